@@ -0,0 +1,21 @@
+"""
+Benchmarks for Flask-CRUDSDB
+
+Each module in this package can be run on its own, e.g.:
+    python -m benchmarks.autokey
+"""
+
+import time
+
+
+def rate(func, count):
+    """
+    Call func count times and measure how many calls per second it sustained.
+    :param func: A callable taking the iteration number as its only argument.
+    :param count: The number of times to call func.
+    :return: Calls per second.
+    """
+    start = time.perf_counter()
+    for i in range(count):
+        func(i)
+    return count / (time.perf_counter() - start)
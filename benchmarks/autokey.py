@@ -0,0 +1,84 @@
+"""
+Insert throughput and memory of FlatDatabase record stores as a table grows.
+
+Compares the monotonic key counter against the old len(sorted(...)) allocation, then the memory footprint of the
+'dict' and 'packed' record stores.
+"""
+
+import sys
+import tracemalloc
+from collection_json import Item, Template
+from flask_crudsdb import Model
+from flask_crudsdb.flatfile import FlatDatabase
+from benchmarks import rate
+
+
+class Row(Model):
+    name = None
+    email = None
+    age = None
+
+    def __init__(self, pk, data, *args, **kwargs):
+        self.pk = pk
+        for datum in data.data:
+            setattr(self, datum.name, datum.value)
+
+    def get_collection_item(self, as_dict=False):
+        return Item(href='/row/%s' % self.pk, data=[
+            {'name': 'name', 'value': self.name},
+            {'name': 'email', 'value': self.email},
+            {'name': 'age', 'value': self.age}
+        ])
+
+
+class SortedKeyDict(FlatDatabase.AutoKeyDict):
+    """Key allocation as it was before the monotonic counter."""
+    def __setitem__(self, key, value):
+        if key == 'next':
+            key = len(sorted(self.data))
+        super().__setitem__(key, value)
+
+    def get_next(self):
+        return len(sorted(self.data))
+
+
+def make_row(i):
+    return Row(i, Template([
+        {'name': 'name', 'value': 'row %d' % i},
+        {'name': 'email', 'value': 'row%d@example.com' % i},
+        {'name': 'age', 'value': i % 100}
+    ]))
+
+
+def insert_rates(table, total, window):
+    rates = []
+    for start in range(0, total, window):
+        rates.append((start + window, rate(lambda i: table.__setitem__('next', make_row(table.get_next())), window)))
+    return rates
+
+
+def footprint(table, total):
+    tracemalloc.start()
+    for i in range(total):
+        table['next'] = make_row(i)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size
+
+
+def main(total=20000, window=2000):
+    print('inserts/second as the table grows')
+    print('{:>10} {:>14} {:>14}'.format('rows', 'sorted', 'counter'))
+    old = insert_rates(SortedKeyDict(), total, window)
+    new = insert_rates(FlatDatabase.AutoKeyDict(), total, window)
+    for (rows, before), (_, after) in zip(old, new):
+        print('{:>10} {:>14.0f} {:>14.0f}'.format(rows, before, after))
+
+    print()
+    print('traced memory for {} rows'.format(total))
+    print('{:>10} {:>14}'.format('dict', footprint(FlatDatabase.AutoKeyDict(), total)))
+    print('{:>10} {:>14}'.format('packed', footprint(FlatDatabase.PackedKeyDict(Row), total)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,150 @@
+"""
+Throughput of the synchronous and asyncio Databases under concurrent clients.
+
+Each client creates an instance, reads it back and reads the first page of the listing, over and over. Synchronous
+databases get one thread per client, as under a threaded WSGI server; asyncio databases get one task per client on a
+single event loop. SQLAlchemy runs against SQLite files, through aiosqlite for the asyncio engine.
+
+    python -m benchmarks.concurrency [clients] [rounds per client]
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+from collection_json import Item
+from flask import Flask
+from sqlalchemy import Column, Integer, String
+from flask_crudsdb import Model
+from flask_crudsdb.flatfile import AsyncFlatDatabase, FlatDatabase
+from flask_crudsdb.sqlalchemy import AsyncSQLAlchemyDatabase, SQLAlchemyDatabase, SQLAlchemyModel
+
+
+class FlatRow(Model):
+    name = None
+
+    def __init__(self, pk, data, *args, **kwargs):
+        self.pk = pk
+        self.update(data)
+
+    def get_collection_item(self, as_dict=False):
+        return Item(href='/row/%s' % self.pk, data=[{'name': 'name', 'value': self.name}])
+
+
+class SQLRow(SQLAlchemyModel, Model):
+    __tablename__ = 'benchmark_row'
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
+
+    def __init__(self, data, *args, **kwargs):
+        self.update(data)
+
+    def get_collection_item(self, as_dict=False):
+        return Item(href='/row/%s' % self.id, data=[{'name': 'name', 'value': self.name}])
+
+
+def make_app(directory, uri_scheme):
+    app = Flask(__name__)
+    app.config.update(
+        API_ROOT='/',
+        FLAT_DATABASE_FILE=os.path.join(directory, 'flat.json'),
+        SQLALCHEMY_DATABASE_URI='{scheme}:///{path}'.format(
+            scheme=uri_scheme, path=os.path.join(directory, 'db.sqlite')
+        )
+    )
+    return app
+
+
+def get_pk(collection):
+    return int(collection.items[0].href.rsplit('/', 1)[-1])
+
+
+def run_threads(database, model, clients, rounds):
+    def client(number):
+        with database.app.app_context():
+            for i in range(rounds):
+                created = database.create(model, [{'name': 'name', 'value': 'client %d row %d' % (number, i)}])
+                database.read(model, get_pk(created))
+                database.read(model, limit=20)
+
+    threads = [threading.Thread(target=client, args=(number,)) for number in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+async def run_tasks(database, model, clients, rounds):
+    async def client(number):
+        for i in range(rounds):
+            created = await database.create(model, [{'name': 'name', 'value': 'client %d row %d' % (number, i)}])
+            await database.read(model, get_pk(created))
+            await database.read(model, limit=20)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client(number) for number in range(clients)])
+    return time.perf_counter() - start
+
+
+def bench_sqlalchemy(clients, rounds):
+    with tempfile.TemporaryDirectory() as directory:
+        database = SQLAlchemyDatabase(make_app(directory, 'sqlite'))
+        database.add_model(SQLRow)
+        SQLAlchemyModel.metadata.create_all(database.database)
+        elapsed = run_threads(database, 'SQLRow', clients, rounds)
+        database.database.dispose()
+    return elapsed
+
+
+def bench_async_sqlalchemy(clients, rounds):
+    async def bench(directory):
+        database = AsyncSQLAlchemyDatabase(make_app(directory, 'sqlite+aiosqlite'))
+        database.add_model(SQLRow)
+        async with database.database.begin() as connection:
+            await connection.run_sync(SQLAlchemyModel.metadata.create_all)
+        try:
+            return await run_tasks(database, 'SQLRow', clients, rounds)
+        finally:
+            await database.close()
+
+    with tempfile.TemporaryDirectory() as directory:
+        return asyncio.run(bench(directory))
+
+
+def bench_flat(clients, rounds):
+    with tempfile.TemporaryDirectory() as directory:
+        database = FlatDatabase(make_app(directory, 'sqlite'))
+        database.add_model(FlatRow)
+        elapsed = run_threads(database, 'FlatRow', clients, rounds)
+        database.close()
+    return elapsed
+
+
+def bench_async_flat(clients, rounds):
+    with tempfile.TemporaryDirectory() as directory:
+        database = AsyncFlatDatabase(make_app(directory, 'sqlite'))
+        database.add_model(FlatRow)
+        elapsed = asyncio.run(run_tasks(database, 'FlatRow', clients, rounds))
+        database.close()
+    return elapsed
+
+
+def main(clients=50, rounds=20):
+    operations = clients * rounds * 3
+    print('{} clients, {} operations each'.format(clients, rounds * 3))
+    print('{:>18} {:>12} {:>12}'.format('', 'seconds', 'ops/second'))
+    for name, bench in (
+            ('sqlalchemy', bench_sqlalchemy),
+            ('async sqlalchemy', bench_async_sqlalchemy),
+            ('flatfile', bench_flat),
+            ('async flatfile', bench_async_flat)):
+        elapsed = bench(clients, rounds)
+        print('{:>18} {:>12.2f} {:>12.0f}'.format(name, elapsed, operations / elapsed))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
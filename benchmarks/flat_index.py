@@ -0,0 +1,106 @@
+"""
+FlatDatabase in-memory indexes against a linear scan.
+
+For each table size, times a filter on one field, the first page of a listing ordered by a field and a text search,
+once on a model without indexes (which has to scan or sort the whole table) and once on a model with an
+InvertedIndex and SortedIndexes.
+"""
+
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collection_json import Item, Template
+from flask import Flask
+from flask_crudsdb import Model
+from flask_crudsdb.flatfile import FlatDatabase
+
+WORDS = ['alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel', 'india', 'juliet', 'kilo', 'lima']
+
+
+class Plain(Model):
+    city = None
+    bio = None
+
+    def __init__(self, pk, data, *args, **kwargs):
+        self.pk = pk
+        for datum in data.data:
+            setattr(self, datum.name, datum.value)
+
+    def get_collection_item(self, as_dict=False):
+        return Item(href='/plain/%s' % self.pk, data=[
+            {'name': 'city', 'value': self.city}, {'name': 'bio', 'value': self.bio}
+        ])
+
+    @staticmethod
+    def get_collection_template(as_dict=False):
+        return Template([{'name': 'city'}, {'name': 'bio'}])
+
+
+class Indexed(Plain):
+    __indexed__ = ['bio']
+    __sorted__ = ['city']
+
+
+def make_database(directory, size):
+    random.seed(size)
+    records = {}
+    for pk in range(size):
+        records[str(pk)] = {'data': [
+            {'name': 'city', 'value': 'city %d' % random.randrange(1000)},
+            {'name': 'bio', 'value': ' '.join(random.sample(WORDS, 3)) + ' %d' % random.randrange(size)}
+        ]}
+    records['next'] = size
+    path = os.path.join(directory, 'db.json')
+    with open(path, 'w') as db_file:
+        json.dump({'Plain': records, 'Indexed': records}, db_file)
+    app = Flask(__name__)
+    app.config.update(FLAT_DATABASE_FILE=path, API_ROOT='/')
+    database = FlatDatabase(app)
+    database.add_model(Plain)
+    start = time.perf_counter()
+    database.add_model(Indexed)
+    return database, time.perf_counter() - start
+
+
+def timed(func, repeat=5):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def scan_search(database, words):
+    words = set(words.split())
+    return [pk for pk, instance in database.database['Plain'].items() if words <= set(instance.bio.split())]
+
+
+def main(*sizes):
+    for size in sizes or (10000, 100000, 1000000):
+        with tempfile.TemporaryDirectory() as directory:
+            database, build = make_database(directory, size)
+            print('{} rows, indexes built in {:.3f}s'.format(size, build))
+            print('{:>22} {:>12} {:>12}'.format('', 'scan (ms)', 'index (ms)'))
+            cases = (
+                ('filter_by city', lambda model: database.read(model, filter_by={'city': 'city 7'})),
+                ('order_by city, 1 page', lambda model: database.read(model, order_by='city', limit=20)),
+            )
+            for name, func in cases:
+                print('{:>22} {:>12.3f} {:>12.3f}'.format(
+                    name, timed(lambda: func('Plain')) * 1000, timed(lambda: func('Indexed')) * 1000
+                ))
+            print('{:>22} {:>12.3f} {:>12.3f}'.format(
+                'search "golf kilo"',
+                timed(lambda: scan_search(database, 'golf kilo')) * 1000,
+                timed(lambda: database.search('Indexed', 'golf kilo')) * 1000
+            ))
+            print()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
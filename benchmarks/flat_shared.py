@@ -0,0 +1,125 @@
+"""
+FlatDatabase shared by several worker processes, with FLAT_DATABASE_SHARED.
+
+Reports three things:
+- The throughput of 1, 2, 4... worker processes over one database, each running its own FlatDatabase, as gunicorn
+  workers would. Each round is a create followed by READS_PER_WRITE reads, alternating between reading an instance by
+  primary key and the first page of the listing. Reads scale with the number of cores; writes do not, as they take
+  turns and every worker replays every write.
+- The cost of reading an instance when nothing changed, in a shared and an unshared database (a stat of the journal).
+- The time a worker takes to catch up after another one wrote some records, by replaying them from the journal,
+  against reloading the whole database.
+
+    python -m benchmarks.flat_shared [rows] [rounds per worker]
+"""
+
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from collection_json import Item
+from flask import Flask
+from flask_crudsdb import Model
+from flask_crudsdb.flatfile import FlatDatabase
+
+WORKERS = (1, 2, 4)
+READS_PER_WRITE = 10
+CATCH_UP_RECORDS = 100
+
+
+class SharedRow(Model):
+    name = None
+
+    def __init__(self, pk, data, *args, **kwargs):
+        self.pk = pk
+        self.update(data)
+
+    def get_collection_item(self, as_dict=False):
+        return Item(href='/row/%s' % self.pk, data=[{'name': 'name', 'value': self.name}])
+
+
+def open_database(path, shared=True):
+    app = Flask(__name__)
+    app.config.update(FLAT_DATABASE_FILE=path, API_ROOT='/', FLAT_DATABASE_JOURNAL=True, FLAT_DATABASE_SHARED=shared)
+    database = FlatDatabase(app)
+    database.add_model(SharedRow)
+    return database
+
+
+def seed(path, rows):
+    database = open_database(path)
+    database.bulk_create('SharedRow', [[{'name': 'name', 'value': 'row %d' % pk}] for pk in range(rows)])
+    database.compact()
+
+
+def worker(path, rounds, start, results):
+    database = open_database(path)
+    start.wait()
+    began = time.perf_counter()
+    for attempt in range(rounds):
+        created = database.create('SharedRow', [{'name': 'name', 'value': 'new row'}])
+        pk = int(created.items[0].href.rsplit('/', 1)[1])
+        for read in range(READS_PER_WRITE):
+            if read % 2:
+                database.read('SharedRow', limit=20)
+            else:
+                database.read('SharedRow', pk - read)
+    results.put(time.perf_counter() - began)
+
+
+def throughput(path, workers, rounds):
+    context = multiprocessing.get_context('fork')
+    start, results = context.Event(), context.Queue()
+    processes = [context.Process(target=worker, args=(path, rounds, start, results)) for index in range(workers)]
+    for process in processes:
+        process.start()
+    start.set()
+    elapsed = max(results.get() for process in processes)
+    for process in processes:
+        process.join()
+    return workers * rounds * (1 + READS_PER_WRITE) / elapsed
+
+
+def read_latency(path, shared, count=10000):
+    database = open_database(path, shared)
+    began = time.perf_counter()
+    for attempt in range(count):
+        database.read('SharedRow', 1)
+    return (time.perf_counter() - began) / count * 1e6
+
+
+def catch_up(path):
+    """
+    :return: A tuple of the seconds a worker takes to replay CATCH_UP_RECORDS records written by another, and to
+    open the database from scratch.
+    """
+    follower, writer = open_database(path), open_database(path)
+    follower.read('SharedRow', 1)
+    writer.bulk_create('SharedRow', [[{'name': 'name', 'value': 'later row'}]] * CATCH_UP_RECORDS)
+    began = time.perf_counter()
+    follower.read('SharedRow', 1)
+    replay = time.perf_counter() - began
+    began = time.perf_counter()
+    open_database(path)
+    return replay, time.perf_counter() - began
+
+
+def main(rows=100000, rounds=500):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'db.json')
+        seed(path, rows)
+        print('{} rows'.format(rows))
+        for workers in WORKERS:
+            print('{:>2} workers {:>10.0f} ops/s'.format(workers, throughput(path, workers, rounds)))
+        print('read by pk: {:.1f} us shared, {:.1f} us unshared'.format(
+            read_latency(path, True), read_latency(path, False)
+        ))
+        replay, reload = catch_up(path)
+        print('catching up on {} records: {:.2f} ms replayed, {:.2f} ms reloading everything'.format(
+            CATCH_UP_RECORDS, replay * 1000, reload * 1000
+        ))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,114 @@
+"""
+FlatDatabase cold start in each storage layout.
+
+Builds a database of several models, stores it as the single json file and migrates it to sharded json and binary
+segments. Then, in a fresh process per layout, times constructing the database and adding every model, then the first
+read of one instance of a single model, as a worker that only serves that model would. Peak memory is that of the
+whole process.
+
+    python -m benchmarks.flat_startup [models] [rows per model]
+"""
+
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from flask import Flask
+from flask_crudsdb import Model
+from flask_crudsdb.flatfile import FlatDatabase, migrate
+
+LAYOUTS = (
+    ('file', 'json', 'dict'),
+    ('sharded', 'json', 'dict'),
+    ('sharded', 'binary', 'dict'),
+    ('sharded', 'binary', 'mapped'),
+)
+
+
+def make_model(number):
+    def __init__(self, pk, data, *args, **kwargs):
+        self.pk = pk
+        self.endpoint = '/model%d/%s' % (number, pk)
+        self.update(data)
+
+    return type('Model%d' % number, (Model,), {
+        '__fields__': ['name', 'email', 'age', 'score'], 'name': None, 'email': None, 'age': None, 'score': None,
+        '__init__': __init__
+    })
+
+
+def seed(path, models, rows):
+    snapshot = {}
+    for number in range(models):
+        records = dict((str(pk), {'data': [
+            {'name': 'name', 'value': 'person %d' % pk}, {'name': 'email', 'value': 'person%d@example.com' % pk},
+            {'name': 'age', 'value': pk % 90}, {'name': 'score', 'value': pk / 7.0}
+        ]}) for pk in range(rows))
+        records['next'] = rows
+        snapshot['Model%d' % number] = records
+    with open(path, 'w') as db_file:
+        json.dump(snapshot, db_file)
+
+
+def peak_rss_kb():
+    # ru_maxrss survives fork and exec on Linux, so a child would report the parent's peak; VmHWM is the process's own.
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def case(path, layout, encoding, store, models):
+    app = Flask(__name__)
+    app.config.update(
+        FLAT_DATABASE_FILE=path, API_ROOT='/', FLAT_DATABASE_LAYOUT=layout, FLAT_DATABASE_ENCODING=encoding,
+        FLAT_DATABASE_RECORD_STORE=store
+    )
+    start = time.perf_counter()
+    database = FlatDatabase(app)
+    for number in range(models):
+        database.add_model(make_model(number))
+    startup = time.perf_counter() - start
+    start = time.perf_counter()
+    database.read('Model0', 1)
+    first_read = time.perf_counter() - start
+    print(json.dumps({
+        'startup': startup, 'first_read': first_read,
+        'peak_rss_kb': peak_rss_kb()
+    }))
+
+
+def main(models=10, rows=20000):
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, 'db.json')
+        seed(source, models, rows)
+        paths = {('file', 'json'): source}
+        for encoding in ('json', 'binary'):
+            paths[('sharded', encoding)] = os.path.join(directory, 'db-%s.idx' % encoding)
+            migrate(source, paths[('sharded', encoding)], encoding=encoding)
+        print('{} models of {} rows'.format(models, rows))
+        print('{:>24} {:>12} {:>12} {:>14}'.format('', 'startup s', 'first read s', 'peak RSS MiB'))
+        for layout, encoding, store in LAYOUTS:
+            output = subprocess.check_output([
+                sys.executable, '-m', 'benchmarks.flat_startup', 'case', paths[(layout, encoding)], layout, encoding,
+                store, str(models)
+            ])
+            result = json.loads(output)
+            print('{:>24} {:>12.3f} {:>12.3f} {:>14.1f}'.format(
+                '%s %s %s' % (layout, encoding, store), result['startup'], result['first_read'],
+                result['peak_rss_kb'] / 1024.0
+            ))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['case']:
+        case(*sys.argv[2:6], int(sys.argv[6]))
+    else:
+        main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,93 @@
+"""
+SQLAlchemyDatabase listings read through the ORM and through the 'core' read mode.
+
+Seeds a SQLite table like benchmarks.suite does, then lists it in both read modes: the whole table at once, streamed,
+in pages of PAGE_SIZE instances, and in pages filtered by a column and ordered by another. Reports rows per second
+(rows listed over the time spent in read, including building the collection) and the speedup of 'core'.
+
+    python -m benchmarks.sql_read [rows] [width]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+from urllib.parse import parse_qs, urlsplit
+from benchmarks.suite import make_app, make_sql_model, seed_sql
+from flask_crudsdb.sqlalchemy import SQLAlchemyDatabase
+
+PAGE_SIZE = 100
+
+
+def list_all(database, model, read_mode):
+    return len(database.read(model, read_mode=read_mode).items)
+
+
+def list_stream(database, model, read_mode):
+    for chunk in database.read(model, stream=True, read_mode=read_mode):
+        pass
+    # the stream is the whole table
+    return None
+
+
+def list_pages(database, model, read_mode, **kwargs):
+    count = 0
+    page = database.read(model, limit=PAGE_SIZE, read_mode=read_mode, **kwargs)
+    while True:
+        count += len(page.items)
+        links = [link for link in page.links or [] if link.rel == 'next']
+        if not links:
+            return count
+        cursor = parse_qs(urlsplit(links[0].href).query)['cursor'][0]
+        page = database.read(model, limit=PAGE_SIZE, cursor=cursor, read_mode=read_mode, **kwargs)
+
+
+LISTINGS = (
+    ('all', list_all),
+    ('stream', list_stream),
+    ('pages', list_pages),
+    ('filtered pages', lambda database, model, read_mode: list_pages(
+        database, model, read_mode, filter_by={'f1': 'value 1'}, order_by='f0'
+    )),
+)
+
+
+def rows_per_second(database, model, listing, read_mode, rows, repeat):
+    """
+    Time the fastest of repeat runs of a listing.
+    :return: The number of rows listed per second.
+    """
+    best = None
+    for attempt in range(repeat):
+        with database.app.app_context():
+            start = time.perf_counter()
+            count = listing(database, model, read_mode)
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return (rows if count is None else count) / best
+
+
+def main(rows=100000, width=8, repeat=3):
+    rng = random.Random(0)
+    model_class = make_sql_model(width)
+    with tempfile.TemporaryDirectory() as directory:
+        uri = 'sqlite:///' + os.path.join(directory, 'db.sqlite')
+        seed_sql(uri, model_class, rows, width, rng)
+        database = SQLAlchemyDatabase(make_app({'SQLALCHEMY_DATABASE_URI': uri}))
+        database.add_model(model_class)
+        # a tenth of the rows share a value of f1, for the filtered listing
+        with database.database.begin() as connection:
+            connection.execute(model_class.__table__.update().where(model_class.id % 10 == 0).values(f1='value 1'))
+        model = model_class.__name__
+        print('{} rows, {} fields'.format(rows, width))
+        print('{:>16} {:>14} {:>14} {:>8}'.format('', 'orm rows/s', 'core rows/s', 'speedup'))
+        for name, listing in LISTINGS:
+            orm = rows_per_second(database, model, listing, 'orm', rows, repeat)
+            core = rows_per_second(database, model, listing, 'core', rows, repeat)
+            print('{:>16} {:>14.0f} {:>14.0f} {:>7.2f}x'.format(name, orm, core, core / orm))
+        database.database.dispose()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
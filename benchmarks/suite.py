@@ -0,0 +1,331 @@
+"""
+Benchmark suite of every backend and CRUDS operation.
+
+Every case (backend, table size, model width) runs in a fresh process, which seeds a table of synthetic rows, opens
+the database on it, then times each operation call by call. A case reports its startup time (opening the database and
+loading or indexing the table), its peak memory and, per operation, throughput and p50/p99 latency.
+
+    python -m benchmarks.suite run [--backends flatfile sqlalchemy] [--rows 1000 100000 1000000] [--widths 4 16]
+        [--operations create read list update search delete] [--count 1000] [--output results.json]
+    python -m benchmarks.suite compare before.json after.json [--threshold 10]
+
+run writes its results as json (to stdout without --output), together with the commit and environment they were
+measured on. compare prints the change of every metric between two result files and exits with status 1 if any
+throughput dropped, or any latency, startup time or peak memory grew, by more than threshold percent.
+
+FlatDatabase is benchmarked with FLAT_DATABASE_JOURNAL on, since rewriting the whole file on every write does not
+finish in reasonable time at a million rows. SQLAlchemyDatabase runs against a SQLite file and searches through a whoosh
+index, built after seeding and reported as reindex time.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from flask import Flask
+from sqlalchemy import Column, Integer, String, create_engine
+from flask_crudsdb import Model
+from flask_crudsdb.flatfile import FlatDatabase
+from flask_crudsdb.sqlalchemy import SQLAlchemyDatabase, SQLAlchemyModel
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+BACKENDS = ('flatfile', 'sqlalchemy')
+OPERATIONS = ('create', 'read', 'list', 'update', 'search', 'delete')
+WORDS = ['alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel', 'india', 'juliet', 'kilo', 'lima']
+PAGE_SIZE = 20
+
+
+def get_fields(width):
+    return ['f%d' % index for index in range(width)]
+
+
+def make_flat_model(width):
+    """
+    Make a FlatDatabase model with width string fields, the first of them indexed for search.
+    """
+    def __init__(self, pk, data, *args, **kwargs):
+        self.pk = pk
+        self.endpoint = '/row/%s' % pk
+        self.update(data)
+
+    attributes = dict((field, None) for field in get_fields(width))
+    attributes.update(__init__=__init__, __indexed__=['f0'])
+    return type('FlatRow%d' % width, (Model,), attributes)
+
+
+def make_sql_model(width):
+    """
+    Make a SQLAlchemyDatabase model with width string columns, the first of them indexed for search.
+    """
+    def __init__(self, data, *args, **kwargs):
+        self.update(data)
+
+    attributes = dict((field, Column(String)) for field in get_fields(width))
+    attributes.update(
+        __tablename__='benchmark_row_%d' % width, __init__=__init__, __indexed__=['f0'], __fields__=get_fields(width),
+        id=Column(Integer, primary_key=True), endpoint=property(lambda self: '/row/%s' % self.id)
+    )
+    return type('SQLRow%d' % width, (SQLAlchemyModel, Model), attributes)
+
+
+def make_values(rng, width):
+    values = [' '.join(rng.sample(WORDS, 2)) + ' %d' % rng.randrange(1000000)]
+    return values + ['value %d' % rng.randrange(1000000) for field in range(width - 1)]
+
+
+def make_data(rng, width):
+    return [{'name': field, 'value': value} for field, value in zip(get_fields(width), make_values(rng, width))]
+
+
+def seed_flat(path, model_class, rows, width, rng):
+    table = {}
+    for pk in range(rows):
+        table[str(pk)] = {'data': make_data(rng, width)}
+    table['next'] = rows
+    with open(path, 'w') as db_file:
+        json.dump({model_class.__name__: table}, db_file)
+
+
+def seed_sql(uri, model_class, rows, width, rng, batch=10000):
+    engine = create_engine(uri)
+    model_class.__table__.create(engine)
+    with engine.begin() as connection:
+        for start in range(0, rows, batch):
+            connection.execute(model_class.__table__.insert(), [
+                dict(zip(get_fields(width), make_values(rng, width))) for pk in range(start, min(rows, start + batch))
+            ])
+    engine.dispose()
+
+
+def make_app(config):
+    app = Flask(__name__)
+    app.config.update(API_ROOT='/')
+    app.config.update(config)
+    return app
+
+
+def percentile(latencies, fraction):
+    return latencies[int(round(fraction * (len(latencies) - 1)))]
+
+
+def time_calls(func, args):
+    """
+    Call func once per item of args, timing every call.
+    :return: A dict of the operation's count, total seconds, throughput and p50/p99 latency in milliseconds.
+    """
+    latencies = []
+    start = time.perf_counter()
+    for arg in args:
+        call_start = time.perf_counter()
+        func(arg)
+        latencies.append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'count': len(latencies),
+        'seconds': elapsed,
+        'ops_per_second': len(latencies) / elapsed if elapsed else None,
+        'p50_ms': percentile(latencies, 0.5) * 1000 if latencies else None,
+        'p99_ms': percentile(latencies, 0.99) * 1000 if latencies else None
+    }
+
+
+def open_database(backend, directory, rows, width, rng):
+    """
+    Seed a table and open the database on it.
+    :return: A tuple of (database, model name, {phase: seconds})
+    """
+    phases = {}
+    if backend == 'flatfile':
+        model_class = make_flat_model(width)
+        path = os.path.join(directory, 'db.json')
+        seed_flat(path, model_class, rows, width, rng)
+        start = time.perf_counter()
+        database = FlatDatabase(make_app({'FLAT_DATABASE_FILE': path, 'FLAT_DATABASE_JOURNAL': True}))
+        database.add_model(model_class)
+        phases['startup_seconds'] = time.perf_counter() - start
+    else:
+        model_class = make_sql_model(width)
+        uri = 'sqlite:///' + os.path.join(directory, 'db.sqlite')
+        seed_sql(uri, model_class, rows, width, rng)
+        start = time.perf_counter()
+        database = SQLAlchemyDatabase(make_app({
+            'SQLALCHEMY_DATABASE_URI': uri, 'WHOOSH_INDEX_DIR': os.path.join(directory, 'whoosh')
+        }))
+        database.add_model(model_class)
+        with database.app.app_context():
+            database.read(model_class.__name__, limit=1)
+        phases['startup_seconds'] = time.perf_counter() - start
+        start = time.perf_counter()
+        with database.app.app_context():
+            database.reindex(model_class.__name__)
+        database.search_index.flush()
+        phases['reindex_seconds'] = time.perf_counter() - start
+    return database, model_class.__name__, phases
+
+
+def run_case(backend, rows, width, operations, count, seed=0):
+    """
+    Benchmark one backend on one table, in this process.
+    :return: A dict of the case's parameters, phases, peak memory and per-operation results.
+    """
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as directory:
+        database, model, phases = open_database(backend, directory, rows, width, rng)
+        # primary keys are 0 based in flatfile tables and 1 based in SQL tables
+        first = 0 if backend == 'flatfile' else 1
+        existing = list(range(first, first + rows))
+        results = {}
+        with database.app.app_context():
+            for operation in operations:
+                if operation == 'create':
+                    results[operation] = time_calls(
+                        lambda data: database.create(model, data), [make_data(rng, width) for i in range(count)]
+                    )
+                    existing.extend(range(first + rows, first + rows + count))
+                elif operation == 'read':
+                    results[operation] = time_calls(
+                        lambda pk: database.read(model, pk), [rng.choice(existing) for i in range(count)]
+                    )
+                elif operation == 'list':
+                    results[operation] = time_calls(
+                        lambda pk: database.read(model, limit=PAGE_SIZE, after=pk),
+                        [rng.choice(existing) for i in range(count)]
+                    )
+                elif operation == 'update':
+                    results[operation] = time_calls(
+                        lambda args: database.update(model, args[1], pk=args[0]),
+                        [(rng.choice(existing), make_data(rng, width)) for i in range(count)]
+                    )
+                elif operation == 'search':
+                    results[operation] = time_calls(
+                        lambda query: database.search(model, query, pagelen=PAGE_SIZE),
+                        [' '.join(rng.sample(WORDS, 2)) for i in range(count)]
+                    )
+                elif operation == 'delete':
+                    rng.shuffle(existing)
+                    pks, existing = existing[:count], existing[count:]
+                    results[operation] = time_calls(lambda pk: database.delete(model, pk=pk), pks)
+        if backend == 'flatfile':
+            database.close()
+        else:
+            database.search_index.close()
+            database.database.dispose()
+    case = {'backend': backend, 'rows': rows, 'width': width, 'count': count, 'operations': results}
+    case.update(phases)
+    case['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource is not None else None
+    return case
+
+
+def get_environment():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    }
+
+
+def run(args):
+    cases = []
+    for backend in args.backends:
+        for rows in args.rows:
+            for width in args.widths:
+                print('{} rows={} width={}'.format(backend, rows, width), file=sys.stderr)
+                output = subprocess.run([
+                    sys.executable, '-m', 'benchmarks.suite', 'case', backend, str(rows), str(width), str(args.count),
+                    '--operations'
+                ] + list(args.operations), check=True, capture_output=True, text=True).stdout
+                cases.append(json.loads(output))
+    results = {'environment': get_environment(), 'cases': cases}
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+
+
+def case(args):
+    json.dump(run_case(args.backend, args.rows, args.width, args.operations, args.count), sys.stdout)
+
+
+def get_metrics(results):
+    """
+    Flatten a result file into {(backend, rows, width, metric): value}, with a flag of whether higher is better.
+    """
+    metrics = {}
+    for result in results['cases']:
+        key = (result['backend'], result['rows'], result['width'])
+        for phase in ('startup_seconds', 'reindex_seconds', 'peak_rss_kb'):
+            if result.get(phase) is not None:
+                metrics[key + (phase,)] = (result[phase], False)
+        for operation, stats in result['operations'].items():
+            metrics[key + (operation + ' ops/s',)] = (stats['ops_per_second'], True)
+            metrics[key + (operation + ' p50 ms',)] = (stats['p50_ms'], False)
+            metrics[key + (operation + ' p99 ms',)] = (stats['p99_ms'], False)
+    return metrics
+
+
+def compare(args):
+    with open(args.before) as before_file, open(args.after) as after_file:
+        before, after = json.load(before_file), json.load(after_file)
+    print('{} -> {}'.format(before['environment'].get('commit'), after['environment'].get('commit')))
+    old, new = get_metrics(before), get_metrics(after)
+    regressions = 0
+    for key in sorted(set(old) & set(new)):
+        (was, higher_is_better), (now, _) = old[key], new[key]
+        if not was or now is None:
+            continue
+        change = (now - was) / was * 100
+        regressed = (-change if higher_is_better else change) > args.threshold
+        regressions += regressed
+        print('{:>10} {:>8} {:>4} {:<18} {:>14.3f} {:>14.3f} {:>+8.1f}%{}'.format(
+            *(key + (was, now, change, '  REGRESSION' if regressed else ''))
+        ))
+    sys.exit(1 if regressions else 0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.suite')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help='run the benchmark suite')
+    run_parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=list(BACKENDS))
+    run_parser.add_argument('--rows', nargs='+', type=int, default=[1000, 100000, 1000000])
+    run_parser.add_argument('--widths', nargs='+', type=int, default=[4, 16])
+    run_parser.add_argument('--operations', nargs='+', choices=OPERATIONS, default=list(OPERATIONS))
+    run_parser.add_argument('--count', type=int, default=1000, help='calls per operation')
+    run_parser.add_argument('--output', help='file to write json results to, default stdout')
+    run_parser.set_defaults(func=run)
+    case_parser = commands.add_parser('case', help='run one case in this process')
+    case_parser.add_argument('backend', choices=BACKENDS)
+    case_parser.add_argument('rows', type=int)
+    case_parser.add_argument('width', type=int)
+    case_parser.add_argument('count', type=int)
+    case_parser.add_argument('--operations', nargs='+', choices=OPERATIONS, default=list(OPERATIONS))
+    case_parser.set_defaults(func=case)
+    compare_parser = commands.add_parser('compare', help='compare two result files')
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    compare_parser.add_argument('--threshold', type=float, default=10.0, help='percent change counted as regression')
+    compare_parser.set_defaults(func=compare)
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
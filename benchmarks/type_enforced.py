@@ -0,0 +1,74 @@
+"""
+Cost of assigning attributes of TypeEnforced classes.
+
+Compares the old __setattr__, which looked every assigned name up on the class and tested it against both enforcer
+types, with the enforcer table compiled at class creation, and with enforcement turned off.
+"""
+
+import sys
+from flask_crudsdb import DuckTypeEnforcer, TypeEnforced, TypeEnforcer
+from benchmarks import rate
+
+
+class LegacyTypeEnforced(object):
+    """TypeEnforced.__setattr__ as it was before the enforcer tables."""
+    def __setattr__(self, key, value):
+        if hasattr(self.__class__, key):
+            type_enforcer = getattr(self.__class__, key)
+            if isinstance(type_enforcer, TypeEnforcer):
+                required_type = type_enforcer.type
+                if not isinstance(value, required_type):
+                    raise TypeError(
+                        '{key} must be of type {type}'.format(key=key, type=required_type.__name__)
+                    )
+            elif isinstance(type_enforcer, DuckTypeEnforcer):
+                for attr in type_enforcer:
+                    if not hasattr(value, attr):
+                        raise TypeError(
+                            '{key} must have attribute {attr}'.format(key=key, attr=attr)
+                        )
+        object.__setattr__(self, key, value)
+
+
+def make_class(base):
+    class Row(base):
+        typed = TypeEnforcer(str)
+        duck = DuckTypeEnforcer('__getitem__', '__setitem__')
+        declared = None
+    return Row
+
+
+class Untrusted(TypeEnforced):
+    pass
+
+
+class Trusted(TypeEnforced):
+    pass
+
+
+Trusted.enforce_types(False)
+
+
+def main(count=500000):
+    classes = [
+        ('legacy', make_class(LegacyTypeEnforced)),
+        ('compiled', make_class(Untrusted)),
+        ('trusted', make_class(Trusted)),
+        ('object', make_class(object))
+    ]
+    print('attribute assignments/second')
+    print('{:>10} {:>14} {:>14} {:>14} {:>14}'.format('', 'undeclared', 'declared', 'typed', 'duck'))
+    for name, cls in classes:
+        row = cls()
+        duck = {}
+        print('{:>10} {:>14.0f} {:>14.0f} {:>14.0f} {:>14.0f}'.format(
+            name,
+            rate(lambda i: setattr(row, 'plain', i), count),
+            rate(lambda i: setattr(row, 'declared', i), count),
+            rate(lambda i: setattr(row, 'typed', 'value'), count),
+            rate(lambda i: setattr(row, 'duck', duck), count)
+        ))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
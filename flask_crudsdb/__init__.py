@@ -4,31 +4,84 @@ CRUDS Database abstraction system
 http://github.com/ievans3024/Flask-CRUDSDB
 """
 
-from flask import Flask
-# TODO: Implement whoosh for search support
-# TODO: Implement celery to schedule whoosh indexing
+import asyncio
+import base64
+import contextvars
+import datetime
+import decimal
+import functools
+import json
+import logging
+import uuid
+from collection_json import Collection, Error, Item, Link, Template
+from flask import Flask, abort, has_request_context, request, stream_with_context
+from operator import methodcaller
+from types import FunctionType, MemberDescriptorType
+from urllib.parse import urlencode
+from werkzeug.exceptions import HTTPException
+from flask_crudsdb.instrumentation import NULL_INSTRUMENTATION, Instrumentation
+from flask_crudsdb.search import SearchIndex, register_commands
 
 
 class TypeEnforced(object):
     """
     If a class attribute is an instance of TypeEnforcer or DuckTypeEnforcer, assigned values for the instance attribute
     must match the type or attributes specified by the respective enforcer.
+
+    The enforcers of each class are collected once, when the class is created, into its __enforcers__ table of
+    {attribute name: required type or DuckTypeEnforcer}; assigning any other attribute costs no more than on a plain
+    object. Call compile_enforcers again after adding or replacing enforcers on an existing class.
+
+    In trusted code, where assigned values are known to be valid, enforce_types(False) turns checking off.
     """
+
+    __slots__ = ()
+    __enforcers__ = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super(TypeEnforced, cls).__init_subclass__(**kwargs)
+        cls.compile_enforcers()
+
+    @classmethod
+    def compile_enforcers(cls):
+        """
+        Build the __enforcers__ table of this class from the enforcers of its class attributes, the most derived class
+        defining an attribute winning, as in normal attribute lookup.
+        :return:
+        """
+        enforcers = {}
+        for klass in reversed(cls.__mro__):
+            for key, value in vars(klass).items():
+                if isinstance(value, TypeEnforcer):
+                    enforcers[key] = value.type
+                elif isinstance(value, DuckTypeEnforcer):
+                    enforcers[key] = value
+                elif not isinstance(value, MemberDescriptorType):
+                    enforcers.pop(key, None)
+        cls.__enforcers__ = enforcers
+
+    @classmethod
+    def enforce_types(cls, enabled=True):
+        """
+        Turn type enforcement on or off for this class and every subclass that does not override it.
+        :param enabled: If false, attributes are assigned without any checks.
+        :return:
+        """
+        if enabled:
+            if cls.__dict__.get('__setattr__') is object.__setattr__:
+                del cls.__setattr__
+            if cls.__setattr__ is object.__setattr__:
+                cls.__setattr__ = TypeEnforced.__setattr__
+        else:
+            cls.__setattr__ = object.__setattr__
+
     def __setattr__(self, key, value):
-        if hasattr(self.__class__, key):
-            type_enforcer = getattr(self.__class__, key)
-            if isinstance(type_enforcer, TypeEnforcer):
-                required_type = type_enforcer.type
-                if not isinstance(value, required_type):
-                    raise TypeError(
-                        '{key} must be of type {type}'.format(key=key, type=required_type.__name__)
-                    )
-            elif isinstance(type_enforcer, DuckTypeEnforcer):
-                for attr in type_enforcer:
-                    if not hasattr(value, attr):
-                        raise TypeError(
-                            '{key} must have attribute {attr}'.format(key=key, attr=attr)
-                        )
+        enforcer = self.__enforcers__.get(key)
+        if enforcer is not None:
+            if enforcer.__class__ is DuckTypeEnforcer:
+                enforcer.check(key, value)
+            elif not isinstance(value, enforcer):
+                raise TypeError('{key} must be of type {type}'.format(key=key, type=enforcer.__name__))
         object.__setattr__(self, key, value)
 
 
@@ -40,6 +93,13 @@ class DuckTypeEnforcer(tuple):
     def __new__(cls, *args, **kwargs):
         return super(DuckTypeEnforcer, cls).__new__(cls, args)
 
+    def check(self, key, value):
+        for attr in self:
+            if not hasattr(value, attr):
+                raise TypeError(
+                    '{key} must have attribute {attr}'.format(key=key, attr=attr)
+                )
+
 
 class TypeEnforcer(object):
     """
@@ -48,7 +108,7 @@ class TypeEnforcer(object):
     def __init__(self, cls):
         if not isinstance(cls, type):
             raise TypeError('cls must be a type or class')
-        self.type = cls
+        object.__setattr__(self, 'type', cls)
 
     def __setattr__(self, key, value):
         raise NotImplementedError()
@@ -70,6 +130,22 @@ class Database(TypeEnforced, object):
     models = DuckTypeEnforcer("__getitem__", "__setitem__")
     database = TypeEnforcer(object)
 
+    # Where backends report the phases of operations, see flask_crudsdb.instrumentation.
+    instrumentation = NULL_INSTRUMENTATION
+
+    # Cursor key values JSON has no type for, as (tag, type, encode, decode): encode_cursor stores them as
+    # {"$type": tag, "value": encode(value)} so that decode_cursor gives back values of the same type to seek with.
+    cursor_types = (
+        ('datetime', datetime.datetime, datetime.datetime.isoformat, datetime.datetime.fromisoformat),
+        ('date', datetime.date, datetime.date.isoformat, datetime.date.fromisoformat),
+        ('time', datetime.time, datetime.time.isoformat, datetime.time.fromisoformat),
+        ('timedelta', datetime.timedelta, datetime.timedelta.total_seconds,
+         lambda seconds: datetime.timedelta(seconds=seconds)),
+        ('decimal', decimal.Decimal, str, decimal.Decimal),
+        ('uuid', uuid.UUID, str, uuid.UUID),
+        ('bytes', bytes, lambda value: base64.b64encode(value).decode('ascii'), base64.b64decode)
+    )
+
     def __init__(self, app, *args, **kwargs):
         """
         Database Constructor
@@ -87,10 +163,32 @@ class Database(TypeEnforced, object):
         """
         self.app = app
         self.models = {}
+        self.search_index = None
+        # API_ENFORCE_TYPES = False trusts the models this Database adds, see add_model.
+        self.trusted = not app.config.get('API_ENFORCE_TYPES', True)
+        if app.config.get('WHOOSH_INDEX_DIR'):
+            self.search_index = SearchIndex(app)
+            register_commands(app, self)
+        if app.config.get('API_INSTRUMENTATION'):
+            self.instrument(Instrumentation(app))
+            if app.config.get('API_METRICS_ENDPOINT'):
+                self.instrumentation.register_endpoint(app, app.config['API_METRICS_ENDPOINT'])
+
+    def instrument(self, instrumentation):
+        """
+        Time the operations of this Database, see flask_crudsdb.instrumentation.
+        Several Databases may share one Instrumentation.
+        :param instrumentation: A flask_crudsdb.instrumentation.Instrumentation
+        :return:
+        """
+        instrumentation.instrument(self)
 
     def add_model(self, model_class):
         """
         Add a model class to the instance models.
+        With API_ENFORCE_TYPES = False, type enforcement is turned off for the model class (see
+        TypeEnforced.enforce_types.) Classes are shared by the whole process, so this also applies wherever else the
+        class is used, but not to other model classes.
         :param model_class: The model class to add
         :type model_class: database.Database.Model
         :raises TypeError: If model_class is not a subclass of flask_crudsdb.Model
@@ -103,6 +201,8 @@ class Database(TypeEnforced, object):
                 raise NotImplementedError(
                     self.__class__.__name__ + ' does not have a "models" attribute or it is not subscriptable.'
                 )
+            if self.trusted:
+                model_class.enforce_types(False)
         else:
             raise TypeError('model_class must be a subclass of %s' % Model.__name__)
 
@@ -118,15 +218,198 @@ class Database(TypeEnforced, object):
         """
         raise NotImplementedError()
 
-    def read(self, model, *args, **kwargs):
+    def read(self, model, pk=None, *args, limit=None, cursor=None, after=None, order_by=None, filter_by=None,
+             stream=False, **kwargs):
         """
         Get information representing a model instance.
+        When pk is None, all instances are listed. Listings should be paginated with keyset (seek) pagination when a
+        limit is given or API_PAGE_LIMIT is configured: a page is found by seeking past the order_by value and primary
+        key of the last item seen, so its cost does not depend on how deep the client has paged. The links of the
+        returned collection should carry "next" and "prev" hrefs (see get_page_links.)
         :param model: The model to attempt to read from, using information in args/kwargs to specify what is requested.
+        :param pk: The primary key of the instance to read, or None to list instances.
+        :param limit: The maximum number of instances to list.
+        :param cursor: An opaque cursor taken from a "next" or "prev" link of a previous page.
+        :param after: A primary key, list the instances that come after it.
+        :param order_by: The name of the attribute to order listed instances by, ties are broken by primary key.
+        :param filter_by: A dict of {attribute name: value}, only list instances whose attributes equal those values.
+        :param stream: If true, return a generator of Collection+JSON text instead of a Collection (see
+        stream_collection.) Errors found before the first chunk is produced are still raised by read itself.
         :return: A collection_json.Collection instance containing information about the requested resource or what
         happened (including errors.)
         """
         raise NotImplementedError()
 
+    def stream_collection(self, instances, template=None, links=None, get_item=None):
+        """
+        Write a Collection+JSON document piece by piece, e.g. for a flask streaming Response:
+            return Response(database.read('Model', stream=True), mimetype='application/vnd.collection+json')
+        Only one item is serialized at a time, so memory use does not grow with the number of instances. Within a
+        request the generator keeps the request context alive until it is exhausted.
+        :param instances: An iterable of model instances, consumed lazily.
+        :param template: A collection_json.Template to include, if any.
+        :param links: A list of collection_json.Link instances to include, if any.
+        :param get_item: A function building the collection_json.Item of each of instances, defaults to calling their
+        get_collection_item.
+        :return: A generator of str chunks.
+        """
+        if get_item is None:
+            get_item = methodcaller('get_collection_item')
+        chunk_size = self.app.config.get('API_STREAM_CHUNK_SIZE', 16384)
+        href = self.app.config.get('API_ROOT')
+
+        def generate():
+            chunk = '{"collection": {"version": "1.0", "href": ' + json.dumps(href) + ', "items": ['
+            separator = ''
+            for instance in instances:
+                chunk += separator + json.dumps(get_item(instance).to_dict())
+                separator = ', '
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = ''
+            chunk += ']'
+            if links:
+                chunk += ', "links": ' + json.dumps([link.to_dict() for link in links])
+            if template is not None:
+                chunk += ', ' + json.dumps(template.to_dict())[1:-1]
+            yield chunk + '}}'
+
+        if has_request_context():
+            return stream_with_context(generate())
+        return generate()
+
+    def get_page_args(self, limit=None, cursor=None):
+        """
+        Parse the pagination arguments of a read.
+        Aborts with HTTP 400 if either argument is malformed.
+        :param limit: The requested page size, falls back to API_PAGE_LIMIT. Capped at API_MAX_PAGE_LIMIT if set.
+        :param cursor: An opaque cursor made by encode_cursor.
+        :return: A tuple of (limit, keys, direction) where keys is the list of key values to seek past (or None) and
+        direction is "next" or "prev".
+        """
+        if limit is None:
+            limit = self.app.config.get('API_PAGE_LIMIT')
+        if limit is not None:
+            try:
+                limit = int(limit)
+            except (TypeError, ValueError):
+                abort(400)
+            if limit < 1:
+                abort(400)
+            if self.app.config.get('API_MAX_PAGE_LIMIT'):
+                limit = min(limit, self.app.config['API_MAX_PAGE_LIMIT'])
+        if cursor is None:
+            return limit, None, 'next'
+        try:
+            return limit, *self.decode_cursor(cursor)
+        except (TypeError, ValueError, KeyError):
+            abort(400)
+
+    @classmethod
+    def encode_cursor(cls, keys, direction='next'):
+        """
+        Encode the key values of an item as an opaque pagination cursor.
+        :param keys: A list of key values, e.g., [order_by value, primary key]. Values of the cursor_types keep their
+        type, any other value JSON cannot hold is stored as its str.
+        :param direction: "next" to seek to the items after keys, "prev" to seek to the items before them.
+        :return: A url-safe string.
+        """
+        cursor = json.dumps({'k': keys, 'd': direction}, default=cls.encode_cursor_value, separators=(',', ':'))
+        return base64.urlsafe_b64encode(cursor.encode('utf-8')).decode('ascii').rstrip('=')
+
+    @classmethod
+    def decode_cursor(cls, cursor):
+        """
+        Decode a cursor made by encode_cursor.
+        :param cursor: The cursor to decode.
+        :raises ValueError: If cursor is malformed.
+        :return: A tuple of (keys, direction)
+        """
+        cursor = json.loads(
+            base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8'),
+            object_hook=cls.decode_cursor_value
+        )
+        if not isinstance(cursor['k'], list) or cursor['d'] not in ('next', 'prev'):
+            raise ValueError('malformed cursor')
+        return cursor['k'], cursor['d']
+
+    @classmethod
+    def encode_cursor_value(cls, value):
+        for tag, value_type, encode, decode in cls.cursor_types:
+            if isinstance(value, value_type):
+                return {'$type': tag, 'value': encode(value)}
+        return str(value)
+
+    @classmethod
+    def decode_cursor_value(cls, value):
+        if set(value) != {'$type', 'value'}:
+            return value
+        for tag, value_type, encode, decode in cls.cursor_types:
+            if tag == value['$type']:
+                try:
+                    return decode(value['value'])
+                except (TypeError, ArithmeticError) as error:
+                    # e.g. a number where a date belongs, or a malformed decimal
+                    raise ValueError('malformed cursor') from error
+        raise ValueError('malformed cursor')
+
+    @staticmethod
+    def get_page(rows, limit, keys, direction):
+        """
+        Trim the rows fetched by a seek to one page.
+        Backends fetch up to limit + 1 rows in the direction of travel, the extra row only tells whether there is
+        another page beyond this one.
+        :param rows: The fetched rows, in the direction of travel.
+        :param limit: The page size, or None for an unlimited page.
+        :param keys: The keys that were sought past, or None for the first page.
+        :param direction: "next" or "prev"
+        :return: A tuple of (rows, has_prev, has_next) with rows in ascending order.
+        """
+        more = limit is not None and len(rows) > limit
+        rows = list(rows[:limit])
+        if direction == 'prev':
+            rows.reverse()
+            return rows, more, True
+        return rows, keys is not None, more
+
+    def get_page_href(self, **params):
+        """
+        Build the href of another page of the current listing.
+        Inside a request, the current url and query arguments are reused, otherwise API_ROOT (or no path, if it is not
+        set) is used.
+        :param params: Query arguments to set.
+        :return: The href, as a string.
+        """
+        if has_request_context():
+            href = request.base_url
+            args = request.args.to_dict()
+            args.pop('after', None)
+        else:
+            href = self.app.config.get('API_ROOT') or ''
+            args = {}
+        args.update((key, value) for key, value in params.items() if value is not None)
+        return href + '?' + urlencode(args)
+
+    def get_page_links(self, limit, first=None, last=None, order_by=None):
+        """
+        Build Collection+JSON links to the pages around the current one.
+        :param limit: The page size.
+        :param first: Key values of the first item on the page, or None if there is no previous page.
+        :param last: Key values of the last item on the page, or None if there is no next page.
+        :param order_by: The order_by argument of the listing, if any.
+        :return: A list of collection_json.Link instances.
+        """
+        links = []
+        if last is not None:
+            links.append(Link(
+                self.get_page_href(limit=limit, order_by=order_by, cursor=self.encode_cursor(last, 'next')), 'next'
+            ))
+        if first is not None:
+            links.append(Link(
+                self.get_page_href(limit=limit, order_by=order_by, cursor=self.encode_cursor(first, 'prev')), 'prev'
+            ))
+        return links
+
     def update(self, model, data, *args, **kwargs):
         """
         Update information for an existing model instance.
@@ -148,15 +431,327 @@ class Database(TypeEnforced, object):
         """
         raise NotImplementedError()
 
-    def search(self, model, data, *args, **kwargs):
+    def bulk_create(self, model, data, *args, **kwargs):
+        """
+        Create many new model instances.
+        This implementation calls create once per item. Databases should override it to write every instance in a
+        single transaction or flush.
+        :param model: The model to create new instances of.
+        :param data: A list of Collection+JSON data arrays, one per instance.
+        :return: A collection_json.Collection instance containing the created instances. Items that failed are reported
+        in its error (see get_bulk_error.)
+        """
+        return self.run_bulk(lambda item: self.create(model, item, *args, **kwargs), data)
+
+    def bulk_update(self, model, data, *args, **kwargs):
+        """
+        Update many existing model instances.
+        This implementation calls update once per item. Databases should override it to write every instance in a
+        single transaction or flush.
+        :param model: The model to update instances of.
+        :param data: A dict of {primary key: Collection+JSON data array}, or a list of (primary key, data array) pairs.
+        :return: A collection_json.Collection instance containing the updated instances. Items that failed are reported
+        in its error (see get_bulk_error.)
+        """
+        return self.run_bulk(
+            lambda item: self.update(model, item[1], *args, pk=item[0], **kwargs), self.get_bulk_updates(data)
+        )
+
+    def bulk_delete(self, model, pks, *args, **kwargs):
+        """
+        Delete many model instances.
+        This implementation calls delete once per primary key. Databases should override it to delete every instance in
+        a single transaction or flush.
+        :param model: The model to delete instances of.
+        :param pks: A list of primary keys.
+        :return: A collection_json.Collection instance, primary keys that could not be deleted are reported in its error
+        (see get_bulk_error.)
+        """
+        return self.run_bulk(lambda pk: self.delete(model, *args, pk=pk, **kwargs), pks)
+
+    @staticmethod
+    def get_bulk_updates(data):
+        if isinstance(data, dict):
+            return list(data.items())
+        return [tuple(item) for item in data]
+
+    def run_bulk(self, operation, items):
+        """
+        Run a single-item operation for each item, collecting per-item errors instead of stopping at the first one.
+        :param operation: A callable taking one item and returning a Collection (or None.)
+        :param items: The items to run operation on.
+        :return: A collection_json.Collection instance with every returned item, and an error if any item failed.
+        """
+        results, errors = [], []
+        for index, item in enumerate(items):
+            try:
+                result = operation(item)
+            except (DatabaseError, HTTPException) as error:
+                errors.append(self.get_item_error(index, error))
+            else:
+                if result is not None:
+                    results.extend(result.items)
+        return Collection(href=self.app.config.get('API_ROOT'), items=results, error=self.get_bulk_error(errors))
+
+    @staticmethod
+    def get_item_error(index, error):
+        """
+        Describe why one item of a bulk operation failed.
+        :param index: The position of the item in the bulk operation.
+        :param error: The DatabaseError or HTTPException the item raised.
+        :return: A tuple of (index, code, message)
+        """
+        if isinstance(error, HTTPException):
+            return index, error.code, error.description
+        return index, 400, str(error)
+
+    @staticmethod
+    def get_bulk_error(errors):
+        """
+        Build the Collection+JSON error of a bulk operation.
+        The message holds one line per failed item, e.g. "item 3: name not found in provided data".
+        :param errors: A list of (index, code, message) tuples, as made by get_item_error.
+        :return: A collection_json.Error, or None if errors is empty.
+        """
+        if not errors:
+            return None
+        return Error(
+            code=str(errors[0][1]),
+            title='{count} item(s) failed'.format(count=len(errors)),
+            message='\n'.join('item {0}: {2}'.format(*error) for error in errors)
+        )
+
+    def search(self, model, data, *args, page=1, pagelen=None, **kwargs):
         """
         Search a model for instances that might be relevant to a query.
         :param model: The model to search through instances of.
+        :param data: A query string, or a Collection+JSON data array (or dict) of field names and values to match.
+        :param page: The page of results to return, starting at 1.
+        :param pagelen: The number of results per page, defaults to API_PAGE_LIMIT or 20.
         :return: A collection_json.Collection instance containing information about the results from the query, or about
         what happened (including errors.)
         """
         raise NotImplementedError()
 
+    def get_search_args(self, data, page=1, pagelen=None):
+        """
+        Parse the arguments of a search.
+        Aborts with HTTP 400 if any of them is malformed.
+        :param data: See search.
+        :param page: See search.
+        :param pagelen: See search.
+        :return: A tuple of (query, page, pagelen) where query is a string or a dict of {field: value}.
+        """
+        if isinstance(data, (list, tuple)):
+            try:
+                data = dict((datum['name'], datum['value']) for datum in data)
+            except (TypeError, KeyError):
+                abort(400)
+        elif not isinstance(data, (str, dict)):
+            abort(400)
+        try:
+            page = int(page)
+            pagelen = int(pagelen or self.app.config.get('API_PAGE_LIMIT') or 20)
+        except (TypeError, ValueError):
+            abort(400)
+        if page < 1 or pagelen < 1:
+            abort(400)
+        return data, page, pagelen
+
+    def get_search_links(self, page, pagelen, total):
+        """
+        Build Collection+JSON links to the pages of search results around the current one.
+        :param page: The current page, starting at 1.
+        :param pagelen: The number of results per page.
+        :param total: The total number of results.
+        :return: A list of collection_json.Link instances.
+        """
+        links = []
+        if page * pagelen < total:
+            links.append(Link(self.get_page_href(page=page + 1, pagelen=pagelen), 'next'))
+        if page > 1:
+            links.append(Link(self.get_page_href(page=page - 1, pagelen=pagelen), 'prev'))
+        return links
+
+    def search_index_page(self, model, data, page=1, pagelen=None):
+        """
+        Run a search against the whoosh index of a model.
+        Aborts with HTTP 501 if WHOOSH_INDEX_DIR is not configured, or 400 if the query or page is malformed.
+        :param model: The model name to search instances of.
+        :param data: See search.
+        :param page: See search.
+        :param pagelen: See search.
+        :return: A tuple of (pks, links) with pks in order of relevance.
+        """
+        if self.search_index is None:
+            abort(501)
+        query, page, pagelen = self.get_search_args(data, page, pagelen)
+        try:
+            with self.instrumentation.phase('query'):
+                pks, total = self.search_index.search(self.models[model], query, page=page, pagelen=pagelen)
+        except ValueError:
+            abort(400)
+        return pks, self.get_search_links(page, pagelen, total)
+
+    def iter_instances(self, model):
+        """
+        Iterate over every instance of a model, e.g. to rebuild its search index.
+        All Databases should implement this method.
+        :param model: The model name to iterate over instances of.
+        :return: An iterable of (pk, instance) pairs.
+        """
+        raise NotImplementedError()
+
+    def index_instance(self, model, pk, instance):
+        """
+        Add or replace an instance in the search index, if there is one.
+        :param model: The model name of the instance.
+        :param pk: The primary key of the instance.
+        :param instance: The instance.
+        :return:
+        """
+        if self.search_index is not None:
+            with self.instrumentation.phase('index'):
+                self.search_index.add(self.models[model], pk, instance)
+
+    def unindex_instance(self, model, pk):
+        """
+        Remove an instance from the search index, if there is one.
+        :param model: The model name of the instance.
+        :param pk: The primary key of the instance.
+        :return:
+        """
+        if self.search_index is not None:
+            with self.instrumentation.phase('index'):
+                self.search_index.remove(self.models[model], pk)
+
+    def reindex(self, model):
+        """
+        Rebuild the search index of a model from every instance in the database.
+        :param model: The model name to reindex.
+        :raises DatabaseError: If WHOOSH_INDEX_DIR is not configured.
+        :return: The number of instances indexed.
+        """
+        if self.search_index is None:
+            raise DatabaseError('WHOOSH_INDEX_DIR is not configured')
+        return self.search_index.reindex(self.models[model], self.iter_instances(model))
+
+
+class AsyncDatabase(Database):
+    """
+    A base class for asyncio database wrappers.
+
+    The same interface as Database, except that create, read, update, delete, search, the bulk operations and reindex
+    are coroutines, for use from async views without blocking the event loop. iter_instances is an async iterator.
+    Streaming reads are not supported.
+
+    The synchronous Database classes are unaffected; an application picks one or the other.
+    """
+
+    # The concurrent.futures.Executor that run_in_executor uses, None for the event loop's default executor.
+    executor = None
+
+    async def run_in_executor(self, func, *args, **kwargs):
+        """
+        Run a blocking call in the executor, keeping the caller's context (e.g. the flask app context.)
+        :param func: The callable to run.
+        :return: What func returned.
+        """
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, functools.partial(context.run, func, *args, **kwargs)
+        )
+
+    async def create(self, model, data, *args, **kwargs):
+        """
+        Create a new model instance, see Database.create.
+        """
+        raise NotImplementedError()
+
+    async def read(self, model, pk=None, *args, limit=None, cursor=None, after=None, order_by=None, filter_by=None,
+                   **kwargs):
+        """
+        Read a model instance or a listing of model instances, see Database.read.
+        """
+        raise NotImplementedError()
+
+    async def update(self, model, data, *args, **kwargs):
+        """
+        Update information for an existing model instance, see Database.update.
+        """
+        raise NotImplementedError()
+
+    async def delete(self, model, *args, **kwargs):
+        """
+        Delete an instance of a model, see Database.delete.
+        """
+        raise NotImplementedError()
+
+    async def bulk_create(self, model, data, *args, **kwargs):
+        """
+        Create many new model instances, see Database.bulk_create.
+        This implementation awaits create once per item.
+        """
+        return await self.run_bulk_async(lambda item: self.create(model, item, *args, **kwargs), data)
+
+    async def bulk_update(self, model, data, *args, **kwargs):
+        """
+        Update many existing model instances, see Database.bulk_update.
+        This implementation awaits update once per item.
+        """
+        return await self.run_bulk_async(
+            lambda item: self.update(model, item[1], *args, pk=item[0], **kwargs), self.get_bulk_updates(data)
+        )
+
+    async def bulk_delete(self, model, pks, *args, **kwargs):
+        """
+        Delete many model instances, see Database.bulk_delete.
+        This implementation awaits delete once per primary key.
+        """
+        return await self.run_bulk_async(lambda pk: self.delete(model, *args, pk=pk, **kwargs), pks)
+
+    async def run_bulk_async(self, operation, items):
+        """
+        Await a single-item operation for each item, see Database.run_bulk.
+        :param operation: A callable taking one item and returning an awaitable of a Collection (or None.)
+        :param items: The items to run operation on.
+        :return: A collection_json.Collection instance with every returned item, and an error if any item failed.
+        """
+        results, errors = [], []
+        for index, item in enumerate(items):
+            try:
+                result = await operation(item)
+            except (DatabaseError, HTTPException) as error:
+                errors.append(self.get_item_error(index, error))
+            else:
+                if result is not None:
+                    results.extend(result.items)
+        return Collection(href=self.app.config.get('API_ROOT'), items=results, error=self.get_bulk_error(errors))
+
+    async def search(self, model, data, *args, page=1, pagelen=None, **kwargs):
+        """
+        Search a model for instances that might be relevant to a query, see Database.search.
+        """
+        raise NotImplementedError()
+
+    async def iter_instances(self, model):
+        """
+        Iterate over every instance of a model, see Database.iter_instances.
+        :param model: The model name to iterate over instances of.
+        :return: An async iterable of (pk, instance) pairs.
+        """
+        raise NotImplementedError()
+        yield
+
+    async def reindex(self, model):
+        """
+        Rebuild the search index of a model from every instance in the database, see Database.reindex.
+        """
+        if self.search_index is None:
+            raise DatabaseError('WHOOSH_INDEX_DIR is not configured')
+        instances = [pair async for pair in self.iter_instances(model)]
+        return await self.run_in_executor(self.search_index.reindex, self.models[model], instances)
+
 
 class DatabaseError(BaseException):
     """
@@ -180,14 +775,28 @@ class Model(TypeEnforced, object):
 
     __indexed__ attribute is a list of attribute names as strings that are indexed for searching through whoosh.
 
+    __sorted__ attribute is a list of attribute names as strings that databases without their own query engine (e.g.
+    flatfile) keep sorted secondary indexes of, for filtering and ordering listings by those attributes.
+
+    __fields__ attribute is a list of attribute names as strings that hold the model's data. When it is not set, every
+    public class attribute that is not a method or property is a field. See ModelSchema.
+
     When an information model inherits from this and another class, this class should be to the right of all other
     inherited classes, e.g:
         class SomeMultiInheritModel(SomeOtherModel, Model):
             pass
     """
 
+    __slots__ = ()
     __required__ = TypeEnforcer(list)
     __indexed__ = TypeEnforcer(list)
+    __sorted__ = TypeEnforcer(list)
+    __fields__ = TypeEnforcer(list)
+    __schema__ = None
+
+    def __init_subclass__(cls, **kwargs):
+        super(Model, cls).__init_subclass__(**kwargs)
+        cls.__schema__ = ModelSchema(cls)
 
     def __init__(self, data, *args, **kwargs):
         """
@@ -204,43 +813,189 @@ class Model(TypeEnforced, object):
     def get_collection_item(self, as_dict=False):
         """
         Get a collection_json.Item representation of this model
+        This implementation lists every field of the model's schema, with the model's 'endpoint' as href.
         :param as_dict: If true, return a dict-like object instead of a collection_json.Item instance.
         :return: A collection_json.Item instance by default, a dict-like object if as_dict is true.
         """
-        raise NotImplementedError()
+        item = self.__schema__.get_item(self)
+        if as_dict:
+            return item.to_dict()
+        return item
 
-    @staticmethod
-    def get_template(as_dict=False):
+    @classmethod
+    def get_row_endpoint(cls, row):
+        """
+        Get the 'endpoint' of the instance a database row holds, for databases that build items straight from rows
+        without loading instances (e.g. SQLAlchemyDatabase with SQLALCHEMY_READ_MODE 'core').
+        This implementation evaluates the class's 'endpoint' property against the row, which has the model's fields and
+        primary key as attributes. Models whose endpoint needs anything else should override it.
+        :param row: The row, a named tuple of the model's fields followed by its primary key.
+        :return: The href of the row's item.
+        """
+        endpoint = getattr(cls, 'endpoint', None)
+        if isinstance(endpoint, property):
+            return endpoint.fget(row)
+        return getattr(row, 'endpoint', None)
+
+    @classmethod
+    def get_template(cls, as_dict=False):
         """
         Get an empty collection_json.Template for this model
+        This implementation lists every field of the model's schema.
         :param as_dict: If true, return a dict-like object instead of a collection_json.Template instance.
         :return: A collection_json.Template instance by default, a dict-like object if as_dict is true
         """
-        raise NotImplementedError()
+        template = cls.__schema__.get_template()
+        if as_dict:
+            return template.to_dict()
+        return template
+
+    @classmethod
+    def get_collection_template(cls, as_dict=False):
+        """
+        Get the collection_json.Template that Databases attach to collections of this model, see get_template.
+        """
+        return cls.get_template(as_dict=as_dict)
 
     def update(self, data):
         """
         Update this model instance's data
         :param data: The information to update the model with.
         :type data: collection_json.Template
+        :raises ModelError: If a required field is missing from data. Nothing is updated in that case.
+        :return: A list of the names in data that are not fields of this model, which are ignored.
+        """
+        return self.__schema__.update(self, data)
+
+
+class ModelSchema(object):
+    """
+    The fields of a Model class, collected once when the class is created and available as its __schema__.
+
+    Fields are the names listed in the class's __fields__ or, without it, the public class attributes of the model and
+    its Model bases that are not methods, properties, nested classes or primary key columns, in the order they are
+    declared. Columns (of SQLAlchemy models) are never taken as default values.
+    """
+
+    def __init__(self, model_class):
+        """
+        ModelSchema Constructor
+        :param model_class: The Model subclass to describe.
         :return:
         """
-        if isinstance(self.__required__, (TypeEnforcer, DuckTypeEnforcer)):
-            required = []
-        else:
-            required = self.__required__
+        self.model_class = model_class
+        fields = {}
+        for klass in reversed(model_class.__mro__):
+            if not issubclass(klass, Model) or klass is Model:
+                continue
+            for key, value in vars(klass).items():
+                if key.startswith('_') or isinstance(value, MemberDescriptorType):
+                    continue
+                column = self.get_column(value)
+                if isinstance(value, (FunctionType, classmethod, staticmethod, property, type)) or \
+                        getattr(column, 'primary_key', False):
+                    fields.pop(key, None)
+                else:
+                    fields[key] = value
+        if isinstance(model_class.__fields__, list):
+            fields = dict((key, fields.get(key)) for key in model_class.__fields__)
+        self.fields = tuple(fields)
+        self.field_set = frozenset(self.fields)
+        self.defaults = dict(
+            (key, value) for key, value in fields.items()
+            if not isinstance(value, (TypeEnforcer, DuckTypeEnforcer)) and not hasattr(type(value), '__get__') and
+            self.get_column(value) is None
+        )
+        self.required = tuple(self.get_list(model_class.__required__))
+        self.indexed = tuple(self.get_list(model_class.__indexed__))
 
-        for attr in required:
-            if not data.data.find(attr):
-                raise ModelError('%s not found in provided data but is a attr attribute.' % attr)
+    @staticmethod
+    def get_column(value):
+        """
+        Get the column a class attribute declares: a Column, mapped_column or the mapped attribute of an ORM model.
+        :return: The column, or None if value is not one of those.
+        """
+        get_clause_element = getattr(value, '__clause_element__', None)
+        if not callable(get_clause_element):
+            return None
+        return get_clause_element()
 
+    @staticmethod
+    def get_list(value):
+        if isinstance(value, list):
+            return value
+        return []
+
+    def update(self, instance, data):
+        """
+        Validate data and assign its fields to instance, in one pass over data.
+        :param instance: The model instance to update.
+        :param data: The information to update the instance with.
+        :type data: collection_json.Template
+        :raises ModelError: If a required field is missing from data.
+        :return: A list of the names in data that are not fields, which are logged and ignored.
+        """
+        values = {}
+        unknown = []
         for prop in data.data:
-            if hasattr(self.__class__, prop.name):
-                setattr(self, prop.name, prop.value)
+            if prop.name in self.field_set:
+                values[prop.name] = prop.value
             else:
-                print(
-                    'attribute {key} not found in class {type}'.format(key=prop.name, type=self.__class__.__name__)
-                )
+                unknown.append(prop.name)
+        for attr in self.required:
+            if attr not in values:
+                raise ModelError('%s not found in provided data but is a attr attribute.' % attr)
+        for key, value in values.items():
+            setattr(instance, key, value)
+        if unknown:
+            logging.getLogger(__name__).warning(
+                'attributes %s not found in class %s', ', '.join(unknown), self.model_class.__name__
+            )
+        return unknown
+
+    def get_item(self, instance):
+        return Item(
+            href=getattr(instance, 'endpoint', None),
+            data=[{'name': key, 'value': getattr(instance, key, None)} for key in self.fields]
+        )
+
+    def get_row_item(self, row):
+        """
+        Build the collection_json.Item of an instance from a row whose leading columns are the fields, in order.
+        :param row: A named tuple of the fields, then any other columns the model's get_row_endpoint needs.
+        :return: The same Item as get_item of the instance the row holds.
+        """
+        return Item(
+            href=self.model_class.get_row_endpoint(row),
+            data=[{'name': key, 'value': value} for key, value in zip(self.fields, row)]
+        )
+
+    def get_template(self):
+        return Template(data=[{'name': key, 'value': ''} for key in self.fields])
+
+    def slotted_class(self, *extra):
+        """
+        Generate a subclass of the model that stores its fields in __slots__ rather than an instance __dict__, for a
+        smaller footprint per instance, e.g.:
+            database.add_model(Person.__schema__.slotted_class('pk', 'endpoint'))
+        Instances only go without a __dict__ if every class the model inherits from declares __slots__ (Model does.)
+        :param extra: Names of other attributes the model's methods set on instances, e.g. its primary key.
+        :return: The generated class, with the same name as the model.
+        """
+        model_class = self.model_class
+        defaults = self.defaults
+
+        def __init__(instance, *args, **kwargs):
+            for key, value in defaults.items():
+                object.__setattr__(instance, key, value)
+            model_class.__init__(instance, *args, **kwargs)
+
+        return type(model_class.__name__, (model_class,), {
+            '__slots__': tuple(dict.fromkeys(self.fields + extra)),
+            '__init__': __init__,
+            '__module__': model_class.__module__,
+            '__qualname__': model_class.__qualname__
+        })
 
 
 class ModelError(DatabaseError):
@@ -0,0 +1,284 @@
+__author__ = 'Ian S. Evans'
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from collection_json import Collection
+from flask_crudsdb import Database
+
+
+class MemoryCache(object):
+    """
+    A bounded, thread safe LRU cache of read results for a single process.
+
+    Entries are tagged with the model and primary key they were read for (None for listings), so writes can drop exactly
+    the entries they make stale. Each model also has a version that every invalidation bumps; a result read before a
+    concurrent write finished is not stored, since it may already be stale.
+    """
+
+    def __init__(self, size=1024, ttl=None):
+        """
+        MemoryCache Constructor
+        :param size: The most entries to keep, least recently used entries are evicted first.
+        :param ttl: The number of seconds an entry stays valid, or None to keep entries until they are evicted.
+        :return:
+        """
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.tags = {}
+        self.versions = {}
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, model, pk, key):
+        """
+        Look up a cached result.
+        :param model: The model name the result was read for.
+        :param pk: The primary key the result was read for, None for listings.
+        :param key: The cache key of the read.
+        :return: A tuple of (hit, value, token), where token must be passed to set when storing a missed result.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, expires = entry[:2]
+                if expires is None or expires > time.monotonic():
+                    self.entries.move_to_end(key)
+                    return True, value, None
+                self.__discard(key)
+            return False, None, self.versions.get(model, 0)
+
+    def set(self, model, pk, key, value, token):
+        with self.lock:
+            if self.versions.get(model, 0) != token:
+                return
+            if key in self.entries:
+                self.__discard(key)
+            expires = time.monotonic() + self.ttl if self.ttl else None
+            self.entries[key] = (value, expires, model, pk)
+            self.tags.setdefault(model, {}).setdefault(pk, set()).add(key)
+            while len(self.entries) > self.size:
+                self.__discard(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, model, pks=()):
+        """
+        Drop the listings of a model and the results read for the given primary keys.
+        :param model: The model name that was written to.
+        :param pks: The primary keys that were updated or deleted.
+        :return:
+        """
+        with self.lock:
+            self.versions[model] = self.versions.get(model, 0) + 1
+            tags = self.tags.get(model, {})
+            for pk in (None,) + tuple(pks):
+                for key in list(tags.get(pk, ())):
+                    self.__discard(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.tags.clear()
+            self.versions.clear()
+
+    def stats(self):
+        return {'size': len(self.entries), 'evictions': self.evictions}
+
+    def __discard(self, key):
+        value, expires, model, pk = self.entries.pop(key)
+        keys = self.tags.get(model, {}).get(pk)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.tags[model][pk]
+
+
+class RedisCache(object):
+    """
+    A cache of read results shared between processes, e.g. gunicorn workers, through a redis server.
+
+    Writes do not delete entries. Instead, every model has a listing generation and every instance a generation of its
+    own, kept in redis and included in the cache keys; writes bump them, so stale entries are never looked up again and
+    expire on their own. clear bumps a generation of the whole cache in the same way. Set a maxmemory-policy of
+    allkeys-lru on the server to bound its size.
+    """
+
+    def __init__(self, client, ttl=None, prefix='crudsdb:'):
+        """
+        RedisCache Constructor
+        :param client: A redis.Redis instance, or anything with the same get, mget, set and incr methods, e.g.
+        flask_crudsdb.testing.FakeRedis.
+        :param ttl: The number of seconds an entry stays valid, or None to keep entries until redis evicts them.
+        :param prefix: A prefix for every key this cache stores.
+        :return:
+        """
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get_generation_key(self, model=None, pk=None):
+        """
+        Get the key of a generation: of the whole cache without a model, else of a model's listings, or of one of its
+        instances.
+        """
+        if model is None:
+            return '{prefix}generation'.format(prefix=self.prefix)
+        return '{prefix}generation:{model}:{pk}'.format(prefix=self.prefix, model=model, pk=json.dumps(pk))
+
+    def get(self, model, pk, key):
+        generations = self.client.mget(self.get_generation_key(), self.get_generation_key(model, pk))
+        generations = [
+            (generation.decode() if isinstance(generation, bytes) else generation) or 0 for generation in generations
+        ]
+        token = self.prefix + hashlib.sha1('{key}:{0}:{1}'.format(*generations, key=key).encode()).hexdigest()
+        value = self.client.get(token)
+        if value is None:
+            return False, None, token
+        return True, Collection.from_json(value.decode() if isinstance(value, bytes) else value), None
+
+    def set(self, model, pk, key, value, token):
+        try:
+            value = json.dumps(value.to_dict())
+        except TypeError:
+            # Data that does not serialize to json is not cached.
+            return
+        self.client.set(token, value, ex=self.ttl)
+
+    def invalidate(self, model, pks=()):
+        for pk in (None,) + tuple(pks):
+            self.client.incr(self.get_generation_key(model, pk))
+
+    def clear(self):
+        self.client.incr(self.get_generation_key())
+
+    def stats(self):
+        return {}
+
+
+class CachedDatabase(Database):
+    """
+    A read-through cache in front of any Database.
+
+    read results are kept in the cache backend, keyed by model, primary key and every other argument to read (limit,
+    cursor, order_by, filter_by, ...). create drops the cached listings of its model; update and delete also drop the
+    results read for the primary key they change. Streaming reads are never cached.
+
+    Cached collections are shared between callers and must not be modified.
+    """
+
+    def __init__(self, database, backend=None, *args, **kwargs):
+        """
+        CachedDatabase Constructor
+        :param database: The flask_crudsdb.Database to cache reads of.
+        :param backend: A MemoryCache or RedisCache. Defaults to a MemoryCache of API_CACHE_SIZE entries that expire
+        after API_CACHE_TTL seconds.
+        :return:
+        """
+        self.app = database.app
+        self.models = database.models
+        self.database = database
+        self.search_index = database.search_index
+        if backend is None:
+            backend = MemoryCache(
+                size=self.app.config.get('API_CACHE_SIZE', 1024), ttl=self.app.config.get('API_CACHE_TTL', 60)
+            )
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # Anything the cache does not handle, e.g. FlatDatabase.flush, goes to the wrapped database.
+        if name == 'database':
+            raise AttributeError(name)
+        return getattr(self.database, name)
+
+    @staticmethod
+    def get_cache_pk(pk):
+        if pk is None:
+            return None
+        return str(pk)
+
+    def get_cache_key(self, model, pk, args, kwargs):
+        return json.dumps([model, self.get_cache_pk(pk), args, kwargs], sort_keys=True, default=str)
+
+    def add_model(self, model_class):
+        return self.database.add_model(model_class)
+
+    def create(self, model, data, *args, **kwargs):
+        try:
+            return self.database.create(model, data, *args, **kwargs)
+        finally:
+            self.backend.invalidate(model)
+
+    def read(self, model, pk=None, *args, stream=False, **kwargs):
+        if stream:
+            return self.database.read(model, pk, *args, stream=True, **kwargs)
+        cache_pk = self.get_cache_pk(pk)
+        key = self.get_cache_key(model, pk, args, kwargs)
+        hit, value, token = self.backend.get(model, cache_pk, key)
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if hit:
+            return value
+        value = self.database.read(model, pk, *args, **kwargs)
+        self.backend.set(model, cache_pk, key, value, token)
+        return value
+
+    def update(self, model, data, pk=None, *args, **kwargs):
+        try:
+            return self.database.update(model, data, *args, pk=pk, **kwargs)
+        finally:
+            self.backend.invalidate(model, [self.get_cache_pk(pk)])
+
+    def delete(self, model, pk=None, *args, **kwargs):
+        try:
+            return self.database.delete(model, *args, pk=pk, **kwargs)
+        finally:
+            self.backend.invalidate(model, [self.get_cache_pk(pk)])
+
+    def bulk_create(self, model, data, *args, **kwargs):
+        try:
+            return self.database.bulk_create(model, data, *args, **kwargs)
+        finally:
+            self.backend.invalidate(model)
+
+    def bulk_update(self, model, data, *args, **kwargs):
+        updates = self.get_bulk_updates(data)
+        try:
+            return self.database.bulk_update(model, updates, *args, **kwargs)
+        finally:
+            self.backend.invalidate(model, [self.get_cache_pk(pk) for pk, item in updates])
+
+    def bulk_delete(self, model, pks, *args, **kwargs):
+        pks = list(pks)
+        try:
+            return self.database.bulk_delete(model, pks, *args, **kwargs)
+        finally:
+            self.backend.invalidate(model, [self.get_cache_pk(pk) for pk in pks])
+
+    def search(self, model, data, *args, **kwargs):
+        return self.database.search(model, data, *args, **kwargs)
+
+    def iter_instances(self, model):
+        return self.database.iter_instances(model)
+
+    def reindex(self, model):
+        return self.database.reindex(model)
+
+    def cache_stats(self):
+        """
+        Get statistics of the cache.
+        :return: A dict of the hits and misses of this process and, for a MemoryCache, the number of cached entries
+        and of entries evicted to stay under its size.
+        """
+        with self.lock:
+            stats = {'hits': self.hits, 'misses': self.misses}
+        stats.update(self.backend.stats())
+        return stats
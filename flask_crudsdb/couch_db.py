@@ -1 +1,604 @@
 __author__ = 'Ian S. Evans'
+
+import json
+import os
+import random
+import threading
+from collection_json import Collection, Template
+from collections import OrderedDict
+from flask_crudsdb import Database, DatabaseError
+from flask import abort
+from requests import RequestException, Session
+from requests.adapters import HTTPAdapter
+from urllib.parse import quote
+
+
+class CouchDatabase(Database):
+    """
+    CouchDB flask_crudsdb wrapper
+
+    Every model is stored in one CouchDB database, as documents of the form:
+        {"_id": "<model>:<pk>", "_rev": "...", "model": "<model>", "data": {"<field>": <value>, ...}}
+    data holds the fields of the model's Collection+JSON item, so models are built like the flatfile module's, with
+    model_class(pk, data). Primary keys are strings, allocated by the database.
+
+    Requests go through one requests.Session, so connections are kept alive and pooled between calls. Revisions are
+    taken from the ETag of CouchDB's responses; documents read or written recently are kept with their revision, so
+    reading them again is a conditional GET that CouchDB answers with 304 Not Modified when nothing changed.
+    """
+
+    def __init__(self, app):
+        super(CouchDatabase, self).__init__(app)
+        self.url = '{server}/{database}'.format(
+            server=app.config.get('COUCHDB_URL', 'http://localhost:5984').rstrip('/'),
+            database=quote(app.config.get('COUCHDB_DATABASE', 'crudsdb'), safe='')
+        )
+        self.timeout = app.config.get('COUCHDB_TIMEOUT', 10)
+        self.batch_size = app.config.get('COUCHDB_BATCH_SIZE', 1000)
+        self.conflict_retries = app.config.get('COUCHDB_CONFLICT_RETRIES', 3)
+        self.cache_size = app.config.get('COUCHDB_DOCUMENT_CACHE_SIZE', 1024)
+        self.database = Session()
+        self.database.mount(self.url, HTTPAdapter(
+            pool_connections=1, pool_maxsize=app.config.get('COUCHDB_POOL_SIZE', 10),
+            max_retries=app.config.get('COUCHDB_MAX_RETRIES', 0)
+        ))
+        if app.config.get('COUCHDB_USERNAME') is not None:
+            self.database.auth = (app.config['COUCHDB_USERNAME'], app.config.get('COUCHDB_PASSWORD'))
+        self.documents = OrderedDict()
+        self.indexes = set()
+        self.lock = threading.Lock()
+        self.pk_prefix = None
+        self.pk_counter = 0
+        if app.config.get('COUCHDB_CREATE_DATABASE', True):
+            response = self.request('PUT', '')
+            if response.status_code not in (201, 202, 412):
+                self.check(response)
+
+    def close(self):
+        """
+        Close the pooled connections to CouchDB.
+        :return:
+        """
+        self.database.close()
+
+    def request(self, method, path, **kwargs):
+        """
+        Send a request to the CouchDB database through the pooled session.
+        :param method: The HTTP method.
+        :param path: The path under the database's url, e.g. '/_all_docs'.
+        :param kwargs: Any other arguments to requests.Session.request.
+        :raises DatabaseError: If CouchDB could not be reached.
+        :return: The requests.Response
+        """
+        try:
+            return self.database.request(method, self.url + path, timeout=self.timeout, **kwargs)
+        except RequestException as error:
+            raise DatabaseError('CouchDB request failed: {error}'.format(error=error))
+
+    @staticmethod
+    def check(response):
+        """
+        Raise for a response CouchDB answered with an error.
+        :param response: A requests.Response
+        :raises DatabaseError: If the response status is 400 or above.
+        :return: The response.
+        """
+        if response.status_code >= 400:
+            try:
+                error = response.json()
+                reason = '{0}: {1}'.format(error.get('error'), error.get('reason'))
+            except ValueError:
+                reason = response.text
+            raise DatabaseError('CouchDB answered {code}, {reason}'.format(code=response.status_code, reason=reason))
+        return response
+
+    @staticmethod
+    def get_rev(response):
+        return response.headers['ETag'].strip('"')
+
+    @staticmethod
+    def get_doc_id(model, pk):
+        return '{model}:{pk}'.format(model=model, pk=pk)
+
+    @staticmethod
+    def get_pk(doc_id):
+        return doc_id.split(':', 1)[1]
+
+    @staticmethod
+    def get_doc_path(doc_id):
+        return '/' + quote(doc_id, safe='')
+
+    @staticmethod
+    def get_field_path(field):
+        # Mango reads dots as nested fields, field names keep theirs escaped.
+        return 'data.' + field.replace('.', '\\.')
+
+    def get_next_pk(self):
+        """
+        Allocate a primary key, like CouchDB's "sequential" uuid algorithm: a random prefix and a counter that grows by
+        a random step. Keys allocated one after the other sort close together, so inserts touch the same few b-tree
+        nodes of the database instead of random ones.
+        :return: A 32 character hex string.
+        """
+        with self.lock:
+            self.pk_counter += random.randint(1, 0xffe)
+            if self.pk_prefix is None or self.pk_counter > 0xffffff:
+                self.pk_prefix = os.urandom(13).hex()
+                self.pk_counter = random.randint(1, 0xffe)
+            return '{prefix}{counter:06x}'.format(prefix=self.pk_prefix, counter=self.pk_counter)
+
+    def get_document(self, model, pk, instance, rev=None):
+        """
+        Build the CouchDB document of an instance.
+        :param model: The model name of the instance.
+        :param pk: The primary key of the instance.
+        :param instance: The model instance.
+        :param rev: The revision the document replaces, if any.
+        :return: A dict
+        """
+        item = instance.get_collection_item().to_dict()
+        document = {
+            '_id': self.get_doc_id(model, pk),
+            'model': model,
+            'data': dict((datum['name'], datum.get('value')) for datum in item.get('data', ()))
+        }
+        if rev is not None:
+            document['_rev'] = rev
+        return document
+
+    def load_instance(self, model, document):
+        """
+        Build a model instance from its CouchDB document.
+        :param model: The model name of the instance.
+        :param document: The document, as read from CouchDB.
+        :return: The model instance.
+        """
+        data = [{'name': name, 'value': value} for name, value in document.get('data', {}).items()]
+        return self.models[model](self.get_pk(document['_id']), Template(data))
+
+    def __remember(self, document):
+        with self.lock:
+            self.documents[document['_id']] = document
+            self.documents.move_to_end(document['_id'])
+            while len(self.documents) > self.cache_size:
+                self.documents.popitem(last=False)
+
+    def __forget(self, doc_id):
+        with self.lock:
+            self.documents.pop(doc_id, None)
+
+    def __recall(self, doc_id):
+        with self.lock:
+            return self.documents.get(doc_id)
+
+    def __get_document(self, model, pk):
+        """
+        Read a document, revalidating the cached copy with If-None-Match when there is one.
+        Aborts with HTTP 404 if the document does not exist.
+        """
+        doc_id = self.get_doc_id(model, pk)
+        cached = self.__recall(doc_id)
+        headers = {'If-None-Match': '"{rev}"'.format(rev=cached['_rev'])} if cached is not None else {}
+        response = self.request('GET', self.get_doc_path(doc_id), headers=headers)
+        if response.status_code == 304 and cached is not None:
+            return cached
+        if response.status_code == 404:
+            self.__forget(doc_id)
+            abort(404)
+        document = self.check(response).json()
+        document['_rev'] = self.get_rev(response)
+        self.__remember(document)
+        return document
+
+    def __get_documents(self, model, pks):
+        """
+        Read many documents with one request.
+        :return: A dict of {pk: document} for every document found.
+        """
+        if not pks:
+            return {}
+        response = self.check(self.request(
+            'POST', '/_all_docs', params={'include_docs': 'true'},
+            json={'keys': [self.get_doc_id(model, pk) for pk in pks]}
+        ))
+        documents = {}
+        for row in response.json()['rows']:
+            if row.get('doc') is not None:
+                documents[self.get_pk(row['id'])] = row['doc']
+        return documents
+
+    def __put_document(self, document):
+        """
+        Write a document.
+        :return: The requests.Response, the document is cached with its new revision if it was written.
+        """
+        response = self.request('PUT', self.get_doc_path(document['_id']), json=document)
+        if response.status_code in (201, 202):
+            document['_rev'] = self.get_rev(response)
+            self.__remember(document)
+        return response
+
+    def __bulk_docs(self, documents):
+        """
+        Write many documents with one _bulk_docs request.
+        :return: A list of CouchDB's results, in the order of documents.
+        """
+        results = self.check(self.request('POST', '/_bulk_docs', json={'docs': documents})).json()
+        for document, result in zip(documents, results):
+            if 'rev' in result and not result.get('error'):
+                if document.get('_deleted'):
+                    self.__forget(document['_id'])
+                else:
+                    document['_rev'] = result['rev']
+                    self.__remember(document)
+        return results
+
+    @staticmethod
+    def get_result_error(index, result):
+        code = 409 if result.get('error') == 'conflict' else 400
+        return index, code, '{0}: {1}'.format(result.get('error'), result.get('reason'))
+
+    def create(self, model, data, *args, **kwargs):
+        """
+        Create a new instance of a model
+        :param model: The model name to create an instance of
+        :param data: The data to provide to that instance, formatted as a Collection+JSON data array
+        :return: Collection representation of the created resource.
+        """
+        try:
+            data = Template(data)
+        except (TypeError, ValueError, IndexError):
+            abort(400)
+        pk = self.get_next_pk()
+        # letting this raise a KeyError on purpose, flask returns HTTP 500 on python errors
+        with self.instrumentation.phase('model'):
+            instance = self.models[model](pk, data)
+        with self.instrumentation.phase('persist'):
+            self.check(self.__put_document(self.get_document(model, pk, instance)))
+        self.index_instance(model, pk, instance)
+        with self.instrumentation.phase('serialize'):
+            return Collection(href=self.app.config.get('API_ROOT'), items=[instance.get_collection_item()])
+
+    def read(self, model, pk=None, *args, limit=None, cursor=None, after=None, order_by=None, filter_by=None,
+             stream=False, **kwargs):
+        """
+        Read a model instance by primary key, or list instances of a model.
+        Listings without order_by or filter_by are read from _all_docs, the others with a Mango query. Both seek past
+        the keys of the previous page rather than skipping rows, see flask_crudsdb.Database.read. Ordering by a field
+        creates a Mango index on it the first time; instances without that field are not listed.
+        :param model: The model name to look for instances of.
+        :param pk: The primary key of the model instance to attempt to read.
+        :param limit: The maximum number of instances to list.
+        :param cursor: An opaque cursor from the "next" or "prev" link of a previous page.
+        :param after: A primary key, list the instances that come after it.
+        :param order_by: The name of the field to order listed instances by.
+        :param filter_by: A dict of {field name: value} to filter listed instances by.
+        :param stream: If true, return a generator of Collection+JSON text. Unpaginated listings are then read from
+        CouchDB in batches of COUCHDB_BATCH_SIZE documents while the generator is consumed.
+        :return: Collection representation of resource(s) retrieved from the database.
+        """
+        # letting self.models[model] raise a KeyError on purpose, see above
+        template = self.models[model].get_collection_template()
+        links = None
+        with self.instrumentation.phase('query'):
+            if pk is not None:
+                documents = [self.__get_document(model, pk)]
+            else:
+                limit, keys, direction = self.get_page_args(limit, cursor)
+                if keys is None and after is not None:
+                    if order_by:
+                        anchor = self.__get_document(model, after)
+                        keys = [anchor['data'].get(order_by), after]
+                    else:
+                        keys = [after]
+                if limit is None and keys is None:
+                    documents = self.__scan(model, order_by, filter_by)
+                    if not stream:
+                        documents = list(documents)
+                else:
+                    documents, links = self.__read_page(model, limit, keys, direction, order_by, filter_by)
+
+        instances = (self.load_instance(model, document) for document in documents)
+        if stream:
+            return self.stream_collection(instances, template=template, links=links)
+        response = Collection(href=self.app.config.get('API_ROOT'), template=template, links=links)
+        with self.instrumentation.phase('serialize'):
+            for instance in instances:
+                response.items.append(instance.get_collection_item())
+        return response
+
+    def __read_page(self, model, limit, keys, direction, order_by=None, filter_by=None):
+        if keys is not None and len(keys) != (2 if order_by else 1):
+            abort(400)
+        rows = self.__seek(model, limit, keys, direction, order_by, filter_by)
+        documents, has_prev, has_next = self.get_page(rows, limit, keys, direction)
+        links = None
+        if documents:
+            links = self.get_page_links(
+                limit,
+                first=self.__get_keys(documents[0], order_by) if has_prev else None,
+                last=self.__get_keys(documents[-1], order_by) if has_next else None,
+                order_by=order_by
+            )
+        return documents, links
+
+    def __get_keys(self, document, order_by=None):
+        if order_by:
+            return [document['data'].get(order_by), self.get_pk(document['_id'])]
+        return [self.get_pk(document['_id'])]
+
+    def __scan(self, model, order_by=None, filter_by=None):
+        """
+        Iterate over every (matching) document of a model in order, a batch of COUCHDB_BATCH_SIZE at a time.
+        """
+        keys = None
+        while True:
+            documents = self.__seek(model, self.batch_size, keys, 'next', order_by, filter_by)
+            for document in documents[:self.batch_size]:
+                yield document
+            if len(documents) <= self.batch_size:
+                break
+            keys = self.__get_keys(documents[self.batch_size - 1], order_by)
+
+    def __seek(self, model, limit, keys, direction, order_by=None, filter_by=None):
+        """
+        Fetch up to limit + 1 documents past keys in the direction of travel, see Database.get_page.
+        """
+        if order_by or filter_by:
+            return self.__find(model, limit, keys, direction, order_by, filter_by)
+        params = {'include_docs': 'true', 'descending': json.dumps(direction == 'prev')}
+        low, high = self.get_doc_id(model, ''), self.get_doc_id(model, '\ufff0')
+        start = self.get_doc_id(model, keys[0]) if keys is not None else None
+        if direction == 'prev':
+            params['start_key'], params['end_key'] = json.dumps(start or high), json.dumps(low)
+        else:
+            params['start_key'], params['end_key'] = json.dumps(start or low), json.dumps(high)
+        if limit is not None:
+            # _all_docs has no exclusive start key, the document at keys (if it still exists) is dropped below.
+            params['limit'] = limit + 2 if keys is not None else limit + 1
+        rows = self.check(self.request('GET', '/_all_docs', params=params)).json()['rows']
+        documents = [row['doc'] for row in rows if row.get('doc') is not None and row['id'] != start]
+        return documents[:limit + 1] if limit is not None else documents
+
+    def __find(self, model, limit, keys, direction, order_by=None, filter_by=None):
+        """
+        Fetch a page of documents with a Mango query, seeking past keys with the selector.
+        """
+        order = 'desc' if direction == 'prev' else 'asc'
+        past = '$lt' if direction == 'prev' else '$gt'
+        conditions = [{'model': model}]
+        conditions.extend({self.get_field_path(field): value} for field, value in (filter_by or {}).items())
+        if order_by:
+            field = self.get_field_path(order_by)
+            self.__ensure_index(field)
+            sort = [{'model': order}, {field: order}, {'_id': order}]
+            conditions.append({field: {'$exists': True}})
+            if keys is not None:
+                doc_id = self.get_doc_id(model, keys[1])
+                conditions.append({'$or': [{field: {past: keys[0]}}, {field: keys[0], '_id': {past: doc_id}}]})
+        else:
+            sort = [{'_id': order}]
+            conditions.append({'_id': {'$gt': self.get_doc_id(model, ''), '$lt': self.get_doc_id(model, '\ufff0')}})
+            if keys is not None:
+                conditions.append({'_id': {past: self.get_doc_id(model, keys[0])}})
+        query = {'selector': {'$and': conditions}, 'sort': sort}
+        documents = []
+        while True:
+            # Mango answers 25 documents unless told otherwise, so unlimited seeks go through every batch.
+            query['limit'] = limit + 1 if limit is not None else self.batch_size
+            result = self.check(self.request('POST', '/_find', json=query)).json()
+            documents.extend(result['docs'])
+            if limit is not None or len(result['docs']) < self.batch_size or not result.get('bookmark'):
+                return documents
+            query['bookmark'] = result['bookmark']
+
+    def __ensure_index(self, field):
+        """
+        Create the Mango index listings ordered by field need, once per process.
+        """
+        if field in self.indexes:
+            return
+        self.check(self.request('POST', '/_index', json={
+            'index': {'fields': ['model', field, '_id']}, 'name': 'crudsdb-' + field, 'type': 'json'
+        }))
+        self.indexes.add(field)
+
+    def update(self, model, data, *args, pk=None, **kwargs):
+        """
+        Update a model instance in the database.
+        The update is applied to the latest revision of the instance and retried up to COUCHDB_CONFLICT_RETRIES times
+        when another writer changes it first, after which the update aborts with HTTP 409.
+        :param model: The model name to look for an instance of.
+        :param data: The data to provide to the instance, formatted as a Collection+JSON data array
+        :param pk: The primary key of the model instance to modify.
+        :return: A Collection+JSON representation of the updated model instance.
+        """
+        try:
+            data = Template(data)
+        except (TypeError, ValueError, IndexError):
+            abort(400)
+        # letting self.models[model] raise a KeyError on purpose, see above
+        template = self.models[model].get_collection_template()
+        for attempt in range(self.conflict_retries + 1):
+            with self.instrumentation.phase('query'):
+                document = self.__get_document(model, pk)
+            with self.instrumentation.phase('model'):
+                instance = self.load_instance(model, document)
+                instance.update(data)
+            with self.instrumentation.phase('persist'):
+                response = self.__put_document(self.get_document(model, pk, instance, document['_rev']))
+            if response.status_code != 409:
+                self.check(response)
+                break
+            self.__forget(document['_id'])
+        else:
+            abort(409)
+        self.index_instance(model, pk, instance)
+        with self.instrumentation.phase('serialize'):
+            return Collection(
+                href=self.app.config.get('API_ROOT'), template=template, items=[instance.get_collection_item()]
+            )
+
+    def delete(self, model, pk=None, *args, **kwargs):
+        """
+        Delete a model instance from the database by primary key.
+        The revision to delete is the cached one if there is one, or else the ETag of a HEAD request. Conflicts are
+        retried like update's.
+        :param model: The name of the model to delete an instance of.
+        :param pk: The primary key of the instance to delete.
+        :return:
+        """
+        # letting self.models[model] raise a KeyError on purpose, see above
+        self.models[model]
+        doc_id = self.get_doc_id(model, pk)
+        path = self.get_doc_path(doc_id)
+        cached = self.__recall(doc_id)
+        rev = cached['_rev'] if cached is not None else None
+        for attempt in range(self.conflict_retries + 1):
+            if rev is None:
+                with self.instrumentation.phase('query'):
+                    response = self.request('HEAD', path)
+                if response.status_code == 404:
+                    abort(404)
+                rev = self.get_rev(self.check(response))
+            with self.instrumentation.phase('persist'):
+                response = self.request('DELETE', path, headers={'If-Match': '"{rev}"'.format(rev=rev)})
+            if response.status_code == 404:
+                self.__forget(doc_id)
+                abort(404)
+            if response.status_code != 409:
+                self.check(response)
+                break
+            self.__forget(doc_id)
+            rev = None
+        else:
+            abort(409)
+        self.__forget(doc_id)
+        self.unindex_instance(model, pk)
+
+    def bulk_create(self, model, data, *args, **kwargs):
+        """
+        Create many new instances of a model with one _bulk_docs request.
+        Instances that fail validation, or that CouchDB rejects, are reported in the returned collection's error.
+        :param model: The model name to create instances of.
+        :param data: A list of Collection+JSON data arrays, one per instance.
+        :return: Collection representation of the created resources.
+        """
+        # letting self.models[model] raise a KeyError on purpose, see above
+        created, errors = [], []
+        for index, item in enumerate(data):
+            pk = self.get_next_pk()
+            try:
+                created.append((index, pk, self.models[model](pk, Template(item))))
+            except (TypeError, ValueError, IndexError):
+                errors.append((index, 400, 'malformed data'))
+            except DatabaseError as error:
+                errors.append(self.get_item_error(index, error))
+        return self.__write_bulk(model, created, errors)
+
+    def bulk_update(self, model, data, *args, **kwargs):
+        """
+        Update many instances of a model, reading them with one _all_docs request and writing them with one _bulk_docs
+        request. Instances that are missing, fail validation or were changed by another writer in between are reported
+        in the returned collection's error.
+        :param model: The model name to update instances of.
+        :param data: A dict of {primary key: Collection+JSON data array}, or a list of (primary key, data array) pairs.
+        :return: Collection representation of the updated resources.
+        """
+        updates = self.get_bulk_updates(data)
+        documents = self.__get_documents(model, [pk for pk, item in updates])
+        updated, errors = [], []
+        for index, (pk, item) in enumerate(updates):
+            document = documents.get(str(pk))
+            if document is None:
+                errors.append((index, 404, 'not found'))
+                continue
+            try:
+                instance = self.load_instance(model, document)
+                instance.update(Template(item))
+            except (TypeError, ValueError, IndexError):
+                errors.append((index, 400, 'malformed data'))
+            except DatabaseError as error:
+                errors.append(self.get_item_error(index, error))
+            else:
+                updated.append((index, str(pk), instance, document['_rev']))
+        return self.__write_bulk(model, updated, errors)
+
+    def __write_bulk(self, model, changes, errors):
+        """
+        Write the instances of a bulk_create or bulk_update and build its response.
+        :param changes: A list of (index, pk, instance) or (index, pk, instance, rev) tuples.
+        :param errors: The errors found so far, CouchDB's are added.
+        """
+        results = self.__bulk_docs([self.get_document(model, *change[1:]) for change in changes]) if changes else []
+        written = []
+        for change, result in zip(changes, results):
+            if result.get('error'):
+                errors.append(self.get_result_error(change[0], result))
+            else:
+                written.append(change)
+                self.index_instance(model, change[1], change[2])
+        return Collection(
+            href=self.app.config.get('API_ROOT'), template=self.models[model].get_collection_template(),
+            items=[change[2].get_collection_item() for change in written],
+            error=self.get_bulk_error(sorted(errors))
+        )
+
+    def bulk_delete(self, model, pks, *args, **kwargs):
+        """
+        Delete many instances of a model, reading their revisions with one _all_docs request and deleting them with one
+        _bulk_docs request.
+        :param model: The model name to delete instances of.
+        :param pks: A list of primary keys.
+        :return: A Collection, primary keys that were not found or changed in between are reported in its error.
+        """
+        pks = list(pks)
+        revs = {}
+        if pks:
+            response = self.check(self.request(
+                'POST', '/_all_docs', json={'keys': [self.get_doc_id(model, pk) for pk in pks]}
+            ))
+            for row in response.json()['rows']:
+                if 'value' in row and not row['value'].get('deleted'):
+                    revs[row['id']] = row['value']['rev']
+        deletes, errors = [], []
+        for index, pk in enumerate(pks):
+            doc_id = self.get_doc_id(model, pk)
+            if doc_id in revs:
+                deletes.append((index, pk, {'_id': doc_id, '_rev': revs.pop(doc_id), '_deleted': True}))
+            else:
+                errors.append((index, 404, 'not found'))
+        results = self.__bulk_docs([document for index, pk, document in deletes]) if deletes else []
+        for (index, pk, document), result in zip(deletes, results):
+            if result.get('error'):
+                errors.append(self.get_result_error(index, result))
+            else:
+                self.unindex_instance(model, pk)
+        return Collection(href=self.app.config.get('API_ROOT'), error=self.get_bulk_error(sorted(errors)))
+
+    def search(self, model, data, *args, page=1, pagelen=None, **kwargs):
+        """
+        Search the whoosh index of a model and read the matching instances with one _all_docs request.
+        :param model: The model name to search instances of.
+        :param data: A query string, or a Collection+JSON data array (or dict) of field names and values to match.
+        :param page: The page of results to return, starting at 1.
+        :param pagelen: The number of results per page.
+        :return: Collection representation of the matching resources, most relevant first.
+        """
+        # letting self.models[model] raise a KeyError on purpose, see above
+        pks, links = self.search_index_page(model, data, page, pagelen)
+        response = Collection(
+            href=self.app.config.get('API_ROOT'), template=self.models[model].get_collection_template(), links=links
+        )
+        with self.instrumentation.phase('query'):
+            documents = self.__get_documents(model, pks)
+        with self.instrumentation.phase('serialize'):
+            for pk in pks:
+                document = documents.get(str(pk))
+                if document is not None:
+                    response.items.append(self.load_instance(model, document).get_collection_item())
+        return response
+
+    def iter_instances(self, model):
+        for document in self.__scan(model):
+            yield self.get_pk(document['_id']), self.load_instance(model, document)
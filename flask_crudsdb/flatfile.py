@@ -1,72 +1,1344 @@
 __author__ = 'Ian S. Evans'
 
+import array
+import asyncio
+import atexit
+import bisect
+import click
+import contextlib
 import json
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import weakref
 from collection_json import Collection, Template
 from collections import UserDict
-from flask_crudsdb import Database
+from collections.abc import MutableMapping
+from flask_crudsdb import AsyncDatabase, Database, DatabaseError
 from flask import abort
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# The "format" of the manifest of a sharded FlatDatabase.
+SHARDED_FORMAT = 'crudsdb-sharded'
+
 
 class FlatDatabase(Database):
     """A flatfile database that operates in memory and stores on disk as json in user-configurable file"""
     class AutoKeyDict(UserDict):
-        def __init__(self, *args, **kwargs):
+        """
+        A dict keyed by integers that can allocate its own keys.
+        Keys are handed out from a monotonic counter, so a key is never reused after its value is deleted.
+        sorted_keys keeps the keys in ascending order for seeking through the dict page by page.
+        """
+        def __init__(self, *args, next_key=0, **kwargs):
+            self.next_key = next_key
+            self.sorted_keys = []
             super().__init__(*args, **kwargs)
 
         def __setitem__(self, key, value):
+            key = self.allocate(key)
+            if key not in self.data:
+                if not self.sorted_keys or key > self.sorted_keys[-1]:
+                    self.sorted_keys.append(key)
+                else:
+                    bisect.insort(self.sorted_keys, key)
+            super().__setitem__(key, value)
+
+        def __delitem__(self, key):
+            super().__delitem__(key)
+            del self.sorted_keys[bisect.bisect_left(self.sorted_keys, key)]
+
+        def allocate(self, key):
+            """
+            Resolve a key being set and move the counter past it.
+            :param key: An integer, a string parseable to an integer, or "next" for the next key.
+            :return: The integer key.
+            """
             if key == 'next':
-                key = len(sorted(self.data))
+                key = self.next_key
             elif type(key) != int:
                 try:
-                    key = int(abs(key))
+                    key = abs(int(key))
                 except (ValueError, TypeError):
                     raise TypeError('key must be parseable to an integer or "next"')
-            super().__setitem__(key, value)
+            if key >= self.next_key:
+                self.next_key = key + 1
+            return key
 
         def extend(self, d):
-            super().__init__(dict(self.data), **d)
+            self.update(d)
 
         def get_next(self):
-            return len(sorted(self.data))
-
-    class ModelJSONEncoder(json.JSONEncoder):
-        def default(self, o, models={}):
-            if o.__class__.__name__ in models:
-                d = o.get_collection_item().to_dict()
-                d['__class__'] = o.__class__.__name__
-                return d
-            elif isinstance(o, FlatDatabase.AutoKeyDict):
-                d = o.data
-                d['__class__'] = o.__class__.__name__
-                return d
+            return self.next_key
+
+        def dump(self, key):
+            """
+            Get the serializable representation of the value stored at key.
+            :param key: The key to dump.
+            :return: The Collection+JSON item of the stored instance, as a dict.
+            """
+            return self.data[key].get_collection_item().to_dict()
+
+    class PackedRecords(MutableMapping):
+        """
+        The records of a PackedKeyDict, stored by column: the keys in ascending order in an array of unsigned 64 bit
+        integers, as in binary segments, and one list of values per field. A record costs a slot in each list instead
+        of a tuple, a dict entry and an int object; it is found by bisecting the keys and read back as a tuple.
+        """
+        def __init__(self):
+            self.sorted_keys = array.array('Q')
+            self.columns = []
+
+        def find(self, key):
+            if not isinstance(key, int):
+                return None
+            position = bisect.bisect_left(self.sorted_keys, key)
+            if position < len(self.sorted_keys) and self.sorted_keys[position] == key:
+                return position
+            return None
+
+        def __contains__(self, key):
+            return self.find(key) is not None
+
+        def __getitem__(self, key):
+            position = self.find(key)
+            if position is None:
+                raise KeyError(key)
+            return tuple(column[position] for column in self.columns)
+
+        def __setitem__(self, key, values):
+            while len(self.columns) < len(values):
+                self.columns.append([None] * len(self.sorted_keys))
+            position = bisect.bisect_left(self.sorted_keys, key)
+            if position == len(self.sorted_keys) or self.sorted_keys[position] != key:
+                self.sorted_keys.insert(position, key)
+                for column in self.columns:
+                    column.insert(position, None)
+            for column, value in zip(self.columns, values):
+                column[position] = value
+
+        def __delitem__(self, key):
+            position = self.find(key)
+            if position is None:
+                raise KeyError(key)
+            del self.sorted_keys[position]
+            for column in self.columns:
+                del column[position]
+
+        def __iter__(self):
+            return iter(self.sorted_keys)
+
+        def __len__(self):
+            return len(self.sorted_keys)
+
+    class PackedKeyDict(AutoKeyDict):
+        """
+        An AutoKeyDict that stores the data values of its instances in PackedRecords instead of full model objects.
+        Field names are kept once per table and instances are rebuilt on access, trading some CPU on reads for a much
+        smaller footprint on large tables. Changes made to a rebuilt instance must be stored back to persist.
+        """
+        def __init__(self, model_class, *args, next_key=0, **kwargs):
+            self.model_class = model_class
+            self.fields = []
+            self.field_index = {}
+            super().__init__(next_key=next_key)
+            self.data = FlatDatabase.PackedRecords()
+            # the records keep their keys sorted, so they double as sorted_keys
+            self.sorted_keys = self.data.sorted_keys
+            self.update(*args, **kwargs)
+
+        def __setitem__(self, key, value):
+            self.data[self.allocate(key)] = self.pack(value.get_collection_item().to_dict())
+
+        def __delitem__(self, key):
+            del self.data[key]
+
+        def __getitem__(self, key):
+            return self.model_class(key, Template(self.dump(key).get('data')))
+
+        def pack(self, item):
+            values = [None] * len(self.fields)
+            for datum in item.get('data', ()):
+                index = self.field_index.get(datum['name'])
+                if index is None:
+                    index = self.field_index[datum['name']] = len(self.fields)
+                    self.fields.append(datum['name'])
+                    values.append(None)
+                values[index] = datum.get('value')
+            return tuple(values)
+
+        def dump(self, key):
+            return {
+                'data': [
+                    {'name': name, 'value': value}
+                    for name, value in zip(self.fields, self.data[key]) if value is not None
+                ]
+            }
+
+    class GroupCommitWriter(threading.Thread):
+        """
+        A writer thread that coalesces mutations and persists them in batches.
+        A batch is handed to the flush callback once max_mutations are queued or interval seconds have passed,
+        whichever comes first.
+        """
+        def __init__(self, flush, interval=0.1, max_mutations=100):
+            super().__init__(name='FlatDatabase.GroupCommitWriter', daemon=True)
+            self.flush_callback = flush
+            self.interval = interval
+            self.max_mutations = max_mutations
+            self.condition = threading.Condition()
+            self.queue = []
+            self.submitted = 0
+            self.flushed = 0
+            self.failures = 0
+            self.error = None
+            self.flush_requested = False
+            self.running = True
+            self.flush_count = 0
+            self.last_flush_latency = 0.0
+            self.total_flush_latency = 0.0
+
+        @property
+        def queue_depth(self):
+            return len(self.queue)
+
+        @property
+        def stats(self):
+            return {
+                'queue_depth': self.queue_depth,
+                'flush_count': self.flush_count,
+                'last_flush_latency': self.last_flush_latency,
+                'average_flush_latency': self.total_flush_latency / self.flush_count if self.flush_count else 0.0
+            }
+
+        def submit(self, record):
+            with self.condition:
+                self.queue.append(record)
+                self.submitted += 1
+                if len(self.queue) >= self.max_mutations:
+                    self.condition.notify_all()
+
+        def run(self):
+            while True:
+                with self.condition:
+                    if self.running and not self.flush_requested and len(self.queue) < self.max_mutations:
+                        self.condition.wait(self.interval)
+                    batch, self.queue = self.queue, []
+                    target = self.submitted
+                    self.flush_requested = False
+                    running = self.running
+                error = None
+                if batch:
+                    start = time.perf_counter()
+                    try:
+                        self.flush_callback(batch)
+                    except Exception as exception:
+                        logging.getLogger(__name__).exception('FlatDatabase background flush failed')
+                        error = exception
+                    self.last_flush_latency = time.perf_counter() - start
+                    self.total_flush_latency += self.last_flush_latency
+                    self.flush_count += 1
+                with self.condition:
+                    if error is None:
+                        self.flushed = target
+                        self.error = None
+                    else:
+                        # Put the batch back in front of anything queued since, to be retried on the next round.
+                        self.queue = batch + self.queue
+                        self.error = error
+                        self.failures += 1
+                    self.condition.notify_all()
+                if not running:
+                    break
+
+        def flush(self, timeout=None):
+            """
+            Block until everything submitted before this call has been persisted.
+            :param timeout: Maximum number of seconds to wait, or None to wait indefinitely.
+            :raises DatabaseError: If persisting failed, the mutations stay queued and are retried.
+            :return: True if the flush completed, False on timeout or if the writer has stopped.
+            """
+            with self.condition:
+                target = self.submitted
+                failures = self.failures
+                self.flush_requested = True
+                self.condition.notify_all()
+                self.condition.wait_for(
+                    lambda: self.flushed >= target or self.failures > failures or not self.is_alive(), timeout
+                )
+                if self.flushed < target and self.failures > failures:
+                    raise DatabaseError(
+                        'FlatDatabase background flush failed: {error}'.format(error=self.error)
+                    ) from self.error
+                return self.flushed >= target
+
+        def stop(self):
+            with self.condition:
+                self.running = False
+                self.condition.notify_all()
+            self.join()
+
+    class ProcessLock(object):
+        """
+        A reentrant lock shared by every process opening the same lock file, held with flock, for
+        FLAT_DATABASE_SHARED.
+        flock is held per open file, not per thread, so the threads of a process take turns through a thread lock
+        first. The file is reopened after a fork, so that forked workers do not share (and hold) each other's lock.
+        """
+        def __init__(self, path):
+            self.path = path
+            self.thread_lock = threading.RLock()
+            self.lock_file = None
+            self.pid = None
+            self.depth = 0
+
+        def __enter__(self):
+            self.thread_lock.acquire()
+            try:
+                if self.depth == 0:
+                    if self.pid != os.getpid():
+                        self.lock_file = open(self.path, 'a')
+                        self.pid = os.getpid()
+                    fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX)
+            except BaseException:
+                self.thread_lock.release()
+                raise
+            self.depth += 1
+            return self
+
+        def __exit__(self, *exc_info):
+            self.depth -= 1
+            if self.depth == 0:
+                fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+            self.thread_lock.release()
+
+    class InvertedIndex(object):
+        """
+        An in-memory inverted index of the words in some fields of a model's instances.
+        Maps each (field, word) pair to the primary keys of the instances containing it, so a search only visits the
+        instances that match at least one of its words.
+        """
+        word = re.compile(r'\w+')
+
+        def __init__(self, fields):
+            self.fields = list(fields)
+            self.postings = {}
+            self.documents = {}
+
+        @classmethod
+        def tokenize(cls, value):
+            if value is None:
+                return set()
+            return set(cls.word.findall(str(value).lower()))
+
+        def add(self, pk, instance):
+            self.remove(pk)
+            terms = set(
+                (field, word) for field in self.fields for word in self.tokenize(getattr(instance, field, None))
+            )
+            for term in terms:
+                self.postings.setdefault(term, set()).add(pk)
+            self.documents[pk] = terms
+
+        def remove(self, pk):
+            for term in self.documents.pop(pk, ()):
+                postings = self.postings[term]
+                postings.discard(pk)
+                if not postings:
+                    del self.postings[term]
+
+        def search(self, query):
+            """
+            Find the instances containing every word of a query.
+            :param query: A string searched across every field, or a dict of {field: value} searched per field.
+            :raises ValueError: If query names a field that is not indexed.
+            :return: A list of primary keys, instances matching in the most fields first.
+            """
+            if isinstance(query, dict):
+                terms = []
+                for field, value in query.items():
+                    if field not in self.fields:
+                        raise ValueError('{field} is not indexed'.format(field=field))
+                    terms.extend([(field, word)] for word in self.tokenize(value))
+            else:
+                terms = [[(field, word) for field in self.fields] for word in self.tokenize(query)]
+            if not terms:
+                return []
+            matches = []
+            for alternatives in terms:
+                hits = {}
+                for term in alternatives:
+                    for pk in self.postings.get(term, ()):
+                        hits[pk] = hits.get(pk, 0) + 1
+                matches.append(hits)
+            matches.sort(key=len)
+            scores = matches[0]
+            for hits in matches[1:]:
+                scores = dict((pk, score + hits[pk]) for pk, score in scores.items() if pk in hits)
+            return sorted(scores, key=lambda pk: (-scores[pk], pk))
+
+    class SortedIndex(object):
+        """
+        An in-memory secondary index keeping the (value, primary key) pairs of one field sorted, for finding
+        instances by value and listing them in order of that field by bisection rather than scanning.
+        """
+        def __init__(self, field):
+            self.field = field
+            self.entries = []
+            self.values = {}
+
+        @staticmethod
+        def sort_key(value):
+            """
+            Make values of any type comparable, so a field holding mixed types cannot break the index: None sorts
+            first, then numbers, then strings, then any other values by type name and repr.
+            """
+            if value is None:
+                return (0,)
+            if isinstance(value, (bool, int, float)):
+                return (1, value)
+            if isinstance(value, str):
+                return (2, value)
+            return (3, type(value).__name__, repr(value))
+
+        def add(self, pk, instance):
+            self.remove(pk)
+            entry = (self.sort_key(getattr(instance, self.field, None)), pk)
+            bisect.insort(self.entries, entry)
+            self.values[pk] = entry
+
+        def remove(self, pk):
+            entry = self.values.pop(pk, None)
+            if entry is not None:
+                del self.entries[bisect.bisect_left(self.entries, entry)]
+
+        def extend(self, instances):
+            """
+            Add many instances at once, sorting once instead of inserting one at a time.
+            :param instances: An iterable of (pk, instance) pairs not already in the index.
+            :return:
+            """
+            for pk, instance in instances:
+                self.values[pk] = (self.sort_key(getattr(instance, self.field, None)), pk)
+            self.entries = sorted(self.values.values())
+
+        def find(self, value):
+            key = self.sort_key(value)
+            start = bisect.bisect_left(self.entries, (key,))
+            end = bisect.bisect_left(self.entries, (key, float('inf')), start)
+            return set(pk for key, pk in self.entries[start:end])
+
+    class BinarySegment(object):
+        """
+        A read-only, memory-mapped segment of one model's records in the compact binary encoding:
+            magic (8 bytes), next key (u64), record count (u64), fields length (u32), padding (4 bytes)
+            the field names, as a json list, padded to 8 bytes
+            the primary keys of the records in ascending order (u64 each)
+            the offsets of the records, plus the end of the last one (u64 each)
+            the records, each the values of every field in order: a tag byte, then the value
+        All integers are little endian. Opening a segment only reads its header and keys; records are decoded when
+        they are looked up.
+        """
+        MAGIC = b'CRUDSDB\x01'
+        HEADER = struct.Struct('<8sQQI4x')
+        NONE, FALSE, TRUE, INT, FLOAT, STR, JSON = range(7)
+
+        def __init__(self, path):
+            with open(path, 'rb') as segment_file:
+                self.map = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, self.next_key, self.count, fields_length = self.HEADER.unpack_from(self.map, 0)
+            if magic != self.MAGIC:
+                raise DatabaseError('{path} is not a binary segment'.format(path=path))
+            start = self.HEADER.size
+            self.fields = json.loads(self.map[start:start + fields_length].decode('utf-8'))
+            start += fields_length + (-fields_length % 8)
+            self.keys = struct.unpack_from('<{0}Q'.format(self.count), self.map, start)
+            self.offsets = start + 8 * self.count
+
+        def __contains__(self, key):
+            return self.find(key) is not None
+
+        def find(self, key):
+            position = bisect.bisect_left(self.keys, key)
+            if position < self.count and self.keys[position] == key:
+                return position
+            return None
+
+        def get(self, key):
+            """
+            Decode the record stored for key.
+            :param key: The primary key.
+            :return: The record as a Collection+JSON item dict, or None if there is none.
+            """
+            position = self.find(key)
+            if position is None:
+                return None
+            start = struct.unpack_from('<Q', self.map, self.offsets + 8 * position)[0]
+            data = []
+            for name in self.fields:
+                value, start = self.decode(self.map, start)
+                if value is not None:
+                    data.append({'name': name, 'value': value})
+            return {'data': data}
+
+        @classmethod
+        def decode(cls, buffer, position):
+            tag = buffer[position]
+            position += 1
+            if tag == cls.NONE:
+                return None, position
+            if tag == cls.FALSE or tag == cls.TRUE:
+                return tag == cls.TRUE, position
+            if tag == cls.INT:
+                return struct.unpack_from('<q', buffer, position)[0], position + 8
+            if tag == cls.FLOAT:
+                return struct.unpack_from('<d', buffer, position)[0], position + 8
+            length = struct.unpack_from('<I', buffer, position)[0]
+            value = bytes(buffer[position + 4:position + 4 + length]).decode('utf-8')
+            return (value if tag == cls.STR else json.loads(value)), position + 4 + length
+
+        @classmethod
+        def encode(cls, value):
+            if value is None:
+                return bytes((cls.NONE,))
+            if value is True or value is False:
+                return bytes((cls.TRUE if value else cls.FALSE,))
+            if type(value) is int and -2 ** 63 <= value < 2 ** 63:
+                return struct.pack('<Bq', cls.INT, value)
+            if type(value) is float:
+                return struct.pack('<Bd', cls.FLOAT, value)
+            if type(value) is str:
+                tag, value = cls.STR, value.encode('utf-8')
             else:
-                return json.JSONEncoder.default(self, o)
-
-    class ModelJSONDecoder(json.JSONDecoder):
-        def decode(self, s, models={}, **kwargs):
-            default = super().decode(s, **kwargs)
-            if '__class__' in default:
-                if default['__class__'] in models:
-                    default = models[default['__class__']](**default)
-                if default['__class__'] == 'AutoKeyDict':
-                    default = FlatDatabase.AutoKeyDict(default)
-            return default
+                tag, value = cls.JSON, json.dumps(value).encode('utf-8')
+            return struct.pack('<BI', tag, len(value)) + value
+
+        @classmethod
+        def write(cls, segment_file, next_key, records):
+            """
+            Write records in the binary encoding.
+            :param segment_file: A file opened for writing in binary mode.
+            :param next_key: The next primary key of the model.
+            :param records: A list of (primary key, Collection+JSON item dict) pairs in ascending key order.
+            :return:
+            """
+            fields, field_index, rows = [], {}, []
+            for pk, record in records:
+                values = {}
+                for datum in record.get('data', ()):
+                    if datum['name'] not in field_index:
+                        field_index[datum['name']] = len(fields)
+                        fields.append(datum['name'])
+                    values[datum['name']] = datum.get('value')
+                rows.append(b''.join(cls.encode(values.get(name)) for name in fields))
+            names = json.dumps(fields).encode('utf-8')
+            fields_length = len(names)
+            names += b'\0' * (-fields_length % 8)
+            offset = cls.HEADER.size + len(names) + 8 * (2 * len(rows) + 1)
+            offsets = []
+            for row in rows:
+                offsets.append(offset)
+                offset += len(row)
+            offsets.append(offset)
+            segment_file.write(cls.HEADER.pack(cls.MAGIC, next_key, len(rows), fields_length))
+            segment_file.write(names)
+            segment_file.write(struct.pack('<{0}Q'.format(len(rows)), *[pk for pk, record in records]))
+            segment_file.write(struct.pack('<{0}Q'.format(len(offsets)), *offsets))
+            for row in rows:
+                segment_file.write(row)
+
+    class MappedRecords(MutableMapping):
+        """
+        The records of a MappedKeyDict: the instances stored in a BinarySegment, overlaid with the instances set and
+        deleted since it was written. Stored instances are rebuilt with load on every access.
+        """
+        def __init__(self, segment, load):
+            self.segment = segment
+            self.load = load
+            self.changed = {}
+            self.deleted = set()
+            self.size = segment.count if segment is not None else 0
+
+        def __contains__(self, key):
+            if key in self.changed:
+                return True
+            return key not in self.deleted and self.segment is not None and key in self.segment
+
+        def __getitem__(self, key):
+            if key in self.changed:
+                return self.changed[key]
+            record = self.dump(key)
+            return self.load(key, record)
+
+        def dump(self, key):
+            if key in self.changed:
+                return self.changed[key].get_collection_item().to_dict()
+            record = self.segment.get(key) if self.segment is not None and key not in self.deleted else None
+            if record is None:
+                raise KeyError(key)
+            return record
+
+        def __setitem__(self, key, value):
+            if key not in self:
+                self.size += 1
+            self.changed[key] = value
+            self.deleted.discard(key)
+
+        def __delitem__(self, key):
+            if key not in self:
+                raise KeyError(key)
+            self.changed.pop(key, None)
+            if self.segment is not None and key in self.segment:
+                self.deleted.add(key)
+            self.size -= 1
+
+        def __iter__(self):
+            if self.segment is not None:
+                for key in self.segment.keys:
+                    if key not in self.changed and key not in self.deleted:
+                        yield key
+            for key in list(self.changed):
+                yield key
+
+        def __len__(self):
+            return self.size
+
+    class MappedKeyDict(AutoKeyDict):
+        """
+        An AutoKeyDict backed by a memory-mapped BinarySegment, for FLAT_DATABASE_RECORD_STORE 'mapped'.
+        Loading it only reads the segment's keys; records stay in the page cache and are decoded into instances when
+        they are read, so a large table costs little memory until it is used. Like PackedKeyDict, changes made to a
+        rebuilt instance must be stored back to persist.
+        """
+        def __init__(self, segment, load):
+            super().__init__(next_key=segment.next_key if segment is not None else 0)
+            self.load = load
+            self.data = FlatDatabase.MappedRecords(segment, load)
+            self.sorted_keys = list(segment.keys) if segment is not None else []
+            self.generation = 0
+
+        def __setitem__(self, key, value):
+            super().__setitem__(key, value)
+            self.generation += 1
+
+        def __delitem__(self, key):
+            super().__delitem__(key)
+            self.generation += 1
+
+        def dump(self, key):
+            return self.data.dump(key)
+
+        def remap(self, segment):
+            """Replace the overlay with a segment that holds every change made so far."""
+            self.data = FlatDatabase.MappedRecords(segment, self.load)
+
+    class LazyTables(dict):
+        """
+        The tables of a sharded FlatDatabase, keyed by model name.
+        A model's table is loaded from its segment the first time it is looked up (with [], get or in), so a process
+        only reads the models it uses. Iterating only visits the tables loaded so far.
+        """
+        def __init__(self, load):
+            super().__init__()
+            self.load = load
+
+        def __missing__(self, model):
+            table = self.load(model)
+            if table is None:
+                raise KeyError(model)
+            return table
+
+        def get(self, model, default=None):
+            try:
+                return self[model]
+            except KeyError:
+                return default
+
+        def __contains__(self, model):
+            return self.get(model) is not None
 
     def __init__(self, app):
         super(FlatDatabase, self).__init__(app)
-        self.database = {}
+        self.layout = app.config.get('FLAT_DATABASE_LAYOUT', 'file')
+        self.encoding = app.config.get('FLAT_DATABASE_ENCODING', 'json')
+        self.record_store = app.config.get('FLAT_DATABASE_RECORD_STORE', 'dict')
+        if self.record_store == 'mapped' and (self.layout != 'sharded' or self.encoding != 'binary'):
+            raise DatabaseError("FLAT_DATABASE_RECORD_STORE 'mapped' needs the 'sharded' layout and 'binary' encoding")
+        self.database = self.LazyTables(self.__load_model) if self.layout == 'sharded' else {}
+        # Raw records read from disk for models that have not been added with add_model yet.
+        self.pending = {}
+        # In the sharded layout: the manifest listing each model's segment, the journal records of models whose table
+        # is not loaded yet ({model: {pk: item, or None once deleted}}), and the models changed since their segment was
+        # last written.
+        self.manifest = {'format': SHARDED_FORMAT, 'version': 1, 'models': {}}
+        self.journal_changes = {}
+        self.dirty = set()
+        self.text_indexes = {}
+        self.sorted_indexes = {}
+        # Processes sharing the database append every change to the journal, and follow each other's changes in it.
+        self.shared = bool(app.config.get('FLAT_DATABASE_SHARED', False))
+        self.journal = bool(app.config.get('FLAT_DATABASE_JOURNAL', False)) or self.shared
+        self.journal_file = app.config.get(
+            'FLAT_DATABASE_JOURNAL_FILE', app.config.get('FLAT_DATABASE_FILE') + '.journal'
+        )
+        self.journal_max_records = app.config.get('FLAT_DATABASE_JOURNAL_MAX_RECORDS', 10000)
+        self.journal_max_size = app.config.get('FLAT_DATABASE_JOURNAL_MAX_SIZE', 16 * 1024 * 1024)
+        self.journal_records = 0
+        # The generation of the journal, incremented by each compaction, and how far it has been read: the open
+        # journal (kept open with FLAT_DATABASE_SHARED, to follow it), the offset of the first record not read yet and
+        # whether it is the torn end of a record a crash interrupted.
+        self.generation = 0
+        self.journal_reader = None
+        self.journal_identity = None
+        self.journal_offset = 0
+        self.journal_torn = False
+        # lock guards the in-memory database, io_lock serializes file writes so the background writer does not hold
+        # up requests while it is on disk. process_lock serializes writes between processes with FLAT_DATABASE_SHARED.
+        # They are always taken in that order: process_lock, io_lock, lock.
+        self.lock = threading.RLock()
+        self.io_lock = threading.RLock()
+        self.process_lock = None
+        # Set by caught_up, while the calling thread reads under lock after catching up.
+        self.local = threading.local()
+        self.writer = None
+        if self.shared:
+            if fcntl is None:
+                raise DatabaseError('FLAT_DATABASE_SHARED needs fcntl file locks, which this platform does not have')
+            if app.config.get('FLAT_DATABASE_DURABILITY', 'sync') != 'sync':
+                raise DatabaseError("FLAT_DATABASE_SHARED needs FLAT_DATABASE_DURABILITY 'sync'")
+            if self.search_index is not None:
+                raise DatabaseError('FLAT_DATABASE_SHARED does not support WHOOSH_INDEX_DIR, whoosh allows one writer')
+            self.process_lock = self.ProcessLock(
+                app.config.get('FLAT_DATABASE_LOCK_FILE', app.config.get('FLAT_DATABASE_FILE') + '.lock')
+            )
+        with self.process_lock or contextlib.nullcontext():
+            self.__load()
+        if app.config.get('FLAT_DATABASE_DURABILITY', 'sync') == 'group':
+            self.writer = self.GroupCommitWriter(
+                self.__flush,
+                interval=app.config.get('FLAT_DATABASE_FLUSH_INTERVAL', 100) / 1000.0,
+                max_mutations=app.config.get('FLAT_DATABASE_FLUSH_MUTATIONS', 100)
+            )
+            self.writer.start()
+            atexit.register(self.close)
+        register_commands(app)
+
+    def __load(self):
+        """
+        Load the database file and replay the journal on top of it, creating the file if there is none.
+        With FLAT_DATABASE_SHARED this runs under process_lock, and the journal is created too (with its generation)
+        and kept open to follow.
+        """
         try:
             self.__reload_db_file()
         except FileNotFoundError:
             self.__write_db_file()
+        if self.shared and not os.path.exists(self.journal_file):
+            self.__write_journal_header()
+        if self.journal:
+            self.__replay_journal()
 
     def __reload_db_file(self):
         with open(self.app.config.get('FLAT_DATABASE_FILE')) as db_file:
-            self.database = json.load(db_file, cls=FlatDatabase.ModelJSONDecoder, models=self.models)
+            if self.layout == 'sharded':
+                self.manifest = self.read_manifest(db_file)
+            else:
+                self.pending = json.load(db_file)
+
+    def __write_db_file(self, models=None):
+        """
+        Write a snapshot of every model to FLAT_DATABASE_FILE.
+        The snapshot is written to a temporary file first and renamed over the old one, so a crash mid-write never
+        leaves a truncated database behind.
+        In the sharded layout only the segments of the given models are written, see __write_segments.
+        :param models: The names of the models that changed, or None.
+        """
+        if self.layout == 'sharded':
+            return self.__write_segments(models)
+        with self.lock:
+            snapshot = dict(self.pending)
+            for model, instances in self.database.items():
+                snapshot[model] = {pk: instances.dump(pk) for pk in instances.data}
+                snapshot[model]['next'] = instances.next_key
+        with self.io_lock:
+            self.write_file(self.app.config.get('FLAT_DATABASE_FILE'), lambda db_file: json.dump(snapshot, db_file))
+
+    def __write_segments(self, models=None):
+        """
+        Write the segments of some models, each to a temporary file renamed over the old one.
+        The manifest is only rewritten when a model gets a new segment, e.g. its first one, or one in another encoding.
+        :param models: The names of the models to write, or None for every model changed since its segment was last
+        written, including models that were never loaded but have journal records to fold in.
+        """
+        snapshots, folds = [], []
+        with self.lock:
+            if models is None:
+                models = self.dirty | set(self.journal_changes)
+            for model in models:
+                self.dirty.discard(model)
+                table = dict.get(self.database, model)
+                if table is not None:
+                    records = [(pk, table.dump(pk)) for pk in table.sorted_keys]
+                    snapshots.append((model, table, getattr(table, 'generation', None), table.next_key, records))
+                elif model in self.journal_changes:
+                    # Left in journal_changes until the segment is written, in case the model is loaded meanwhile.
+                    folds.append((model, dict(self.journal_changes[model])))
+        path = self.app.config.get('FLAT_DATABASE_FILE')
+        with self.io_lock:
+            for model, changes in folds:
+                entry = self.manifest['models'].get(model)
+                next_key, records = 0, []
+                if entry is not None:
+                    next_key, records = self.read_segment(
+                        self.get_segment_path(path, entry['segment']), entry['encoding']
+                    )
+                next_key, records = self.apply_changes(next_key, dict(records), changes)
+                snapshots.append((model, None, None, next_key, sorted(records.items())))
+            entries, written = {}, []
+            for model, table, generation, next_key, records in snapshots:
+                entry = {'segment': self.get_segment_name(path, model, self.encoding), 'encoding': self.encoding}
+                segment_path = self.get_segment_path(path, entry['segment'])
+                self.write_segment(segment_path, self.encoding, next_key, records)
+                if self.manifest['models'].get(model) != entry:
+                    entries[model] = entry
+                written.append((model, table, generation, segment_path))
+            if entries or not os.path.exists(path):
+                with self.lock:
+                    manifest = dict(self.manifest, models=dict(self.manifest['models'], **entries))
+                    self.write_file(path, lambda manifest_file: json.dump(manifest, manifest_file))
+                    replaced, self.manifest = self.manifest, manifest
+                    for model in entries:
+                        if model in replaced['models']:
+                            self.remove_file(self.get_segment_path(path, replaced['models'][model]['segment']))
+        with self.lock:
+            for model, changes in folds:
+                if self.journal_changes.get(model) == changes:
+                    del self.journal_changes[model]
+        for model, table, generation, segment_path in written:
+            with self.lock:
+                # A mapped table only switches to its new segment if nothing changed while it was being written.
+                if generation is not None and table.generation == generation and \
+                        dict.get(self.database, model) is table:
+                    table.remap(self.BinarySegment(segment_path))
+
+    def __load_model(self, model):
+        """
+        Load the table of a model from its segment, with the journal records not folded into it yet, and build its
+        indexes. LazyTables calls this the first time a model is looked up in the sharded layout.
+        With FLAT_DATABASE_SHARED this holds process_lock and catches up first, so that no other process replaces the
+        segment with one holding changes that are not read from the journal yet.
+        :param model: The model name.
+        :return: The table, or None if the model has not been added.
+        """
+        if model not in self.models:
+            return None
+        with self.process_lock or contextlib.nullcontext(), self.lock:
+            self.__refresh()
+            table = dict.get(self.database, model)
+            if table is not None:
+                return table
+            entry = self.manifest['models'].get(model)
+            if entry is None:
+                table = self.__new_table(model)
+            elif self.record_store == 'mapped' and entry['encoding'] == 'binary':
+                path = self.get_segment_path(self.app.config.get('FLAT_DATABASE_FILE'), entry['segment'])
+                table = self.__new_table(model, segment=self.BinarySegment(path))
+            else:
+                path = self.get_segment_path(self.app.config.get('FLAT_DATABASE_FILE'), entry['segment'])
+                next_key, records = self.read_segment(path, entry['encoding'])
+                table = self.__new_table(model, next_key=next_key)
+                for pk, record in records:
+                    table[pk] = self.__load_instance(model, pk, record)
+            changes = self.journal_changes.pop(model, None)
+            if changes:
+                for pk, record in changes.items():
+                    if record is None:
+                        table.pop(pk, None)
+                    else:
+                        table[pk] = self.__load_instance(model, pk, record)
+                table.next_key = max(table.next_key, max(changes) + 1)
+                self.dirty.add(model)
+            self.__build_indexes(self.models[model])
+            return table
+
+    @staticmethod
+    def write_file(path, write, mode='w'):
+        """
+        Write a file atomically: to a temporary file first, synced to disk and renamed over the old one.
+        :param path: The path of the file.
+        :param write: A callable writing the contents to the open temporary file.
+        :param mode: The mode to open the file with, 'wb' for binary contents.
+        :return:
+        """
+        with open(path + '.tmp', mode) as new_file:
+            write(new_file)
+            new_file.flush()
+            os.fsync(new_file.fileno())
+        os.replace(path + '.tmp', path)
+
+    @staticmethod
+    def remove_file(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def read_manifest(manifest_file):
+        manifest = json.load(manifest_file)
+        if manifest.get('format') != SHARDED_FORMAT:
+            raise DatabaseError(
+                '{path} is not a sharded FlatDatabase, convert it with "flask crudsdb-migrate"'.format(
+                    path=manifest_file.name
+                )
+            )
+        return manifest
+
+    @staticmethod
+    def get_segment_name(path, model, encoding):
+        return '{base}.{model}.{extension}'.format(
+            base=os.path.basename(path), model=model, extension='seg' if encoding == 'binary' else 'json'
+        )
+
+    @staticmethod
+    def get_segment_path(path, segment):
+        """Segments are stored in the directory of the manifest, FLAT_DATABASE_FILE."""
+        return os.path.join(os.path.dirname(os.path.abspath(path)), segment)
+
+    @classmethod
+    def read_segment(cls, path, encoding):
+        """
+        Read every record of a segment.
+        :param path: The path of the segment.
+        :param encoding: 'json' or 'binary'
+        :return: A tuple of (next key, list of (primary key, Collection+JSON item dict) pairs in key order)
+        """
+        if encoding == 'binary':
+            segment = cls.BinarySegment(path)
+            return segment.next_key, [(pk, segment.get(pk)) for pk in segment.keys]
+        with open(path) as segment_file:
+            records = json.load(segment_file)
+        next_key = records.pop('next', 0)
+        return next_key, sorted((int(pk), record) for pk, record in records.items())
+
+    @classmethod
+    def write_segment(cls, path, encoding, next_key, records):
+        """
+        Write the records of a model to a segment, see read_segment.
+        A json segment holds the same object as the model's entry in the single file layout.
+        """
+        if encoding == 'binary':
+            cls.write_file(path, lambda segment_file: cls.BinarySegment.write(segment_file, next_key, records), 'wb')
+        else:
+            snapshot = dict((str(pk), record) for pk, record in records)
+            snapshot['next'] = next_key
+            cls.write_file(path, lambda segment_file: json.dump(snapshot, segment_file))
+
+    @staticmethod
+    def apply_changes(next_key, records, changes):
+        """
+        Apply journal changes to the raw records of a model.
+        :param next_key: The next primary key of the model.
+        :param records: A dict of {primary key: item}, changed in place.
+        :param changes: A dict of {primary key: item, or None for deleted instances}.
+        :return: A tuple of (next key, records)
+        """
+        for pk, record in changes.items():
+            if record is None:
+                records.pop(pk, None)
+            else:
+                records[pk] = record
+            next_key = max(next_key, pk + 1)
+        return next_key, records
+
+    def __replay_journal(self):
+        """
+        Apply every record in the journal on top of the loaded snapshot.
+        A partially written trailing record (e.g., from a crash mid-append) is ignored.
+        With FLAT_DATABASE_SHARED the journal is kept open, to follow the records other processes append to it.
+        """
+        if self.__open_journal():
+            self.__read_journal()
+            if not self.shared:
+                self.__close_journal()
+
+    def __open_journal(self):
+        """
+        Open the journal to read it from the start.
+        Journals started by compact begin with a header line holding their generation, older ones are generation 0.
+        :return: True, or False if there is no journal.
+        """
+        self.__close_journal()
+        try:
+            self.journal_reader = open(self.journal_file, 'rb')
+        except FileNotFoundError:
+            return False
+        stat = os.fstat(self.journal_reader.fileno())
+        self.journal_identity = (stat.st_dev, stat.st_ino)
+        self.generation, self.journal_offset, self.journal_records, self.journal_torn = 0, 0, 0, False
+        first = self.journal_reader.readline()
+        try:
+            header = json.loads(first)
+        except ValueError:
+            header = None
+        if isinstance(header, dict) and 'generation' in header and 'op' not in header:
+            self.generation = header['generation']
+            self.journal_offset = len(first)
+        return True
 
-    def __write_db_file(self):
-        with open(self.app.config.get('FLAT_DATABASE_FILE'), 'w') as db_file:
-            json.dump(self.database, db_file, cls=self.ModelJSONEncoder, models=self.models)
+    def __close_journal(self):
+        if self.journal_reader is not None:
+            self.journal_reader.close()
+            self.journal_reader = None
+
+    def __read_journal(self):
+        """
+        Apply the records appended to the open journal since it was last read.
+        A last line without its line end yet, e.g. a record another process is appending, is left for the next read. A
+        complete line that does not parse is the torn end of an append a crash interrupted, which __append_journal
+        ended with a line end before appending after it, and is skipped.
+        Reads with pread, so that processes forked with the journal open do not move each other's file position.
+        """
+        fd = self.journal_reader.fileno()
+        data = os.pread(fd, max(os.fstat(fd).st_size - self.journal_offset, 0), self.journal_offset)
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logging.getLogger(__name__).warning('Skipping a torn record in %s', self.journal_file)
+                continue
+            self.__apply_record(record)
+            self.journal_records += 1
+        self.journal_offset += end
+        self.journal_torn = end < len(data)
+
+    def __write_journal_header(self):
+        """Replace the journal with an empty one of the current generation."""
+        self.write_file(
+            self.journal_file, lambda journal: journal.write(json.dumps({'generation': self.generation}) + '\n')
+        )
+
+    def __refresh(self):
+        """
+        Catch up with the changes other processes made, with FLAT_DATABASE_SHARED. Does nothing otherwise.
+        Checking takes a stat of the journal. Records appended since it was last read are replayed into the tables and
+        their indexes. If another process compacted the journal meanwhile, the rest of the old journal is read, then
+        the new one, provided it is of the next generation: otherwise the changes of the journals in between are only
+        in the snapshot, and everything is reloaded.
+        :return:
+        """
+        if not self.shared or getattr(self.local, 'caught_up', False):
+            return
+        with self.lock:
+            while True:
+                try:
+                    stat = os.stat(self.journal_file)
+                except FileNotFoundError:
+                    stat = None
+                current = self.journal_reader is not None and stat is not None and \
+                    (stat.st_dev, stat.st_ino) == self.journal_identity
+                if current and stat.st_size <= self.journal_offset:
+                    return
+                if self.journal_reader is not None:
+                    # Compaction replaces the journal after its last append, so the old one is complete once replaced.
+                    self.__read_journal()
+                if current:
+                    return
+                generation = self.generation
+                if not self.__open_journal() or self.generation != generation + 1:
+                    break
+                if self.layout == 'sharded':
+                    # The compaction may have given models new segments.
+                    self.__reload_db_file()
+        self.__reload()
+
+    def __reload(self):
+        """
+        Drop the tables and indexes and load everything from disk again, see __refresh.
+        """
+        with self.process_lock, self.lock:
+            self.__close_journal()
+            dict.clear(self.database)
+            self.pending, self.journal_changes, self.dirty = {}, {}, set()
+            self.text_indexes.clear()
+            self.sorted_indexes.clear()
+            self.__reload_db_file()
+            if self.layout != 'sharded':
+                for model_class in self.models.values():
+                    self.__add_table(model_class)
+            self.__replay_journal()
+
+    @contextlib.contextmanager
+    def caught_up(self, model):
+        """
+        Catch up with the other processes' changes and load the table of a model, then hold lock without catching up
+        again. Catching up and loading tables may take process_lock, which must never be waited for under lock, as
+        writers hold it while they wait for lock.
+        :param model: The model name about to be read.
+        """
+        while True:
+            self.__refresh()
+            self.database.get(model)
+            with self.lock:
+                if self.layout == 'sharded' and model in self.models and dict.get(self.database, model) is None:
+                    # reloaded by another thread meanwhile
+                    continue
+                nested, self.local.caught_up = getattr(self.local, 'caught_up', False), True
+                try:
+                    yield
+                finally:
+                    self.local.caught_up = nested
+                return
+
+    @contextlib.contextmanager
+    def __synchronized(self):
+        """
+        Hold lock while changing the database. With FLAT_DATABASE_SHARED, hold process_lock too, and catch up with the
+        other processes' changes first, so that keys are allocated and instances changed on top of all of them.
+        Without a background writer the change is written before lock is released, so io_lock is taken first: writing
+        a snapshot takes lock under io_lock.
+        """
+        io_lock = self.io_lock if self.writer is None else contextlib.nullcontext()
+        if not self.shared:
+            with io_lock, self.lock:
+                yield
+            return
+        with self.process_lock, io_lock, self.lock:
+            self.__refresh()
+            yield
+
+    def __apply_record(self, record):
+        model, pk = record['model'], int(record['pk'])
+        if self.layout != 'sharded' and model in self.models and model not in self.database:
+            # The first instance of an added model, created by another process.
+            self.__new_table(model)
+        # dict.__contains__ so a sharded table is not loaded just to replay its records
+        if dict.__contains__(self.database, model):
+            # Loaded tables only replay records from other processes (with FLAT_DATABASE_SHARED), whose indexes
+            # follow along.
+            if record['op'] == 'set':
+                instance = self.__load_instance(model, pk, record['item'])
+                self.database[model][pk] = instance
+                for index in self.__get_indexes(model):
+                    index.add(pk, instance)
+            else:
+                self.database[model].pop(pk, None)
+                for index in self.__get_indexes(model):
+                    index.remove(pk)
+            self.dirty.add(model)
+        elif self.layout == 'sharded':
+            self.journal_changes.setdefault(model, {})[pk] = record['item'] if record['op'] == 'set' else None
+        else:
+            records = self.pending.setdefault(model, {})
+            if record['op'] == 'set':
+                records[str(pk)] = record['item']
+                records['next'] = max(records.get('next', 0), pk + 1)
+            else:
+                records.pop(str(pk), None)
+
+    def __append_journal(self, records):
+        with open(self.journal_file, 'a') as journal:
+            if self.journal_torn:
+                # End the torn record, see __read_journal.
+                journal.write('\n')
+                self.journal_torn = False
+            for record in records:
+                journal.write(json.dumps(record) + '\n')
+            journal.flush()
+            os.fsync(journal.fileno())
+            size = journal.tell()
+        if self.journal_reader is not None:
+            # The journal was read up to here before appending (under process_lock), and these records are applied.
+            self.journal_offset = size
+        self.journal_records += len(records)
+        if self.journal_records >= self.journal_max_records or size >= self.journal_max_size:
+            self.compact()
+
+    def __flush(self, records):
+        with self.io_lock, self.instrumentation.phase('persist'):
+            if self.journal:
+                self.__append_journal(records)
+            else:
+                self.__write_db_file(set(record['model'] for record in records))
+
+    def __persist(self, op, model, pk, instance=None):
+        """
+        Persist a single mutation.
+        In journal mode this appends one record to FLAT_DATABASE_JOURNAL_FILE, otherwise the whole database is
+        rewritten. With FLAT_DATABASE_DURABILITY set to 'group' the mutation is queued for the background writer
+        instead, and several mutations share one write.
+        :param op: 'set' or 'delete'
+        :param model: The model name the mutation applies to.
+        :param pk: The primary key of the mutated instance.
+        :param instance: The new state of the instance, for 'set' mutations.
+        :return:
+        """
+        self.__persist_many([(op, model, pk, instance)])
+
+    def __persist_many(self, mutations):
+        """
+        Persist several mutations with a single write, see __persist.
+        :param mutations: A list of (op, model, pk, instance) tuples.
+        :return:
+        """
+        records = []
+        for op, model, pk, instance in mutations:
+            self.dirty.add(model)
+            record = {'op': op, 'model': model, 'pk': pk}
+            if self.journal and instance is not None:
+                record['item'] = self.__dump_instance(instance)
+            records.append(record)
+        if not records:
+            return
+        if self.writer is not None:
+            for record in records:
+                self.writer.submit(record)
+        else:
+            self.__flush(records)
+
+    @staticmethod
+    def __dump_instance(instance):
+        return instance.get_collection_item().to_dict()
+
+    def __load_instance(self, model, pk, record):
+        return self.models[model](pk, Template(record.get('data')))
+
+    def __new_table(self, model, next_key=0, segment=None):
+        """
+        Create the storage for a model's instances, as configured by FLAT_DATABASE_RECORD_STORE.
+        :param model: The model name to create storage for.
+        :param next_key: The next primary key to allocate.
+        :param segment: For the 'mapped' record store, the BinarySegment holding the model's instances, if any.
+        :return: An AutoKeyDict, PackedKeyDict or MappedKeyDict
+        """
+        if self.record_store == 'mapped':
+            table = self.MappedKeyDict(segment, lambda pk, record: self.__load_instance(model, pk, record))
+            table.next_key = max(table.next_key, next_key)
+        elif self.record_store == 'packed':
+            table = self.PackedKeyDict(self.models[model], next_key=next_key)
+        else:
+            table = self.AutoKeyDict(next_key=next_key)
+        self.database[model] = table
+        return table
+
+    def add_model(self, model_class):
+        super(FlatDatabase, self).add_model(model_class)
+        if self.layout == 'sharded':
+            # The table is loaded, and indexed, the first time it is used.
+            return
+        self.__add_table(model_class)
+
+    def __add_table(self, model_class):
+        """Build the table of a model from its records read from the database file, and its indexes."""
+        records = self.pending.pop(model_class.__name__, None)
+        if records is not None:
+            instances = self.__new_table(model_class.__name__, next_key=records.pop('next', 0))
+            for pk, record in records.items():
+                instances[int(pk)] = self.__load_instance(model_class.__name__, int(pk), record)
+        self.__build_indexes(model_class)
+
+    def __build_indexes(self, model_class):
+        """
+        Build the in-memory indexes of a model: an InvertedIndex of its __indexed__ fields (unless whoosh is
+        configured) and a SortedIndex per __sorted__ field.
+        """
+        model = model_class.__name__
+        text_indexed = self.search_index is None and isinstance(model_class.__indexed__, list) and \
+            model_class.__indexed__
+        sorted_fields = isinstance(model_class.__sorted__, list)
+        # Only go through the instances when there is something to index, as a mapped table decodes each of them.
+        instances = list(self.database[model].items()) if (text_indexed or sorted_fields) and \
+            model in self.database else []
+        if text_indexed:
+            index = self.text_indexes[model] = self.InvertedIndex(model_class.__indexed__)
+            for pk, instance in instances:
+                index.add(pk, instance)
+        if sorted_fields:
+            self.sorted_indexes[model] = dict((field, self.SortedIndex(field)) for field in model_class.__sorted__)
+            for index in self.sorted_indexes[model].values():
+                index.extend(instances)
+
+    def __get_indexes(self, model):
+        indexes = list(self.sorted_indexes.get(model, {}).values())
+        if model in self.text_indexes:
+            indexes.append(self.text_indexes[model])
+        return indexes
+
+    def index_instance(self, model, pk, instance):
+        super(FlatDatabase, self).index_instance(model, pk, instance)
+        with self.instrumentation.phase('index'):
+            for index in self.__get_indexes(model):
+                index.add(pk, instance)
+
+    def unindex_instance(self, model, pk):
+        super(FlatDatabase, self).unindex_instance(model, pk)
+        with self.instrumentation.phase('index'):
+            for index in self.__get_indexes(model):
+                index.remove(pk)
+
+    def flush(self, timeout=None):
+        """
+        Wait for the background writer to persist every queued mutation. Does nothing in 'sync' durability mode.
+        :param timeout: Maximum number of seconds to wait, or None to wait indefinitely.
+        :raises DatabaseError: If the writer failed to persist them. They stay queued, and are retried.
+        :return: True if everything queued has been persisted.
+        """
+        if self.writer is None:
+            return True
+        return self.writer.flush(timeout)
+
+    def close(self):
+        """
+        Flush queued mutations and stop the background writer, if any.
+        Registered with atexit in 'group' durability mode.
+        :return:
+        """
+        if self.writer is not None and self.writer.is_alive():
+            self.writer.stop()
+
+    def persistence_stats(self):
+        """
+        Get statistics about the background writer.
+        :return: A dict with queue_depth, flush_count, last_flush_latency and average_flush_latency (in seconds), or
+        None in 'sync' durability mode.
+        """
+        if self.writer is None:
+            return None
+        return self.writer.stats
+
+    def compact(self):
+        """
+        Fold the journal into a fresh snapshot and replace it with an empty journal of the next generation.
+        Replaying records that already made it into the snapshot is harmless, so a crash between the two steps
+        does not lose or duplicate data.
+        With FLAT_DATABASE_SHARED the snapshot must hold the changes of every process, so this holds process_lock and
+        catches up first. Other processes read the rest of the old journal before moving on to the new one.
+        :return:
+        """
+        if self.shared:
+            with self.__synchronized():
+                return self.__compact()
+        return self.__compact()
+
+    def __compact(self):
+        with self.io_lock:
+            self.__write_db_file()
+            if self.journal:
+                self.generation += 1
+                self.__write_journal_header()
+                if self.journal_reader is not None:
+                    self.__open_journal()
+            self.journal_records = 0
 
     def create(self, model, data, *args, **kwargs):
         response = Collection(href=self.app.config.get('API_ROOT'))
@@ -74,31 +1346,165 @@ class FlatDatabase(Database):
             data = Template(data)
         except (TypeError, ValueError, IndexError):
             abort(400)
-        if (self.models.get(model)) and (not self.database.get(model)):
-            self.database[model] = self.AutoKeyDict()
-        pk = self.database[model].get_next()
-        instance = self.models[model](pk, data)
-        self.database[model]['next'] = instance
-        self.__write_db_file()  # TODO: Thread/Multiprocess this
-        response.items.append(instance.get_collection_item())
+        with self.__synchronized():
+            if (self.models.get(model)) and (model not in self.database):
+                self.__new_table(model)
+            pk = self.database[model].get_next()
+            with self.instrumentation.phase('model'):
+                instance = self.models[model](pk, data)
+            self.database[model]['next'] = instance
+            self.__persist('set', model, pk, instance)
+            self.index_instance(model, pk, instance)
+        with self.instrumentation.phase('serialize'):
+            response.items.append(instance.get_collection_item())
         return response
 
-    def read(self, model, pk=None, *args, **kwargs):
-        response = Collection(href=self.app.config.get('API_ROOT'))
-        if self.database.get(model):
-            response.template = self.models[model].get_collection_template()
-            if pk is None:
-                for k, v in self.database[model].items():
-                    response.items.append(v.get_collection_item())
-            else:
-                instance = self.database[model].get(pk)
-                if instance:
-                    response.items.append(instance.get_collection_item())
+    def read(self, model, pk=None, *args, limit=None, cursor=None, after=None, order_by=None, filter_by=None,
+             stream=False, **kwargs):
+        with self.caught_up(model):
+            if not self.database.get(model):
+                abort(404)
+            template = self.models[model].get_collection_template()
+            links = None
+            with self.instrumentation.phase('query'):
+                if pk is None:
+                    limit, keys, direction = self.get_page_args(limit, cursor)
+                    candidates = self.__filter(model, filter_by) if filter_by else None
+                    if limit is None and keys is None and after is None and not order_by:
+                        if candidates is not None:
+                            instances = [self.database[model][key] for key in sorted(candidates)]
+                        elif stream:
+                            instances = self.__iter_instances(model)
+                        else:
+                            instances = self.database[model].values()
+                    else:
+                        instances, links = self.__read_page(model, limit, keys, direction, after, order_by, candidates)
                 else:
-                    abort(404)
+                    instance = self.database[model].get(pk)
+                    if not instance:
+                        abort(404)
+                    instances = [instance]
+
+            if stream:
+                return self.stream_collection(instances, template=template, links=links)
+            response = Collection(href=self.app.config.get('API_ROOT'), template=template, links=links)
+            with self.instrumentation.phase('serialize'):
+                for instance in instances:
+                    response.items.append(instance.get_collection_item())
             return response
+
+    def __filter(self, model, filter_by):
+        """
+        Find the primary keys of the instances matching every {field: value} pair in filter_by.
+        Fields with a SortedIndex are looked up in it, the remaining fields are only checked on the instances that
+        matched (or on every instance, if no filtered field is indexed.)
+        """
+        instances = self.database[model]
+        indexes = self.sorted_indexes.get(model, {})
+        candidates = None
+        unindexed = {}
+        for field, value in filter_by.items():
+            if field in indexes:
+                found = indexes[field].find(value)
+                candidates = found if candidates is None else candidates & found
+            else:
+                unindexed[field] = value
+        if unindexed:
+            candidates = set(
+                key for key in (candidates if candidates is not None else list(instances.keys()))
+                if all(getattr(instances[key], field, None) == value for field, value in unindexed.items())
+            )
+        return candidates
+
+    def __iter_instances(self, model, batch=1000):
+        """
+        Iterate over a model's instances in key order, seeking batch keys at a time.
+        Instances created or deleted during iteration are picked up or skipped rather than breaking it.
+        """
+        instances = self.database[model]
+        with self.lock:
+            page = self.seek(instances.sorted_keys, None, batch)
+        while page:
+            for key in page[:batch]:
+                with self.lock:
+                    instance = instances.get(key)
+                if instance is not None:
+                    yield instance
+            # seek again even after a short page, for the instances created while it was being consumed
+            with self.lock:
+                page = self.seek(instances.sorted_keys, page[min(len(page), batch) - 1], batch)
+
+    def __read_page(self, model, limit, keys, direction, after=None, order_by=None, candidates=None):
+        instances = self.database[model]
+        if after is not None and keys is None:
+            try:
+                after = int(after)
+            except (TypeError, ValueError):
+                abort(400)
+            if order_by:
+                if after not in instances:
+                    abort(404)
+                keys = [getattr(instances[after], order_by, None), after]
+            else:
+                keys = [after]
+        if order_by:
+            if keys is not None and len(keys) != 2:
+                abort(400)
+            index = self.sorted_indexes.get(model, {}).get(order_by)
+            if index is None:
+                # Without an index on order_by every listing has to sort the (filtered) table.
+                entries = sorted(
+                    (self.SortedIndex.sort_key(getattr(instances[key], order_by, None)), key)
+                    for key in (candidates if candidates is not None else list(instances.keys()))
+                )
+            elif candidates is not None:
+                entries = sorted(index.values[key] for key in candidates)
+            else:
+                entries = index.entries
+            if keys is not None:
+                keys = (self.SortedIndex.sort_key(keys[0]), keys[1])
+            page = [key for value, key in self.seek(entries, keys, limit, direction)]
         else:
-            abort(404)
+            if keys is not None and len(keys) != 1:
+                abort(400)
+            entries = sorted(candidates) if candidates is not None else instances.sorted_keys
+            page = self.seek(entries, keys[0] if keys is not None else None, limit, direction)
+        page, has_prev, has_next = self.get_page(page, limit, keys, direction)
+        page = [(key, instances[key]) for key in page]
+        links = None
+        if page:
+            links = self.get_page_links(
+                limit,
+                first=self.__get_keys(*page[0], order_by) if has_prev else None,
+                last=self.__get_keys(*page[-1], order_by) if has_next else None,
+                order_by=order_by
+            )
+        return [instance for key, instance in page], links
+
+    @staticmethod
+    def __get_keys(pk, instance, order_by=None):
+        if order_by:
+            return [getattr(instance, order_by, None), pk]
+        return [pk]
+
+    @staticmethod
+    def seek(entries, key=None, limit=None, direction='next'):
+        """
+        Find a page of a sorted list by bisecting for key.
+        :param entries: A sorted list of keys.
+        :param key: The key to seek past, or None to start from either end.
+        :param limit: The page size, or None for no limit. One extra entry is returned if there is more to see.
+        :param direction: "next" for entries after key in ascending order, "prev" for entries before key in
+        descending order.
+        :return: A list of up to limit + 1 entries.
+        """
+        if direction == 'prev':
+            end = len(entries) if key is None else bisect.bisect_left(entries, key)
+            start = 0 if limit is None else max(0, end - limit - 1)
+            return entries[start:end][::-1]
+        start = 0 if key is None else bisect.bisect_right(entries, key)
+        end = len(entries) if limit is None else start + limit + 1
+        return entries[start:end]
 
     def update(self, model, data, *args, pk=None, **kwargs):
         response = Collection(href=self.app.config.get('API_ROOT'))
@@ -106,13 +1512,22 @@ class FlatDatabase(Database):
             data = Template(data)
         except (TypeError, ValueError, IndexError):
             abort(400)
+        self.__refresh()
         if self.database.get(model):
-            response.template = self.database[model].get_collection_template()
+            response.template = self.models[model].get_collection_template()
             if self.database[model].get(pk):
-                instance = self.database[model][pk]
-                instance.update(data)
-                self.__write_db_file()
-                response.items.append(instance.get_collection_item())
+                with self.__synchronized():
+                    # Catching up may have deleted it.
+                    instance = self.database[model].get(pk)
+                    if not instance:
+                        abort(404)
+                    with self.instrumentation.phase('model'):
+                        instance.update(data)
+                    self.database[model][pk] = instance
+                    self.__persist('set', model, pk, instance)
+                    self.index_instance(model, pk, instance)
+                with self.instrumentation.phase('serialize'):
+                    response.items.append(instance.get_collection_item())
                 return response
             else:
                 abort(404)
@@ -120,14 +1535,305 @@ class FlatDatabase(Database):
             abort(404)
 
     def delete(self, model, pk=None, *args, **kwargs):
+        self.__refresh()
         if self.database.get(model):
             if self.database[model].get(pk):
-                del self.database[model][pk]
-                self.__write_db_file()
+                with self.__synchronized():
+                    if not self.database[model].get(pk):
+                        abort(404)
+                    del self.database[model][pk]
+                    self.__persist('delete', model, pk)
+                    self.unindex_instance(model, pk)
             else:
                 abort(404)
         else:
             abort(404)
 
-    def search(self, model, data, *args, **kwargs):
-        pass
\ No newline at end of file
+    def bulk_create(self, model, data, *args, **kwargs):
+        response = Collection(
+            href=self.app.config.get('API_ROOT'), template=self.models[model].get_collection_template()
+        )
+        created, errors = [], []
+        with self.__synchronized():
+            if (self.models.get(model)) and (model not in self.database):
+                self.__new_table(model)
+            for index, item in enumerate(data):
+                pk = self.database[model].get_next()
+                try:
+                    instance = self.models[model](pk, Template(item))
+                except (TypeError, ValueError, IndexError):
+                    errors.append((index, 400, 'malformed data'))
+                except DatabaseError as error:
+                    errors.append(self.get_item_error(index, error))
+                else:
+                    self.database[model]['next'] = instance
+                    created.append((pk, instance))
+            self.__persist_many([('set', model, pk, instance) for pk, instance in created])
+            for pk, instance in created:
+                self.index_instance(model, pk, instance)
+        response.items = [instance.get_collection_item() for pk, instance in created]
+        response.error = self.get_bulk_error(errors)
+        return response
+
+    def bulk_update(self, model, data, *args, **kwargs):
+        self.__refresh()
+        if not self.database.get(model):
+            abort(404)
+        response = Collection(
+            href=self.app.config.get('API_ROOT'), template=self.models[model].get_collection_template()
+        )
+        updated, errors = [], []
+        with self.__synchronized():
+            for index, (pk, item) in enumerate(self.get_bulk_updates(data)):
+                instance = self.__get_instance(model, pk)
+                if instance is None:
+                    errors.append((index, 404, 'not found'))
+                    continue
+                try:
+                    instance.update(Template(item))
+                except (TypeError, ValueError, IndexError):
+                    errors.append((index, 400, 'malformed data'))
+                except DatabaseError as error:
+                    errors.append(self.get_item_error(index, error))
+                else:
+                    self.database[model][int(pk)] = instance
+                    updated.append((int(pk), instance))
+            self.__persist_many([('set', model, pk, instance) for pk, instance in updated])
+            for pk, instance in updated:
+                self.index_instance(model, pk, instance)
+        response.items = [instance.get_collection_item() for pk, instance in updated]
+        response.error = self.get_bulk_error(errors)
+        return response
+
+    def bulk_delete(self, model, pks, *args, **kwargs):
+        self.__refresh()
+        if not self.database.get(model):
+            abort(404)
+        deleted, errors = [], []
+        with self.__synchronized():
+            for index, pk in enumerate(pks):
+                if self.__get_instance(model, pk) is None:
+                    errors.append((index, 404, 'not found'))
+                else:
+                    del self.database[model][int(pk)]
+                    deleted.append(int(pk))
+            self.__persist_many([('delete', model, pk, None) for pk in deleted])
+            for pk in deleted:
+                self.unindex_instance(model, pk)
+        return Collection(href=self.app.config.get('API_ROOT'), error=self.get_bulk_error(errors))
+
+    def __get_instance(self, model, pk):
+        """Look up an instance by a primary key that may not be an int yet, e.g. a JSON object key."""
+        try:
+            return self.database[model].get(int(pk))
+        except (TypeError, ValueError):
+            return None
+
+    def search(self, model, data, *args, page=1, pagelen=None, **kwargs):
+        with self.caught_up(model):
+            if not self.database.get(model):
+                abort(404)
+            if self.search_index is not None:
+                pks, links = self.search_index_page(model, data, page, pagelen)
+            elif model in self.text_indexes:
+                query, page, pagelen = self.get_search_args(data, page, pagelen)
+                try:
+                    with self.instrumentation.phase('query'):
+                        pks = self.text_indexes[model].search(query)
+                except ValueError:
+                    abort(400)
+                links = self.get_search_links(page, pagelen, len(pks))
+                pks = pks[(page - 1) * pagelen:page * pagelen]
+            else:
+                abort(501)
+            response = Collection(
+                href=self.app.config.get('API_ROOT'), template=self.models[model].get_collection_template(), links=links
+            )
+            with self.instrumentation.phase('serialize'):
+                for pk in pks:
+                    instance = self.database[model].get(pk)
+                    if instance is not None:
+                        response.items.append(instance.get_collection_item())
+            return response
+
+    def iter_instances(self, model):
+        with self.caught_up(model):
+            instances = self.database.get(model, {})
+            keys = list(instances.keys())
+        for key in keys:
+            with self.lock:
+                instance = instances.get(key)
+            if instance is not None:
+                yield key, instance
+
+
+def migrate(source, target, layout='sharded', encoding='json', journal_file=None):
+    """
+    Copy a FlatDatabase to another storage layout, e.g. from the single json file to sharded binary segments.
+    The source may be in either layout, its journal (if any) is folded in. Stop every process using the source first.
+    :param source: The FLAT_DATABASE_FILE of the database to copy.
+    :param target: The FLAT_DATABASE_FILE of the copy.
+    :param layout: The layout of the copy, 'file' or 'sharded'.
+    :param encoding: The encoding of the copy's segments in the sharded layout, 'json' or 'binary'.
+    :param journal_file: The journal of the source, defaults to source + '.journal'.
+    :return: A dict of {model: number of instances copied}
+    """
+    if os.path.abspath(source) == os.path.abspath(target):
+        raise DatabaseError('the source and target of a migration must differ')
+    tables = {}
+    with open(source) as source_file:
+        contents = json.load(source_file)
+    if contents.get('format') == SHARDED_FORMAT:
+        for model, entry in contents['models'].items():
+            next_key, records = FlatDatabase.read_segment(
+                FlatDatabase.get_segment_path(source, entry['segment']), entry['encoding']
+            )
+            tables[model] = (next_key, dict(records))
+    else:
+        for model, records in contents.items():
+            next_key = records.pop('next', 0)
+            tables[model] = (next_key, dict((int(pk), record) for pk, record in records.items()))
+    changes = {}
+    try:
+        with open(journal_file or source + '.journal') as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a torn record, see FlatDatabase.__read_journal
+                    continue
+                if 'op' not in record:
+                    # the header holding the journal's generation
+                    continue
+                changes.setdefault(record['model'], {})[int(record['pk'])] = record.get('item')
+    except FileNotFoundError:
+        pass
+    for model, model_changes in changes.items():
+        tables[model] = FlatDatabase.apply_changes(*tables.get(model, (0, {})), model_changes)
+    if layout == 'sharded':
+        manifest = {'format': SHARDED_FORMAT, 'version': 1, 'models': {}}
+        for model, (next_key, records) in tables.items():
+            segment = FlatDatabase.get_segment_name(target, model, encoding)
+            FlatDatabase.write_segment(
+                FlatDatabase.get_segment_path(target, segment), encoding, next_key, sorted(records.items())
+            )
+            manifest['models'][model] = {'segment': segment, 'encoding': encoding}
+        FlatDatabase.write_file(target, lambda target_file: json.dump(manifest, target_file))
+    else:
+        snapshot = {}
+        for model, (next_key, records) in tables.items():
+            snapshot[model] = dict((str(pk), record) for pk, record in records.items())
+            snapshot[model]['next'] = next_key
+        FlatDatabase.write_file(target, lambda target_file: json.dump(snapshot, target_file))
+    return dict((model, len(records)) for model, (next_key, records) in tables.items())
+
+
+def register_commands(app):
+    """
+    Register the "crudsdb-migrate" command with the flask cli, e.g.:
+        flask crudsdb-migrate db.json sharded/db.json --layout sharded --encoding binary
+    :param app: The flask application to register the command with.
+    :return:
+    """
+    @app.cli.command('crudsdb-migrate')
+    @click.argument('source')
+    @click.argument('target')
+    @click.option('--layout', type=click.Choice(['file', 'sharded']), default='sharded')
+    @click.option('--encoding', type=click.Choice(['json', 'binary']), default='json')
+    @click.option('--journal', default=None, help='The journal of the source, defaults to SOURCE.journal')
+    def migrate_command(source, target, layout, encoding, journal):
+        """Copy a flatfile database to another storage layout."""
+        for model, count in migrate(source, target, layout, encoding, journal).items():
+            click.echo('{model}: {count} instances copied'.format(model=model, count=count))
+
+
+class AsyncFlatDatabase(AsyncDatabase, FlatDatabase):
+    """
+    Flatfile flask_crudsdb wrapper for asyncio
+
+    Every call runs the FlatDatabase method in the executor. Writes, which persist to disk, run one at a time under an
+    asyncio lock, so waiting writers queue on the event loop instead of holding executor threads. Reads hold the lock
+    writes change the tables under, as they do in FlatDatabase (see caught_up), so a listing never sees a table change
+    size part way through, and catching up with other processes' changes (FLAT_DATABASE_SHARED) does not block the
+    event loop.
+    """
+
+    def __init__(self, app, executor=None, *args, **kwargs):
+        """
+        AsyncFlatDatabase Constructor
+        :param app: The flask application to tie this Database to.
+        :param executor: The concurrent.futures.Executor to persist changes in, defaults to the event loop's.
+        :return:
+        """
+        super(AsyncFlatDatabase, self).__init__(app, *args, **kwargs)
+        self.executor = executor
+        self.write_locks = weakref.WeakKeyDictionary()
+
+    def get_write_lock(self):
+        """
+        Get the asyncio lock of the running event loop, asyncio locks cannot be shared between loops.
+        FlatDatabase.lock still orders writes from different loops.
+        """
+        loop = asyncio.get_running_loop()
+        lock = self.write_locks.get(loop)
+        if lock is None:
+            lock = self.write_locks[loop] = asyncio.Lock()
+        return lock
+
+    async def write(self, method, *args, **kwargs):
+        """
+        Run a FlatDatabase write method in the executor, under the write lock.
+        :param method: The unbound FlatDatabase method, e.g. FlatDatabase.create
+        :return: What the method returned.
+        """
+        async with self.get_write_lock():
+            return await self.run_in_executor(method, self, *args, **kwargs)
+
+    def run_locked(self, method, model, *args, **kwargs):
+        """
+        Call a FlatDatabase method holding lock, as writes do while changing the tables. Runs in the executor.
+        With FLAT_DATABASE_SHARED, catching up with other processes takes process_lock beforehand, as in read, so reads
+        neither wait for each other nor hold up writers in other processes (see caught_up.)
+        :param method: The unbound method, e.g. AsyncFlatDatabase.list_instances
+        :param model: The model name the method reads.
+        :return: What the method returned.
+        """
+        with self.caught_up(model):
+            return method(self, model, *args, **kwargs)
+
+    async def create(self, model, data, *args, **kwargs):
+        return await self.write(FlatDatabase.create, model, data, *args, **kwargs)
+
+    async def read(self, model, pk=None, *args, **kwargs):
+        return await self.run_in_executor(FlatDatabase.read, self, model, pk, *args, **kwargs)
+
+    async def update(self, model, data, *args, **kwargs):
+        return await self.write(FlatDatabase.update, model, data, *args, **kwargs)
+
+    async def delete(self, model, *args, **kwargs):
+        return await self.write(FlatDatabase.delete, model, *args, **kwargs)
+
+    async def bulk_create(self, model, data, *args, **kwargs):
+        return await self.write(FlatDatabase.bulk_create, model, data, *args, **kwargs)
+
+    async def bulk_update(self, model, data, *args, **kwargs):
+        return await self.write(FlatDatabase.bulk_update, model, data, *args, **kwargs)
+
+    async def bulk_delete(self, model, pks, *args, **kwargs):
+        return await self.write(FlatDatabase.bulk_delete, model, pks, *args, **kwargs)
+
+    async def search(self, model, data, *args, **kwargs):
+        return await self.run_in_executor(FlatDatabase.search, self, model, data, *args, **kwargs)
+
+    def list_instances(self, model):
+        return list(FlatDatabase.iter_instances(self, model))
+
+    async def iter_instances(self, model):
+        for pair in await self.run_in_executor(self.run_locked, AsyncFlatDatabase.list_instances, model):
+            yield pair
+
+    async def reindex(self, model):
+        if self.search_index is None:
+            raise DatabaseError('WHOOSH_INDEX_DIR is not configured')
+        instances = await self.run_in_executor(self.run_locked, AsyncFlatDatabase.list_instances, model)
+        return await self.run_in_executor(self.search_index.reindex, self.models[model], instances)
@@ -0,0 +1,283 @@
+__author__ = 'Ian S. Evans'
+"""
+Timing and metrics of Database operations.
+
+An Instrumentation times every create, read, update, delete, search and bulk operation of the Databases it instruments,
+along with the phases the backends report inside them:
+    model: building or updating model instances from request data
+    query: looking instances up (a SQL query, or a scan or index lookup in memory)
+    persist: writing changes (a SQL commit, or FlatDatabase's file or journal write)
+    index: updating search and secondary indexes
+    serialize: building the Collection+JSON items of a response
+It keeps latency histograms and counters per operation and model, logs slow operations and sends the
+operation_started and operation_finished signals, which any blinker receiver (or flask signal handler) can subscribe to.
+
+Databases that are not instrumented report phases to a null object, and their methods are not wrapped at all.
+"""
+
+import bisect
+import collections
+import contextvars
+import functools
+import inspect
+import logging
+import threading
+import time
+from blinker import Namespace
+from flask import Response
+
+signals = Namespace()
+# Sent with the Database as sender and operation and model keyword arguments.
+operation_started = signals.signal('crudsdb-operation-started')
+# Sent with the Database as sender and operation, model, seconds, phases ({phase: seconds}) and error keyword arguments.
+operation_finished = signals.signal('crudsdb-operation-finished')
+
+OPERATIONS = ('create', 'read', 'update', 'delete', 'search', 'bulk_create', 'bulk_update', 'bulk_delete')
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+current_operation = contextvars.ContextVar('crudsdb_operation', default=None)
+
+
+class NullPhase(object):
+    """A phase that measures nothing."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_PHASE = NullPhase()
+
+
+class NullInstrumentation(object):
+    """The instrumentation of Databases that are not instrumented."""
+    enabled = False
+
+    def phase(self, name):
+        return NULL_PHASE
+
+
+NULL_INSTRUMENTATION = NullInstrumentation()
+
+
+class Histogram(object):
+    """
+    Counts of observed values per bucket, plus their sum and count, as in a prometheus histogram.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """
+        :return: A list of (upper bound, count of values at or under it) pairs, ending with float('inf').
+        """
+        total, counts = 0, []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            counts.append((bound, total))
+        return counts
+
+
+class Phase(object):
+    """Times a block of code and adds it to the current operation."""
+    __slots__ = ('instrumentation', 'name', 'start')
+
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.instrumentation.add_phase(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Instrumentation(object):
+    """
+    Collects timings of the operations of the Databases passed to instrument.
+    """
+    enabled = True
+
+    def __init__(self, app=None, slow_seconds=None, slow_log_size=None, buckets=BUCKETS):
+        """
+        Instrumentation Constructor
+        :param app: A flask application to read API_SLOW_OPERATION_SECONDS and API_SLOW_OPERATION_LOG_SIZE from.
+        :param slow_seconds: Operations taking at least this long are logged as slow, None to log none.
+        :param slow_log_size: The number of slow operations kept in slow_operations.
+        :param buckets: The upper bounds in seconds of the latency histogram buckets.
+        :return:
+        """
+        config = app.config if app is not None else {}
+        if slow_seconds is None:
+            slow_seconds = config.get('API_SLOW_OPERATION_SECONDS')
+        if slow_log_size is None:
+            slow_log_size = config.get('API_SLOW_OPERATION_LOG_SIZE', 100)
+        self.slow_seconds = slow_seconds
+        self.slow_operations = collections.deque(maxlen=slow_log_size)
+        self.buckets = tuple(buckets)
+        self.operations = {}
+        self.phases = {}
+        self.counters = collections.Counter()
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def instrument(self, database):
+        """
+        Wrap the operations of a Database instance, and have its backend report phases to this instrumentation.
+        :param database: The flask_crudsdb.Database (or AsyncDatabase) to instrument.
+        :return: The database.
+        """
+        database.instrumentation = self
+        for operation in OPERATIONS:
+            method = getattr(database, operation, None)
+            if method is not None:
+                setattr(database, operation, self.wrap(database, operation, method))
+        return database
+
+    def wrap(self, database, operation, method):
+        if inspect.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def instrumented(model, *args, **kwargs):
+                record, token = self.start(database, operation, model)
+                error = None
+                try:
+                    return await method(model, *args, **kwargs)
+                except BaseException as caught:
+                    error = caught
+                    raise
+                finally:
+                    self.finish(database, record, token, error)
+        else:
+            @functools.wraps(method)
+            def instrumented(model, *args, **kwargs):
+                record, token = self.start(database, operation, model)
+                error = None
+                try:
+                    return method(model, *args, **kwargs)
+                except BaseException as caught:
+                    error = caught
+                    raise
+                finally:
+                    self.finish(database, record, token, error)
+        return instrumented
+
+    def start(self, database, operation, model):
+        if operation_started.receivers:
+            operation_started.send(database, operation=operation, model=model)
+        record = {'operation': operation, 'model': model, 'phases': {}, 'start': time.perf_counter()}
+        return record, current_operation.set(record)
+
+    def finish(self, database, record, token, error=None):
+        seconds = time.perf_counter() - record['start']
+        current_operation.reset(token)
+        operation, model, phases = record['operation'], record['model'], record['phases']
+        outcome = 'ok' if error is None else 'error'
+        with self.lock:
+            self.get_histogram(self.operations, (operation, model)).observe(seconds)
+            for phase, phase_seconds in phases.items():
+                self.get_histogram(self.phases, (operation, model, phase)).observe(phase_seconds)
+            self.counters[(operation, model, outcome)] += 1
+        if self.slow_seconds is not None and seconds >= self.slow_seconds:
+            self.slow_operations.append({
+                'operation': operation, 'model': model, 'seconds': seconds, 'phases': dict(phases),
+                'outcome': outcome, 'time': time.time()
+            })
+            self.logger.warning('slow %s of %s took %.3fs %r', operation, model, seconds, phases)
+        if operation_finished.receivers:
+            operation_finished.send(
+                database, operation=operation, model=model, seconds=seconds, phases=phases, error=error
+            )
+
+    def get_histogram(self, histograms, key):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(self.buckets)
+        return histogram
+
+    def phase(self, name):
+        """
+        Time a phase of the current operation, e.g.:
+            with self.instrumentation.phase('persist'):
+                ...
+        Phases outside of any operation, e.g. on a background writer thread, are recorded under the operation
+        'background'.
+        :param name: The name of the phase.
+        :return: A context manager.
+        """
+        return Phase(self, name)
+
+    def add_phase(self, name, seconds):
+        record = current_operation.get()
+        if record is not None:
+            record['phases'][name] = record['phases'].get(name, 0.0) + seconds
+        else:
+            with self.lock:
+                self.get_histogram(self.phases, ('background', '', name)).observe(seconds)
+
+    def prometheus_text(self):
+        """
+        Render every metric in the prometheus text exposition format.
+        :return: A str.
+        """
+        lines = []
+        with self.lock:
+            self.render_histograms(
+                lines, 'crudsdb_operation_seconds', 'Latency of Database operations.', ('operation', 'model'),
+                self.operations
+            )
+            self.render_histograms(
+                lines, 'crudsdb_phase_seconds', 'Time spent in each phase of Database operations.',
+                ('operation', 'model', 'phase'), self.phases
+            )
+            lines.append('# HELP crudsdb_operations_total Database operations by outcome.')
+            lines.append('# TYPE crudsdb_operations_total counter')
+            for key, count in sorted(self.counters.items()):
+                labels = self.get_labels(('operation', 'model', 'outcome'), key)
+                lines.append('crudsdb_operations_total{%s} %d' % (labels, count))
+        lines.append('# HELP crudsdb_slow_operations Slow operations in the slow operation log.')
+        lines.append('# TYPE crudsdb_slow_operations gauge')
+        lines.append('crudsdb_slow_operations %d' % len(self.slow_operations))
+        return '\n'.join(lines) + '\n'
+
+    def render_histograms(self, lines, name, description, labels, histograms):
+        lines.append('# HELP {name} {description}'.format(name=name, description=description))
+        lines.append('# TYPE {name} histogram'.format(name=name))
+        for key, histogram in sorted(histograms.items()):
+            label_text = self.get_labels(labels, key)
+            for bound, count in histogram.cumulative():
+                lines.append('%s_bucket{%s,le="%s"} %d' % (
+                    name, label_text, '+Inf' if bound == float('inf') else repr(bound), count
+                ))
+            lines.append('%s_sum{%s} %r' % (name, label_text, histogram.sum))
+            lines.append('%s_count{%s} %d' % (name, label_text, histogram.count))
+
+    @staticmethod
+    def get_labels(names, values):
+        return ','.join('{0}="{1}"'.format(
+            name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        ) for name, value in zip(names, values))
+
+    def register_endpoint(self, app, rule='/metrics', endpoint='crudsdb_metrics'):
+        """
+        Serve prometheus_text from a flask route.
+        :param app: The flask application to add the route to.
+        :param rule: The URL rule of the route.
+        :param endpoint: The endpoint name of the route.
+        :return:
+        """
+        app.add_url_rule(rule, endpoint, lambda: Response(self.prometheus_text(), mimetype='text/plain; version=0.0.4'))
@@ -0,0 +1,252 @@
+__author__ = 'Ian S. Evans'
+
+import asyncio
+import atexit
+import click
+import inspect
+import json
+import logging
+import os
+import threading
+from whoosh import index
+from whoosh.fields import ID, Schema, TEXT
+from whoosh.qparser import MultifieldParser
+from whoosh.query import And
+
+
+class SearchIndex(object):
+    """
+    On-disk whoosh indexes of the __indexed__ fields of each model, one directory per model under WHOOSH_INDEX_DIR.
+
+    Changes are queued in memory and committed by a background thread, every WHOOSH_COMMIT_PERIOD seconds or as soon
+    as WHOOSH_COMMIT_LIMIT of them are queued, so writes to the database never wait on index commits. The thread takes
+    the queue and commits it without holding the lock that queuing a change takes. Searches read the last commit, so a
+    change is searchable once it is committed (see flush.)
+    """
+
+    def __init__(self, app, directory=None):
+        """
+        SearchIndex Constructor
+        :param app: The flask application to read configuration from.
+        :param directory: The directory to keep indexes in, defaults to WHOOSH_INDEX_DIR.
+        :return:
+        """
+        self.directory = directory or app.config.get('WHOOSH_INDEX_DIR')
+        self.period = app.config.get('WHOOSH_COMMIT_PERIOD', 2.0)
+        self.limit = app.config.get('WHOOSH_COMMIT_LIMIT', 100)
+        # The open index of each model, and the changes queued for it: {model name: {pk: document, or None to delete}}
+        self.indexes = {}
+        self.pending = {}
+        self.queued = 0
+        # lock guards indexes and pending, and is only held briefly. commit_lock keeps one whoosh writer open at a time.
+        self.lock = threading.RLock()
+        self.commit_lock = threading.Lock()
+        self.committer = None
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+
+    @staticmethod
+    def get_fields(model_class):
+        if isinstance(model_class.__indexed__, list):
+            return model_class.__indexed__
+        return []
+
+    @classmethod
+    def get_schema(cls, model_class):
+        fields = dict((field, TEXT) for field in cls.get_fields(model_class))
+        return Schema(pk=ID(stored=True, unique=True), **fields)
+
+    def get_index(self, model_class, clear=False):
+        """
+        Open the index of a model, creating it if it does not exist or if the model's __indexed__ fields changed.
+        :param model_class: The model class to open the index of.
+        :param clear: If true, always start from an empty index.
+        :return: A whoosh.index.Index
+        """
+        path = os.path.join(self.directory, model_class.__name__)
+        schema = self.get_schema(model_class)
+        if not clear and index.exists_in(path):
+            existing = index.open_dir(path)
+            if set(existing.schema.names()) == set(schema.names()):
+                return existing
+            existing.close()
+        os.makedirs(path, exist_ok=True)
+        return index.create_in(path, schema)
+
+    def get_handle(self, model_class):
+        """
+        Get the open index of a model, opening it (and starting the committer) the first time.
+        :param model_class: The model class to get the index of.
+        :return: A whoosh.index.Index
+        """
+        with self.lock:
+            handle = self.indexes.get(model_class.__name__)
+            if handle is None:
+                handle = self.indexes[model_class.__name__] = self.get_index(model_class)
+                if self.committer is None:
+                    self.committer = threading.Thread(
+                        target=self.commit_periodically, name='SearchIndex.committer', daemon=True
+                    )
+                    self.committer.start()
+                    atexit.register(self.close)
+            return handle
+
+    def commit_periodically(self):
+        while not self.stopped.is_set():
+            # without a period, only commit once WHOOSH_COMMIT_LIMIT changes are queued
+            self.wakeup.wait(self.period or None)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logging.getLogger(__name__).exception('SearchIndex background commit failed')
+
+    def queue(self, model_class, pk, document):
+        """
+        Queue the change of a document for the next commit, replacing any change of it queued before.
+        :param model_class: The model class of the instance.
+        :param pk: The primary key of the instance, encoded as its document's pk.
+        :param document: The new document, or None to delete it.
+        :return:
+        """
+        with self.lock:
+            self.get_handle(model_class)
+            self.pending.setdefault(model_class.__name__, {})[pk] = document
+            self.queued += 1
+            if self.queued >= self.limit:
+                self.wakeup.set()
+
+    def get_document(self, model_class, pk, instance):
+        document = {'pk': json.dumps(pk)}
+        for field in self.get_fields(model_class):
+            value = getattr(instance, field, None)
+            if value is not None:
+                document[field] = str(value)
+        return document
+
+    def add(self, model_class, pk, instance):
+        """
+        Add or replace the document of a model instance.
+        :param model_class: The model class of the instance.
+        :param pk: The primary key of the instance.
+        :param instance: The instance to index.
+        :return:
+        """
+        document = self.get_document(model_class, pk, instance)
+        self.queue(model_class, document['pk'], document)
+
+    def remove(self, model_class, pk):
+        """
+        Remove the document of a model instance.
+        :param model_class: The model class of the instance.
+        :param pk: The primary key of the instance.
+        :return:
+        """
+        self.queue(model_class, json.dumps(pk), None)
+
+    def search(self, model_class, query, page=1, pagelen=20):
+        """
+        Search the last commit of the index of a model.
+        :param model_class: The model class to search instances of.
+        :param query: A query string in whoosh's query language, searched across every __indexed__ field, or a dict
+        of {field: value} that must all match.
+        :param page: The page of results to return, starting at 1.
+        :param pagelen: The number of results per page.
+        :return: A tuple of (pks, total) where pks are the primary keys on the requested page, most relevant first,
+        and total is the number of matching instances.
+        """
+        fields = self.get_fields(model_class)
+        with self.get_handle(model_class).searcher() as searcher:
+            if isinstance(query, dict):
+                terms = []
+                for field, value in query.items():
+                    if field not in fields:
+                        raise ValueError('{field} is not indexed'.format(field=field))
+                    terms.append(MultifieldParser([field], searcher.schema).parse(str(value)))
+                parsed = And(terms)
+            else:
+                parsed = MultifieldParser(fields, searcher.schema).parse(query)
+            results = searcher.search_page(parsed, page, pagelen=pagelen)
+            return [json.loads(hit['pk']) for hit in results], len(results)
+
+    def reindex(self, model_class, instances):
+        """
+        Rebuild the index of a model from scratch.
+        :param model_class: The model class to rebuild the index of.
+        :param instances: An iterable of (pk, instance) pairs of every instance of the model.
+        :return: The number of instances indexed.
+        """
+        with self.commit_lock:
+            with self.lock:
+                # instances holds every change queued so far
+                self.pending.pop(model_class.__name__, None)
+            rebuilt = self.get_index(model_class, clear=True)
+            count = 0
+            with rebuilt.writer() as bulk:
+                for pk, instance in instances:
+                    bulk.add_document(**self.get_document(model_class, pk, instance))
+                    count += 1
+            with self.lock:
+                self.indexes[model_class.__name__] = rebuilt
+            return count
+
+    def flush(self):
+        """
+        Commit every queued change to disk now.
+        The queue is swapped for an empty one under the lock, and committed after releasing it, so changes queued
+        meanwhile do not wait for the commit. The changes of a model whose commit fails, e.g. with a LockError while
+        another process holds its index's writer, are queued again behind any newer change to the same instance.
+        :raises Exception: The first error a commit failed with, once every model has been tried.
+        :return:
+        """
+        error = None
+        with self.commit_lock:
+            with self.lock:
+                pending, self.pending, self.queued = self.pending, {}, 0
+                handles = dict((model, self.indexes[model]) for model in pending)
+            for model, changes in pending.items():
+                try:
+                    with handles[model].writer() as writer:
+                        for pk, document in changes.items():
+                            if document is None:
+                                writer.delete_by_term('pk', pk)
+                            else:
+                                writer.update_document(**document)
+                except Exception as exception:
+                    with self.lock:
+                        queued = self.pending.setdefault(model, {})
+                        for pk, document in changes.items():
+                            if pk not in queued:
+                                queued[pk] = document
+                                self.queued += 1
+                    error = error or exception
+        if error is not None:
+            raise error
+
+    def close(self):
+        """
+        Stop the committer and commit the queued changes.
+        :return:
+        """
+        self.stopped.set()
+        self.wakeup.set()
+        self.flush()
+
+
+def register_commands(app, database):
+    """
+    Register the "crudsdb-reindex" command with the flask cli, e.g.:
+        flask crudsdb-reindex ModelOne ModelTwo
+    :param app: The flask application to register the command with.
+    :param database: The flask_crudsdb.Database whose models are reindexed.
+    :return:
+    """
+    @app.cli.command('crudsdb-reindex')
+    @click.argument('models', nargs=-1)
+    def reindex(models):
+        """Rebuild the search index of the given models, or of every model."""
+        for model in models or list(database.models):
+            count = database.reindex(model)
+            if inspect.isawaitable(count):
+                count = asyncio.run(count)
+            click.echo('{model}: {count} instances indexed'.format(model=model, count=count))
@@ -1,12 +1,17 @@
 __author__ = 'Ian S. Evans'
 
+import logging
+import threading
+import time
 from collection_json import Collection, Template
-from flask_crudsdb import Database
-from flask import abort
+from flask_crudsdb import AsyncDatabase, Database, DatabaseError, Model
+from flask import abort, g
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import create_engine, BigInteger, Binary, Boolean, Column, Constraint, Date, DateTime, Enum, Float, \
+from sqlalchemy import create_engine, select, BigInteger, Boolean, Column, Constraint, Date, DateTime, Enum, Float, \
     ForeignKey, ForeignKeyConstraint, Index, Integer, Interval, LargeBinary, Numeric, PrimaryKeyConstraint, Sequence, \
-    String, Table, Text, Time, Unicode, UnicodeText, UniqueConstraint
+    String, Table, Text, Time, Unicode, UnicodeText, UniqueConstraint, and_, inspect, or_
+from sqlalchemy.exc import DBAPIError, DisconnectionError
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -15,14 +20,230 @@ from sqlalchemy.orm import sessionmaker
 SQLAlchemyModel = declarative_base()
 
 
+class ReplicaPool(object):
+    """
+    The read replicas of a SQLAlchemyDatabase, and the choice of which one serves each app context's reads.
+    A replica that fails is ejected for eject_seconds, then tried again.
+    """
+
+    balancings = ('round_robin', 'least_connections')
+
+    def __init__(self, engines, balancing='round_robin', eject_seconds=30.0):
+        """
+        ReplicaPool Constructor
+        :param engines: The engines of the replicas.
+        :param balancing: 'round_robin' to take turns, or 'least_connections' to pick the replica serving the fewest
+        app contexts (taking turns between equals.)
+        :param eject_seconds: How long a replica that failed is left out.
+        :return:
+        """
+        if balancing not in self.balancings:
+            raise DatabaseError('Unknown balancing %r, expected one of %s' % (balancing, ', '.join(self.balancings)))
+        self.engines = list(engines)
+        self.session_factories = [sessionmaker(bind=engine) for engine in self.engines]
+        self.balancing = balancing
+        self.eject_seconds = eject_seconds
+        self.active = [0] * len(self.engines)
+        self.ejected_until = [0.0] * len(self.engines)
+        self.next = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Pick the replica to serve an app context's reads, until release.
+        :return: The replica's index, or None if every replica is ejected.
+        """
+        with self.lock:
+            now = time.monotonic()
+            # healthy replicas in turn, starting at the one after the last picked
+            order = [
+                index % len(self.engines) for index in range(self.next, self.next + len(self.engines))
+                if self.ejected_until[index % len(self.engines)] <= now
+            ]
+            if not order:
+                return None
+            if self.balancing == 'least_connections':
+                index = min(order, key=lambda index: self.active[index])
+            else:
+                index = order[0]
+            self.next = index + 1
+            self.active[index] += 1
+            return index
+
+    def release(self, index):
+        with self.lock:
+            self.active[index] -= 1
+
+    def eject(self, index, error=None):
+        """
+        Leave a replica out for eject_seconds.
+        :param index: The index of the replica.
+        :param error: The error it failed with, to log.
+        :return:
+        """
+        with self.lock:
+            self.ejected_until[index] = time.monotonic() + self.eject_seconds
+        logging.getLogger(__name__).warning(
+            'Ejecting read replica %r for %s seconds: %s', self.engines[index].url, self.eject_seconds, error
+        )
+
+    @property
+    def stats(self):
+        """A list of each replica's url (without its password), number of app contexts served and ejection state."""
+        now = time.monotonic()
+        return [
+            {'url': repr(engine.url), 'active': active, 'ejected': ejected_until > now}
+            for engine, active, ejected_until in zip(self.engines, self.active, self.ejected_until)
+        ]
+
+
 class SQLAlchemyDatabase(Database):
     """
     SQL flask_crudsdb wrapper
     """
 
+    # Flask config keys mapped to the create_engine arguments they set.
+    engine_config = (
+        ('SQLALCHEMY_POOL_SIZE', 'pool_size'),
+        ('SQLALCHEMY_MAX_OVERFLOW', 'max_overflow'),
+        ('SQLALCHEMY_POOL_TIMEOUT', 'pool_timeout'),
+        ('SQLALCHEMY_POOL_RECYCLE', 'pool_recycle'),
+        ('SQLALCHEMY_POOL_PRE_PING', 'pool_pre_ping')
+    )
+
+    read_modes = ('orm', 'core')
+
     def __init__(self, app):
-        super(Database, self).__init__(app)
-        self.database = create_engine(app.config.get('SQLALCHEMY_DATABASE_URI'))
+        super(SQLAlchemyDatabase, self).__init__(app)
+        self.database = create_engine(app.config.get('SQLALCHEMY_DATABASE_URI'), **self.get_engine_options(app))
+        self.session_factory = sessionmaker(bind=self.database)
+        self.read_mode = self.get_read_mode(app.config.get('SQLALCHEMY_READ_MODE', 'orm'))
+        self.row_columns = {}
+        self.replicas = None
+        if app.config.get('SQLALCHEMY_REPLICA_URIS'):
+            self.replicas = ReplicaPool(
+                [create_engine(uri, **self.get_engine_options(app)) for uri in app.config['SQLALCHEMY_REPLICA_URIS']],
+                balancing=app.config.get('SQLALCHEMY_REPLICA_BALANCING', 'round_robin'),
+                eject_seconds=app.config.get('SQLALCHEMY_REPLICA_EJECT_SECONDS', 30.0)
+            )
+        self.read_your_writes = app.config.get('SQLALCHEMY_READ_YOUR_WRITES', True)
+        app.teardown_appcontext(self.remove_session)
+
+    @classmethod
+    def get_read_mode(cls, read_mode):
+        if read_mode not in cls.read_modes:
+            raise DatabaseError('Unknown read mode %r, expected one of %s' % (read_mode, ', '.join(cls.read_modes)))
+        return read_mode
+
+    @classmethod
+    def get_engine_options(cls, app):
+        """
+        Get the keyword arguments for create_engine from the app config.
+        Pool options are only passed when configured, since not every pool class accepts them (e.g., sqlite's).
+        SQLALCHEMY_ENGINE_OPTIONS may hold any other create_engine arguments.
+        :param app: The flask application to read configuration from.
+        :return: A dict of keyword arguments.
+        """
+        options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+        for key, option in cls.engine_config:
+            if app.config.get(key) is not None:
+                options.setdefault(option, app.config[key])
+        return options
+
+    @property
+    def session(self):
+        """
+        The session for the current app context.
+        It is created on first use and reused by every call in the same app context, then closed when the app context
+        is torn down.
+        """
+        sessions = g.setdefault('crudsdb_sessions', {})
+        if self not in sessions:
+            sessions[self] = self.session_factory()
+        return sessions[self]
+
+    @property
+    def read_session(self):
+        """
+        The session for reads in the current app context.
+        With SQLALCHEMY_REPLICA_URIS, it is a session of the replica picked the first time the app context reads (see
+        ReplicaPool), kept for the rest of it so that pages of a listing come from the same replica. Reads go to the
+        primary's session when there are no replicas or none is healthy, and, with SQLALCHEMY_READ_YOUR_WRITES, once
+        the app context has written.
+        """
+        if self.replicas is None or self in g.get('crudsdb_pinned', ()):
+            return self.session
+        sessions = g.setdefault('crudsdb_read_sessions', {})
+        if self not in sessions:
+            index = self.replicas.acquire()
+            if index is None:
+                return self.session
+            sessions[self] = (index, self.replicas.session_factories[index]())
+        return sessions[self][1]
+
+    def run_read(self, query):
+        """
+        Run a read on the read session, failing over to another replica, or the primary, if its replica fails.
+        A replica is only ejected when it cannot be connected to or drops the connection; any other error, e.g. of a
+        query naming a missing table, is raised as it would be on the primary.
+        :param query: A function of the session to read in.
+        :return: What query returned.
+        """
+        while True:
+            session = self.read_session
+            connected = False
+            try:
+                session.connection()
+                connected = True
+                return query(session)
+            except (DBAPIError, DisconnectionError) as error:
+                sessions = g.get('crudsdb_read_sessions', {})
+                if self not in sessions or sessions[self][1] is not session:
+                    raise
+                if connected and not isinstance(error, DisconnectionError) and not error.connection_invalidated:
+                    raise
+                index, session = sessions.pop(self)
+                session.close()
+                self.replicas.release(index)
+                self.replicas.eject(index, error)
+
+    def commit(self, expire=True):
+        """
+        Commit the current app context's session. With SQLALCHEMY_READ_YOUR_WRITES, the app context reads from the
+        primary from then on.
+        :param expire: If false, the session's instances keep their state after the commit instead of being reloaded
+        the next time they are read. The caller should expire them once it is done with them.
+        :return:
+        :raises sqlalchemy.exc.SQLAlchemyError: If the commit fails, once the session is rolled back for reuse.
+        """
+        if self.replicas is not None and self.read_your_writes:
+            g.setdefault('crudsdb_pinned', set()).add(self)
+        session = self.session
+        expire_on_commit, session.expire_on_commit = session.expire_on_commit, expire
+        try:
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.expire_on_commit = expire_on_commit
+
+    def remove_session(self, exception=None):
+        """
+        Close the current app context's sessions, rolling back anything uncommitted.
+        Registered with app.teardown_appcontext.
+        :param exception: The exception that ended the app context, if any.
+        :return:
+        """
+        session = g.get('crudsdb_sessions', {}).pop(self, None)
+        if session is not None:
+            if exception is not None:
+                session.rollback()
+            session.close()
+        replica = g.get('crudsdb_read_sessions', {}).pop(self, None)
+        if replica is not None:
+            replica[1].close()
+            self.replicas.release(replica[0])
 
     def create(self, model, data, **kwargs):
         """
@@ -38,38 +259,231 @@ class SQLAlchemyDatabase(Database):
         except (TypeError, ValueError, IndexError):
             abort(400)
         # letting this raise a KeyError on purpose, flask returns HTTP 500 on python errors
-        instance = self.models[model](data)
-        session = sessionmaker(bind=self.database)
-        session.add(instance)
-        session.commit()
-        return Collection(href=self.app.config.get('API_ROOT'), items=[instance.get_collection_item()])
+        with self.instrumentation.phase('model'):
+            instance = self.models[model](data)
+        with self.instrumentation.phase('persist'):
+            self.session.add(instance)
+            self.commit()
+        self.index_instance(model, self.get_pk(instance), instance)
+        with self.instrumentation.phase('serialize'):
+            return Collection(href=self.app.config.get('API_ROOT'), items=[instance.get_collection_item()])
 
-    def read(self, model, pk=None, **kwargs):
+    def read(self, model, pk=None, limit=None, cursor=None, after=None, order_by=None, filter_by=None, stream=False,
+             read_mode=None, **kwargs):
         """
         Read the database for a model instance by id.
+        Listings are paginated by seeking past the order_by column and primary key of the previous page, see
+        flask_crudsdb.Database.read. In the 'core' read mode, listings select only the columns of the model's fields
+        and build items straight from the rows, without loading instances into the session (see get_row_select.)
+        Reads run on read_session, a replica when SQLALCHEMY_REPLICA_URIS is set.
         :param model: The model name to look for instances of.
         :type model: str
         :param pk: The primary key of the model instance to attempt to read.
+        :param limit: The maximum number of instances to list.
+        :param cursor: An opaque cursor from the "next" or "prev" link of a previous page.
+        :param after: A primary key, list the instances that come after it.
+        :param order_by: The name of the attribute to order listed instances by.
+        :param filter_by: A dict of {attribute name: value} to filter listed instances by.
+        :param stream: If true, return a generator of Collection+JSON text. Unpaginated listings are then fetched from
+        the database in batches of SQLALCHEMY_STREAM_BATCH rows rather than all at once.
+        :param read_mode: 'orm' or 'core', overrides SQLALCHEMY_READ_MODE for this call.
         :param kwargs:
         :return: Collection representation of resource(s) retrieved from the database.
         """
         # letting self.models[model] raise a KeyError on purpose, see above
-        response = Collection(
-            href=self.app.config.get('API_ROOT'), template=self.models[model].get_collection_template()
-        )
-        session = sessionmaker(bind=self.database)
-        if pk is None:
-            instances = session.query(self.models[model])
-            if kwargs.get('order_by'):
-                instances = instances.order_by(getattr(self.models[model], kwargs['order_by']))
-        else:
-            instances = session.query(self.models[model]).get(pk)
-            if instances is None:
-                abort(404)
-        for instance in instances:
-            response.items.append(instance.get_collection_item())
+        template = self.models[model].get_collection_template()
+        links = None
+        rows = self.get_row_select(model, order_by, read_mode) if pk is None else None
+
+        def query(session):
+            if pk is not None:
+                instance = session.query(self.models[model]).get(pk)
+                if instance is None:
+                    abort(404)
+                return [instance], None
+            instances = session.query(self.models[model]) if rows is None else rows
+            if filter_by:
+                instances = instances.filter_by(**filter_by) if rows is None else \
+                    self.filter_rows(model, instances, filter_by)
+            page_limit, keys, direction = self.get_page_args(limit, cursor)
+            if page_limit is None and keys is None and after is None:
+                if order_by:
+                    instances = instances.order_by(getattr(self.models[model], order_by))
+                batch = self.app.config.get('SQLALCHEMY_STREAM_BATCH', 1000)
+                if rows is not None:
+                    if stream:
+                        return session.execute(instances.execution_options(yield_per=batch)), None
+                    return session.execute(instances).all(), None
+                return (instances.yield_per(batch) if stream else instances.all()), None
+            return self.read_page(
+                model, instances, page_limit, keys, direction, after, order_by, rows=rows is not None, session=session
+            )
+
+        with self.instrumentation.phase('query'):
+            instances, links = self.run_read(query)
+
+        get_item = self.models[model].__schema__.get_row_item if rows is not None else None
+        if stream:
+            return self.stream_collection(instances, template=template, links=links, get_item=get_item)
+        response = Collection(href=self.app.config.get('API_ROOT'), template=template, links=links)
+        with self.instrumentation.phase('serialize'):
+            if get_item is not None:
+                response.items.extend(get_item(row) for row in instances)
+            else:
+                for instance in instances:
+                    response.items.append(instance.get_collection_item())
         return response
 
+    def get_row_columns(self, model):
+        """
+        Get the columns a 'core' read selects for a model: its fields, in the order of its schema, then the rest of its
+        primary key. Collected once per model.
+        :param model: The model name.
+        :return: A list of (attribute name, Column) pairs, or None if the model's items cannot be built from rows: when
+        it overrides get_collection_item, or any of its fields is not a column.
+        """
+        if model not in self.row_columns:
+            model_class = self.models[model]
+            mapper = inspect(model_class)
+            keys = [mapper.get_property_by_column(column).key for column in mapper.primary_key]
+            fields = model_class.__schema__.fields
+            columns = None
+            if model_class.get_collection_item is Model.get_collection_item and \
+                    all(key in mapper.column_attrs for key in fields):
+                columns = [(key, mapper.column_attrs[key].columns[0]) for key in fields]
+                columns.extend((key, mapper.column_attrs[key].columns[0]) for key in keys if key not in fields)
+            self.row_columns[model] = columns
+        return self.row_columns[model]
+
+    def get_row_select(self, model, order_by=None, read_mode=None):
+        """
+        Build the select() of a 'core' listing, if that is the read mode and the model supports it.
+        Rows hold the model's fields, then its primary key and the order_by column, labelled with their attribute names
+        so that get_keys, get_row_item and the model's get_row_endpoint can read them as attributes.
+        :param model: The model name being listed.
+        :param order_by: The name of the attribute the listing is ordered by.
+        :param read_mode: 'orm' or 'core', defaults to the configured SQLALCHEMY_READ_MODE.
+        :return: A select() of the model's table, or None to list instances through the ORM.
+        """
+        read_mode = self.read_mode if read_mode is None else self.get_read_mode(read_mode)
+        columns = self.get_row_columns(model) if read_mode == 'core' else None
+        if columns is None:
+            return None
+        if order_by and order_by not in [key for key, column in columns]:
+            columns = columns + [(order_by, getattr(self.models[model], order_by))]
+        return select(*[column.label(key) for key, column in columns])
+
+    def filter_rows(self, model, rows, filter_by):
+        """
+        Restrict a select() from get_row_select to rows whose attributes equal the values of filter_by, like
+        Query.filter_by does for instances.
+        :param model: The model name being listed.
+        :param rows: The select().
+        :param filter_by: A dict of {attribute name: value}.
+        :return: The restricted select().
+        """
+        return rows.where(*[getattr(self.models[model], key) == value for key, value in filter_by.items()])
+
+    def read_page(self, model, instances, limit, keys, direction, after=None, order_by=None, rows=False,
+                  session=None):
+        """
+        Seek to one page of a listing.
+        :param model: The model name being listed.
+        :param instances: The query to page through.
+        :param limit: The page size, or None for no limit.
+        :param keys: The key values to seek past, from a cursor.
+        :param direction: "next" or "prev"
+        :param after: A primary key to seek past when there is no cursor.
+        :param order_by: The name of the attribute to order by.
+        :param rows: If true, instances is a select() from get_row_select, and the page holds rows.
+        :param session: The session to query in, the app context's session by default.
+        :return: A tuple of (instances, links)
+        """
+        session = self.session if session is None else session
+        columns = self.get_key_columns(self.models[model], order_by)
+        if keys is None and after is not None:
+            # after comes from the query string, so compare it as the primary key column types
+            after = self.normalize_pk(model, after)
+            if order_by:
+                anchor = session.query(self.models[model]).get(after)
+                if anchor is None:
+                    abort(404)
+                keys = self.get_keys(anchor, columns)
+            else:
+                keys = list(after) if isinstance(after, tuple) else [after]
+        instances = self.seek_page(instances, columns, limit, keys, direction)
+        instances = session.execute(instances).all() if rows else instances.all()
+        return self.get_page_result(instances, columns, limit, keys, direction, order_by)
+
+    def seek_page(self, query, columns, limit, keys, direction):
+        """
+        Restrict a query to one page of a listing, fetching one extra row to tell whether there is another page.
+        :param query: A Query or select() of the instances being listed.
+        :param columns: The key columns, see get_key_columns.
+        :param limit: The page size, or None for no limit.
+        :param keys: The key values to seek past, or None to start at the beginning.
+        :param direction: "next" or "prev"
+        :return: The restricted query.
+        """
+        if keys is not None:
+            if len(keys) != len(columns):
+                abort(400)
+            query = query.filter(self.get_seek_condition(columns, keys, direction))
+        query = query.order_by(*[column.desc() if direction == 'prev' else column for column in columns])
+        if limit is not None:
+            query = query.limit(limit + 1)
+        return query
+
+    def get_page_result(self, rows, columns, limit, keys, direction, order_by=None):
+        """
+        Trim the rows fetched by a seek_page query to the page and link to its neighbours.
+        :return: A tuple of (instances, links)
+        """
+        instances, has_prev, has_next = self.get_page(rows, limit, keys, direction)
+        links = None
+        if instances:
+            links = self.get_page_links(
+                limit,
+                first=self.get_keys(instances[0], columns) if has_prev else None,
+                last=self.get_keys(instances[-1], columns) if has_next else None,
+                order_by=order_by
+            )
+        return instances, links
+
+    @staticmethod
+    def get_key_columns(model_class, order_by=None):
+        """
+        Get the columns a listing of model_class is ordered and sought by: order_by (if any) then the primary key.
+        :param model_class: The model class being listed.
+        :param order_by: The name of the attribute to order by.
+        :return: A list of instrumented attributes.
+        """
+        mapper = inspect(model_class)
+        columns = [getattr(model_class, mapper.get_property_by_column(column).key) for column in mapper.primary_key]
+        if order_by and order_by not in [column.key for column in columns]:
+            columns.insert(0, getattr(model_class, order_by))
+        return columns
+
+    @staticmethod
+    def get_keys(instance, columns):
+        return [getattr(instance, column.key) for column in columns]
+
+    @staticmethod
+    def get_seek_condition(columns, keys, direction):
+        """
+        Build the WHERE clause selecting rows past keys, e.g. for two columns moving forward:
+        (a > :a) OR (a = :a AND b > :b)
+        :param columns: The columns the listing is ordered by.
+        :param keys: The values of columns on the row to seek past.
+        :param direction: "next" or "prev"
+        :return: A SQLAlchemy boolean clause.
+        """
+        condition = None
+        for column, key in reversed(list(zip(columns, keys))):
+            past = column < key if direction == 'prev' else column > key
+            condition = past if condition is None else or_(past, and_(column == key, condition))
+        return condition
+
     def update(self, model, data, pk=None, **kwargs):
         """
         Update a model instance in the database.
@@ -85,13 +499,20 @@ class SQLAlchemyDatabase(Database):
             abort(400)
 
         # letting self.models[model] raise a KeyError on purpose, see above
-        instance = self.models[model].query.get_or_404(pk)
-        instance.update(data)
-        self.database.session.commit()
-        return Collection(
-            href=self.app.config.get('API_ROOT'), template=self.models[model].get_collection_template(),
-            items=[instance.get_collection_item()]
-        )
+        with self.instrumentation.phase('query'):
+            instance = self.session.query(self.models[model]).get(pk)
+        if instance is None:
+            abort(404)
+        with self.instrumentation.phase('model'):
+            instance.update(data)
+        with self.instrumentation.phase('persist'):
+            self.commit()
+        self.index_instance(model, self.get_pk(instance), instance)
+        with self.instrumentation.phase('serialize'):
+            return Collection(
+                href=self.app.config.get('API_ROOT'), template=self.models[model].get_collection_template(),
+                items=[instance.get_collection_item()]
+            )
 
     def delete(self, model, pk=None, **kwargs):
         """
@@ -102,9 +523,430 @@ class SQLAlchemyDatabase(Database):
         :return:
         """
         # letting self.models[model] raise a KeyError on purpose, see above
-        instance = self.models[model].query.get_or_404(pk)
-        self.database.session.delete(instance)
-        self.database.session.commit()
+        with self.instrumentation.phase('query'):
+            instance = self.session.query(self.models[model]).get(pk)
+        if instance is None:
+            abort(404)
+        with self.instrumentation.phase('persist'):
+            self.session.delete(instance)
+            self.commit()
+        self.unindex_instance(model, self.normalize_pk(model, pk))
+
+    def bulk_create(self, model, data, **kwargs):
+        """
+        Create many new instances of a model in a single transaction.
+        Instances that fail validation are reported in the returned collection's error, the rest are committed.
+        :param model: The model name to create instances of.
+        :param data: A list of Collection+JSON data arrays, one per instance.
+        :param kwargs:
+        :return: Collection representation of the created resources.
+        """
+        # letting self.models[model] raise a KeyError on purpose, see above
+        instances, errors = [], []
+        for index, item in enumerate(data):
+            try:
+                instances.append(self.models[model](Template(item)))
+            except (TypeError, ValueError, IndexError):
+                errors.append((index, 400, 'malformed data'))
+            except DatabaseError as error:
+                errors.append(self.get_item_error(index, error))
+        self.session.add_all(instances)
+        # index and serialize the instances as committed, rather than reloading each of them
+        self.commit(expire=False)
+        for instance in instances:
+            self.index_instance(model, self.get_pk(instance), instance)
+        collection = Collection(
+            href=self.app.config.get('API_ROOT'), template=self.models[model].get_collection_template(),
+            items=[instance.get_collection_item() for instance in instances], error=self.get_bulk_error(errors)
+        )
+        self.session.expire_all()
+        return collection
+
+    def bulk_update(self, model, data, **kwargs):
+        """
+        Update many instances of a model in a single transaction.
+        Every instance is loaded with one query. Instances that are missing or fail validation are reported in the
+        returned collection's error, the rest are committed.
+        :param model: The model name to update instances of.
+        :param data: A dict of {primary key: Collection+JSON data array}, or a list of (primary key, data array) pairs.
+        :param kwargs:
+        :return: Collection representation of the updated resources.
+        """
+        updates = self.get_bulk_updates(data)
+        instances = self.get_instances(model, [pk for pk, item in updates])
+        updated, errors = [], []
+        for index, (pk, item) in enumerate(updates):
+            instance = instances.get(self.normalize_pk(model, pk))
+            if instance is None:
+                errors.append((index, 404, 'not found'))
+                continue
+            try:
+                instance.update(Template(item))
+            except (TypeError, ValueError, IndexError):
+                errors.append((index, 400, 'malformed data'))
+            except DatabaseError as error:
+                errors.append(self.get_item_error(index, error))
+            else:
+                updated.append((pk, instance))
+        # instances that failed part way through update must not be flushed with the others
+        for index, code, message in errors:
+            instance = instances.get(self.normalize_pk(model, updates[index][0]))
+            if instance is not None:
+                self.session.expire(instance)
+        # the updates are flushed as one executemany per set of changed columns, see bulk_create for expire=False
+        self.commit(expire=False)
+        for pk, instance in updated:
+            self.index_instance(model, self.get_pk(instance), instance)
+        collection = Collection(
+            href=self.app.config.get('API_ROOT'), template=self.models[model].get_collection_template(),
+            items=[instance.get_collection_item() for pk, instance in updated], error=self.get_bulk_error(errors)
+        )
+        self.session.expire_all()
+        return collection
+
+    def bulk_delete(self, model, pks, **kwargs):
+        """
+        Delete many instances of a model in a single transaction.
+        :param model: The model name to delete instances of.
+        :param pks: A list of primary keys.
+        :param kwargs:
+        :return: A Collection, primary keys that were not found are reported in its error.
+        """
+        instances = self.get_instances(model, pks)
+        errors = []
+        for index, pk in enumerate(pks):
+            instance = instances.get(self.normalize_pk(model, pk))
+            if instance is None:
+                errors.append((index, 404, 'not found'))
+            else:
+                self.session.delete(instance)
+        self.commit()
+        for pk in pks:
+            if self.normalize_pk(model, pk) in instances:
+                self.unindex_instance(model, self.normalize_pk(model, pk))
+        return Collection(href=self.app.config.get('API_ROOT'), error=self.get_bulk_error(errors))
+
+    def get_instances(self, model, pks, session=None):
+        """
+        Load many instances of a model by primary key, with one query for single column primary keys.
+        :param model: The model name to load instances of.
+        :param pks: A list of primary keys.
+        :param session: The session to query in, the app context's session by default.
+        :return: A dict of {normalize_pk(pk): instance} for every instance found.
+        """
+        session = self.session if session is None else session
+        columns = inspect(self.models[model]).primary_key
+        if not pks:
+            return {}
+        if len(columns) == 1:
+            keys = [self.normalize_pk(model, pk) for pk in pks]
+            query = session.query(self.models[model]).filter(columns[0].in_(keys))
+            return dict((self.normalize_pk(model, self.get_pk(instance)), instance) for instance in query)
+        instances = {}
+        for pk in pks:
+            instance = session.query(self.models[model]).get(self.normalize_pk(model, pk))
+            if instance is not None:
+                instances[self.normalize_pk(model, pk)] = instance
+        return instances
+
+    def normalize_pk(self, model, pk):
+        """
+        Normalize a primary key from a request, e.g. the string keys of a JSON object, for looking up loaded instances.
+        :param model: The model name the primary key belongs to.
+        :param pk: The primary key, a list for composite primary keys.
+        :return: The primary key converted to the column types where possible, as a tuple for composite primary keys.
+        """
+        columns = inspect(self.models[model]).primary_key
+        values = list(pk) if isinstance(pk, (list, tuple)) else [pk]
+        for index, (column, value) in enumerate(zip(columns, values)):
+            try:
+                if not isinstance(value, column.type.python_type):
+                    values[index] = column.type.python_type(value)
+            except (NotImplementedError, TypeError, ValueError):
+                pass
+        return tuple(values) if len(columns) > 1 else values[0]
+
+    def search(self, model, data, page=1, pagelen=None, **kwargs):
+        """
+        Search the whoosh index of a model and read the matching instances from read_session.
+        :param model: The model name to search instances of.
+        :param data: A query string, or a Collection+JSON data array (or dict) of field names and values to match.
+        :param page: The page of results to return, starting at 1.
+        :param pagelen: The number of results per page.
+        :param kwargs:
+        :return: Collection representation of the matching resources, most relevant first.
+        """
+        # letting self.models[model] raise a KeyError on purpose, see above
+        pks, links = self.search_index_page(model, data, page, pagelen)
+        response = Collection(
+            href=self.app.config.get('API_ROOT'), template=self.models[model].get_collection_template(), links=links
+        )
+        with self.instrumentation.phase('query'):
+            instances = self.run_read(lambda session: self.get_instances(model, pks, session=session))
+        with self.instrumentation.phase('serialize'):
+            for pk in pks:
+                instance = instances.get(self.normalize_pk(model, pk))
+                if instance is not None:
+                    response.items.append(instance.get_collection_item())
+        return response
+
+    def iter_instances(self, model):
+        for instance in self.session.query(self.models[model]).yield_per(
+                self.app.config.get('SQLALCHEMY_STREAM_BATCH', 1000)):
+            yield self.get_pk(instance), instance
+
+    @staticmethod
+    def get_pk(instance):
+        """
+        Get the primary key of a persisted instance.
+        :param instance: The model instance.
+        :return: The primary key value, or a list of values for composite primary keys.
+        """
+        identity = inspect(instance).identity
+        return identity[0] if len(identity) == 1 else list(identity)
+
+
+class AsyncSQLAlchemyDatabase(AsyncDatabase, SQLAlchemyDatabase):
+    """
+    SQL flask_crudsdb wrapper on SQLAlchemy's asyncio extension
+
+    SQLALCHEMY_DATABASE_URI must name an asyncio driver, e.g. 'sqlite+aiosqlite:///app.db' or
+    'postgresql+asyncpg://...'. Every call runs in an AsyncSession of its own from the engine's connection pool, so
+    calls may run concurrently on one event loop.
+    """
+
+    def __init__(self, app):
+        Database.__init__(self, app)
+        self.database = create_async_engine(app.config.get('SQLALCHEMY_DATABASE_URI'), **self.get_engine_options(app))
+        self.session_factory = sessionmaker(bind=self.database, class_=AsyncSession, expire_on_commit=False)
+        self.read_mode = self.get_read_mode(app.config.get('SQLALCHEMY_READ_MODE', 'orm'))
+        self.row_columns = {}
+        self.replicas = None
+
+    async def close(self):
+        """
+        Close every pooled connection.
+        :return:
+        """
+        await self.database.dispose()
+
+    async def create(self, model, data, **kwargs):
+        try:
+            data = Template(data)
+        except (TypeError, ValueError, IndexError):
+            abort(400)
+        # letting this raise a KeyError on purpose, flask returns HTTP 500 on python errors
+        with self.instrumentation.phase('model'):
+            instance = self.models[model](data)
+        async with self.session_factory() as session:
+            with self.instrumentation.phase('persist'):
+                session.add(instance)
+                await session.commit()
+        self.index_instance(model, self.get_pk(instance), instance)
+        with self.instrumentation.phase('serialize'):
+            return Collection(href=self.app.config.get('API_ROOT'), items=[instance.get_collection_item()])
+
+    async def read(self, model, pk=None, limit=None, cursor=None, after=None, order_by=None, filter_by=None,
+                   read_mode=None, **kwargs):
+        # letting self.models[model] raise a KeyError on purpose, see above
+        template = self.models[model].get_collection_template()
+        links = None
+        rows = self.get_row_select(model, order_by, read_mode) if pk is None else None
+        async with self.session_factory() as session:
+            with self.instrumentation.phase('query'):
+                if pk is not None:
+                    instance = await session.get(self.models[model], pk)
+                    if instance is None:
+                        abort(404)
+                    instances = [instance]
+                else:
+                    query = select(self.models[model]) if rows is None else rows
+                    if filter_by:
+                        query = query.filter_by(**filter_by) if rows is None else \
+                            self.filter_rows(model, query, filter_by)
+                    limit, keys, direction = self.get_page_args(limit, cursor)
+                    if limit is None and keys is None and after is None:
+                        if order_by:
+                            query = query.order_by(getattr(self.models[model], order_by))
+                        result = await session.execute(query)
+                        instances = result.scalars().all() if rows is None else result.all()
+                    else:
+                        instances, links = await self.read_page(
+                            model, query, limit, keys, direction, after, order_by, session=session,
+                            rows=rows is not None
+                        )
+        response = Collection(href=self.app.config.get('API_ROOT'), template=template, links=links)
+        with self.instrumentation.phase('serialize'):
+            if rows is not None:
+                response.items.extend(self.models[model].__schema__.get_row_item(row) for row in instances)
+            else:
+                for instance in instances:
+                    response.items.append(instance.get_collection_item())
+        return response
+
+    async def read_page(self, model, instances, limit, keys, direction, after=None, order_by=None, session=None,
+                        rows=False):
+        """
+        Seek to one page of a listing, see SQLAlchemyDatabase.read_page.
+        :param session: The AsyncSession to query in.
+        :param rows: If true, instances is a select() from get_row_select, and the page holds rows.
+        """
+        columns = self.get_key_columns(self.models[model], order_by)
+        if keys is None and after is not None:
+            # after comes from the query string, so compare it as the primary key column types
+            after = self.normalize_pk(model, after)
+            if order_by:
+                anchor = await session.get(self.models[model], after)
+                if anchor is None:
+                    abort(404)
+                keys = self.get_keys(anchor, columns)
+            else:
+                keys = list(after) if isinstance(after, tuple) else [after]
+        instances = self.seek_page(instances, columns, limit, keys, direction)
+        result = await session.execute(instances)
+        instances = result.all() if rows else result.scalars().all()
+        return self.get_page_result(instances, columns, limit, keys, direction, order_by)
+
+    async def update(self, model, data, pk=None, **kwargs):
+        try:
+            data = Template(data)
+        except (TypeError, ValueError, IndexError):
+            abort(400)
+        # letting self.models[model] raise a KeyError on purpose, see above
+        async with self.session_factory() as session:
+            with self.instrumentation.phase('query'):
+                instance = await session.get(self.models[model], pk)
+            if instance is None:
+                abort(404)
+            with self.instrumentation.phase('model'):
+                instance.update(data)
+            with self.instrumentation.phase('persist'):
+                await session.commit()
+        self.index_instance(model, self.get_pk(instance), instance)
+        with self.instrumentation.phase('serialize'):
+            return Collection(
+                href=self.app.config.get('API_ROOT'), template=self.models[model].get_collection_template(),
+                items=[instance.get_collection_item()]
+            )
+
+    async def delete(self, model, pk=None, **kwargs):
+        # letting self.models[model] raise a KeyError on purpose, see above
+        async with self.session_factory() as session:
+            with self.instrumentation.phase('query'):
+                instance = await session.get(self.models[model], pk)
+            if instance is None:
+                abort(404)
+            with self.instrumentation.phase('persist'):
+                await session.delete(instance)
+                await session.commit()
+        self.unindex_instance(model, self.normalize_pk(model, pk))
+
+    async def bulk_create(self, model, data, **kwargs):
+        # letting self.models[model] raise a KeyError on purpose, see above
+        instances, errors = [], []
+        for index, item in enumerate(data):
+            try:
+                instances.append(self.models[model](Template(item)))
+            except (TypeError, ValueError, IndexError):
+                errors.append((index, 400, 'malformed data'))
+            except DatabaseError as error:
+                errors.append(self.get_item_error(index, error))
+        async with self.session_factory() as session:
+            session.add_all(instances)
+            await session.commit()
+        for instance in instances:
+            self.index_instance(model, self.get_pk(instance), instance)
+        return Collection(
+            href=self.app.config.get('API_ROOT'), template=self.models[model].get_collection_template(),
+            items=[instance.get_collection_item() for instance in instances], error=self.get_bulk_error(errors)
+        )
+
+    async def bulk_update(self, model, data, **kwargs):
+        updates = self.get_bulk_updates(data)
+        updated, errors = [], []
+        async with self.session_factory() as session:
+            instances = await self.get_instances(model, [pk for pk, item in updates], session=session)
+            for index, (pk, item) in enumerate(updates):
+                instance = instances.get(self.normalize_pk(model, pk))
+                if instance is None:
+                    errors.append((index, 404, 'not found'))
+                    continue
+                try:
+                    instance.update(Template(item))
+                except (TypeError, ValueError, IndexError):
+                    errors.append((index, 400, 'malformed data'))
+                except DatabaseError as error:
+                    errors.append(self.get_item_error(index, error))
+                else:
+                    updated.append((pk, instance))
+            # instances that failed part way through update must not be flushed with the others
+            for index, code, message in errors:
+                instance = instances.get(self.normalize_pk(model, updates[index][0]))
+                if instance is not None:
+                    session.expire(instance)
+            await session.commit()
+        for pk, instance in updated:
+            self.index_instance(model, self.get_pk(instance), instance)
+        return Collection(
+            href=self.app.config.get('API_ROOT'), template=self.models[model].get_collection_template(),
+            items=[instance.get_collection_item() for pk, instance in updated], error=self.get_bulk_error(errors)
+        )
+
+    async def bulk_delete(self, model, pks, **kwargs):
+        errors = []
+        async with self.session_factory() as session:
+            instances = await self.get_instances(model, pks, session=session)
+            for index, pk in enumerate(pks):
+                instance = instances.get(self.normalize_pk(model, pk))
+                if instance is None:
+                    errors.append((index, 404, 'not found'))
+                else:
+                    await session.delete(instance)
+            await session.commit()
+        for pk in pks:
+            if self.normalize_pk(model, pk) in instances:
+                self.unindex_instance(model, self.normalize_pk(model, pk))
+        return Collection(href=self.app.config.get('API_ROOT'), error=self.get_bulk_error(errors))
+
+    async def get_instances(self, model, pks, session=None):
+        """
+        Load many instances of a model by primary key, see SQLAlchemyDatabase.get_instances.
+        :param session: The AsyncSession to query in.
+        """
+        columns = inspect(self.models[model]).primary_key
+        if not pks:
+            return {}
+        if len(columns) == 1:
+            keys = [self.normalize_pk(model, pk) for pk in pks]
+            result = await session.execute(select(self.models[model]).where(columns[0].in_(keys)))
+            return dict((self.normalize_pk(model, self.get_pk(instance)), instance) for instance in result.scalars())
+        instances = {}
+        for pk in pks:
+            instance = await session.get(self.models[model], self.normalize_pk(model, pk))
+            if instance is not None:
+                instances[self.normalize_pk(model, pk)] = instance
+        return instances
+
+    async def search(self, model, data, page=1, pagelen=None, **kwargs):
+        # letting self.models[model] raise a KeyError on purpose, see above
+        pks, links = await self.run_in_executor(self.search_index_page, model, data, page, pagelen)
+        response = Collection(
+            href=self.app.config.get('API_ROOT'), template=self.models[model].get_collection_template(), links=links
+        )
+        async with self.session_factory() as session:
+            instances = await self.get_instances(model, pks, session=session)
+        for pk in pks:
+            instance = instances.get(self.normalize_pk(model, pk))
+            if instance is not None:
+                response.items.append(instance.get_collection_item())
+        return response
 
-    def search(self, model, data, **kwargs):
-        pass
\ No newline at end of file
+    async def iter_instances(self, model):
+        async with self.session_factory() as session:
+            instances = await session.stream_scalars(
+                select(self.models[model]).execution_options(
+                    yield_per=self.app.config.get('SQLALCHEMY_STREAM_BATCH', 1000)
+                )
+            )
+            async for instance in instances:
+                yield self.get_pk(instance), instance
@@ -0,0 +1,358 @@
+__author__ = 'Ian S. Evans'
+"""
+Local stand-ins for the external services flask_crudsdb can use, for tests and development without a server.
+"""
+
+import base64
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+
+class FakeRedis(object):
+    """
+    An in-process stand-in for a redis.Redis client, implementing the commands flask_crudsdb.cache.RedisCache uses.
+    Values are stored and returned as bytes, like redis does.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def __get(self, name):
+        value, expires = self.data.get(name, (None, None))
+        if expires is not None and expires <= time.monotonic():
+            del self.data[name]
+            return None
+        return value
+
+    def get(self, name):
+        with self.lock:
+            return self.__get(name)
+
+    def mget(self, *names):
+        with self.lock:
+            return [self.__get(name) for name in names]
+
+    def set(self, name, value, ex=None):
+        if isinstance(value, str):
+            value = value.encode()
+        elif not isinstance(value, bytes):
+            value = str(value).encode()
+        with self.lock:
+            self.data[name] = (value, time.monotonic() + ex if ex else None)
+        return True
+
+    def incr(self, name, amount=1):
+        with self.lock:
+            value = int(self.__get(name) or 0) + amount
+            self.data[name] = (str(value).encode(), None)
+            return value
+
+    def delete(self, *names):
+        with self.lock:
+            return len([self.data.pop(name) for name in names if name in self.data])
+
+    def flushdb(self):
+        with self.lock:
+            self.data.clear()
+        return True
+
+
+class FakeCouchDB(object):
+    """
+    An in-process CouchDB HTTP server for flask_crudsdb.couch_db.CouchDatabase, serving the parts of the CouchDB API it
+    uses: databases, documents with revisions and ETags, _all_docs, _bulk_docs, and Mango _find and _index. Like
+    CouchDB, sorted Mango queries need an index on their sort fields. e.g.:
+        with FakeCouchDB() as couch:
+            app.config['COUCHDB_URL'] = couch.url
+    connections and requests count the TCP connections accepted and the requests served.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        """
+        FakeCouchDB Constructor
+        :param host: The address to listen on.
+        :param port: The port to listen on, 0 for any free port.
+        :return:
+        """
+        self.databases = {}
+        self.lock = threading.RLock()
+        self.connections = 0
+        self.requests = 0
+        self.server = ThreadingHTTPServer((host, port), self.get_handler())
+        self.server.daemon_threads = True
+        self.url = 'http://{0}:{1}'.format(*self.server.server_address[:2])
+        self.thread = threading.Thread(target=self.server.serve_forever, name='FakeCouchDB', daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_handler(self):
+        couch = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with couch.lock:
+                    couch.connections += 1
+
+            def handle_request(self):
+                url = urlsplit(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                with couch.lock:
+                    couch.requests += 1
+                    status, payload, headers = couch.dispatch(
+                        self.command, [unquote(part) for part in url.path.split('/') if part],
+                        dict(parse_qsl(url.query)), self.headers, body
+                    )
+                content = b'' if payload is None else json.dumps(payload).encode()
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                if payload is not None:
+                    self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(0 if self.command == 'HEAD' else len(content)))
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(content)
+
+            do_GET = do_PUT = do_POST = do_DELETE = do_HEAD = handle_request
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    @staticmethod
+    def error(status, error, reason):
+        return status, {'error': error, 'reason': reason}, {}
+
+    def dispatch(self, method, parts, params, headers, body):
+        if not parts:
+            return 200, {'couchdb': 'Welcome', 'vendor': {'name': 'flask_crudsdb.testing'}}, {}
+        name, parts = parts[0], parts[1:]
+        if not parts:
+            if method == 'PUT':
+                if name in self.databases:
+                    return self.error(412, 'file_exists', 'The database could not be created, the file already exists.')
+                self.databases[name] = {'docs': {}, 'deleted': {}, 'indexes': []}
+                return 201, {'ok': True}, {}
+            if name not in self.databases:
+                return self.error(404, 'not_found', 'Database does not exist.')
+            if method == 'DELETE':
+                del self.databases[name]
+                return 200, {'ok': True}, {}
+            return 200, {'db_name': name, 'doc_count': len(self.databases[name]['docs'])}, {}
+        if name not in self.databases:
+            return self.error(404, 'not_found', 'Database does not exist.')
+        database = self.databases[name]
+        resource = '/'.join(parts)
+        if resource == '_all_docs' and method in ('GET', 'POST'):
+            return self.all_docs(database, params, body or {})
+        if resource == '_bulk_docs' and method == 'POST':
+            return 201, [self.write(database, doc) for doc in body.get('docs', [])], {}
+        if resource == '_find' and method == 'POST':
+            return self.find(database, body)
+        if resource == '_index' and method == 'POST':
+            database['indexes'].append([self.get_sort_field(field) for field in body['index']['fields']])
+            return 200, {'result': 'created', 'name': body.get('name')}, {}
+        return self.document(database, method, resource, params, headers, body)
+
+    def document(self, database, method, doc_id, params, headers, body):
+        doc = database['docs'].get(doc_id)
+        if method in ('GET', 'HEAD'):
+            if doc is None:
+                return self.error(404, 'not_found', 'deleted' if doc_id in database['deleted'] else 'missing')
+            etag = '"{0}"'.format(doc['_rev'])
+            if headers.get('If-None-Match') == etag:
+                return 304, None, {'ETag': etag}
+            return 200, doc, {'ETag': etag}
+        if method == 'PUT':
+            body = dict(body, _id=doc_id)
+            if headers.get('If-Match'):
+                body.setdefault('_rev', headers['If-Match'].strip('"'))
+            result = self.write(database, body)
+        elif method == 'DELETE':
+            rev = params.get('rev') or (headers.get('If-Match') or '').strip('"')
+            if doc is None:
+                return self.error(404, 'not_found', 'missing')
+            result = self.write(database, {'_id': doc_id, '_rev': rev, '_deleted': True})
+        else:
+            return self.error(405, 'method_not_allowed', 'Only GET,HEAD,PUT,DELETE allowed')
+        if result.get('error'):
+            return self.error(409, result['error'], result['reason'])
+        return 200 if method == 'DELETE' else 201, result, {'ETag': '"{0}"'.format(result['rev'])}
+
+    def write(self, database, doc):
+        """
+        Write a document the way CouchDB does: updates and deletes must name the current revision.
+        :return: The result of the write, as in a _bulk_docs response.
+        """
+        doc_id = doc.get('_id') or uuid.uuid4().hex
+        current = database['docs'].get(doc_id)
+        if current is not None and doc.get('_rev') != current['_rev']:
+            return {'id': doc_id, 'error': 'conflict', 'reason': 'Document update conflict.'}
+        if current is None and doc.get('_deleted'):
+            return {'id': doc_id, 'error': 'not_found', 'reason': 'missing'}
+        generation = int((current or {}).get('_rev', database['deleted'].get(doc_id, '0-')).split('-')[0]) + 1
+        rev = '{0}-{1}'.format(generation, uuid.uuid4().hex)
+        if doc.get('_deleted'):
+            del database['docs'][doc_id]
+            database['deleted'][doc_id] = rev
+        else:
+            database['docs'][doc_id] = dict(doc, _id=doc_id, _rev=rev)
+            database['deleted'].pop(doc_id, None)
+        return {'ok': True, 'id': doc_id, 'rev': rev}
+
+    def all_docs(self, database, params, body):
+        include_docs = params.get('include_docs') == 'true'
+        rows = []
+        if 'keys' in body:
+            for key in body['keys']:
+                doc = database['docs'].get(key)
+                if doc is not None:
+                    rows.append({'id': key, 'key': key, 'value': {'rev': doc['_rev']}})
+                    if include_docs:
+                        rows[-1]['doc'] = doc
+                elif key in database['deleted']:
+                    rows.append({'id': key, 'key': key, 'value': {'rev': database['deleted'][key], 'deleted': True}})
+                    if include_docs:
+                        rows[-1]['doc'] = None
+                else:
+                    rows.append({'key': key, 'error': 'not_found'})
+            return 200, {'total_rows': len(database['docs']), 'rows': rows}, {}
+        descending = params.get('descending') == 'true'
+        start = params.get('start_key', params.get('startkey'))
+        end = params.get('end_key', params.get('endkey'))
+        start = json.loads(start) if start is not None else None
+        end = json.loads(end) if end is not None else None
+        inclusive_end = params.get('inclusive_end', 'true') == 'true'
+        for doc_id in sorted(database['docs'], reverse=descending):
+            before = (lambda a, b: a > b) if descending else (lambda a, b: a < b)
+            if start is not None and before(doc_id, start):
+                continue
+            if end is not None and (before(end, doc_id) or (not inclusive_end and doc_id == end)):
+                continue
+            doc = database['docs'][doc_id]
+            rows.append({'id': doc_id, 'key': doc_id, 'value': {'rev': doc['_rev']}})
+            if include_docs:
+                rows[-1]['doc'] = doc
+        skip = int(params.get('skip', 0))
+        limit = int(params['limit']) if 'limit' in params else None
+        rows = rows[skip:skip + limit if limit is not None else None]
+        return 200, {'total_rows': len(database['docs']), 'offset': skip, 'rows': rows}, {}
+
+    def find(self, database, query):
+        sort = [self.get_sort(spec) for spec in query.get('sort', [])]
+        if len(set(direction for field, direction in sort)) > 1:
+            return self.error(400, 'unsupported_mixed_sort', 'Sorts currently only support a single direction.')
+        sort_fields = [field for field, direction in sort if field != ['_id']]
+        if sort_fields and not any(all(field in index for field in sort_fields) for index in database['indexes']):
+            return self.error(400, 'no_usable_index', 'No index exists for this sort, try indexing by the sort fields.')
+        docs = [
+            doc for doc in database['docs'].values()
+            if self.matches(doc, query.get('selector', {})) and all(
+                self.get_value(doc, field)[0] for field in sort_fields
+            )
+        ]
+        docs.sort(key=lambda doc: [self.collate(self.get_value(doc, field)[1]) for field, direction in sort] + [
+            self.collate(doc['_id'])
+        ], reverse=bool(sort) and sort[0][1] == 'desc')
+        # The bookmark is the number of documents already returned, past skip.
+        seen = int(base64.urlsafe_b64decode(query['bookmark'].encode())) if query.get('bookmark') else 0
+        start = int(query.get('skip', 0)) + seen
+        docs = docs[start:start + int(query.get('limit', 25))]
+        bookmark = base64.urlsafe_b64encode(str(seen + len(docs)).encode()).decode()
+        return 200, {'docs': docs, 'bookmark': bookmark}, {}
+
+    @classmethod
+    def get_sort(cls, spec):
+        if isinstance(spec, dict):
+            field, direction = next(iter(spec.items()))
+            return cls.get_sort_field(field), direction
+        return cls.get_sort_field(spec), 'asc'
+
+    @staticmethod
+    def get_sort_field(field):
+        if isinstance(field, dict):
+            field = next(iter(field))
+        return [part.replace('\\.', '.') for part in re.split(r'(?<!\\)\.', field)]
+
+    @staticmethod
+    def get_value(doc, path):
+        """
+        :return: A tuple of (found, value) for the field at path, a list of names.
+        """
+        for name in path:
+            if not isinstance(doc, dict) or name not in doc:
+                return False, None
+            doc = doc[name]
+        return True, doc
+
+    @staticmethod
+    def collate(value):
+        # CouchDB's view collation: null, false, true, numbers, strings, arrays, then objects.
+        if value is None:
+            return 0, 0
+        if value is False or value is True:
+            return 1, value
+        if isinstance(value, (int, float)):
+            return 2, value
+        if isinstance(value, str):
+            return 3, value
+        if isinstance(value, list):
+            return 4, [FakeCouchDB.collate(item) for item in value]
+        return 5, sorted((key, FakeCouchDB.collate(item)) for key, item in value.items())
+
+    def matches(self, doc, selector):
+        for key, condition in selector.items():
+            if key == '$and':
+                if not all(self.matches(doc, item) for item in condition):
+                    return False
+            elif key == '$or':
+                if not any(self.matches(doc, item) for item in condition):
+                    return False
+            elif key == '$not':
+                if self.matches(doc, condition):
+                    return False
+            elif not self.matches_field(self.get_value(doc, self.get_sort_field(key)), condition):
+                return False
+        return True
+
+    def matches_field(self, field, condition):
+        found, value = field
+        if not isinstance(condition, dict) or not any(key.startswith('$') for key in condition):
+            condition = {'$eq': condition}
+        for operator, operand in condition.items():
+            if operator == '$exists':
+                if found != operand:
+                    return False
+                continue
+            if not found:
+                return False
+            left, right = self.collate(value), self.collate(operand) if operator != '$in' else None
+            if operator == '$eq' and left != right or operator == '$ne' and left == right:
+                return False
+            if operator == '$gt' and not left > right or operator == '$gte' and not left >= right:
+                return False
+            if operator == '$lt' and not left < right or operator == '$lte' and not left <= right:
+                return False
+            if operator == '$in' and left not in [self.collate(item) for item in operand]:
+                return False
+        return True
@@ -5,8 +5,9 @@ from setuptools import setup, find_packages
 setup(
     name='Flask-CRUDSDB',
     version='0.0.1',
-    packages=find_packages(),
-    install_requires=['collection_json', 'flask', 'flask_sqlalchemy', 'whoosh'],
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
+    install_requires=['blinker', 'collection_json', 'flask', 'flask_sqlalchemy', 'sqlalchemy>=1.4', 'whoosh'],
+    extras_require={'asyncio': ['sqlalchemy[asyncio]>=1.4'], 'couchdb': ['requests']},
     url='http://github.com/ievans3024/Flask-CRUDSDB',
     license='MIT',
     author='Ian S. Evans',
@@ -0,0 +1,52 @@
+import pytest
+from flask import Flask
+from flask_crudsdb.flatfile import FlatDatabase
+from flask_crudsdb.sqlalchemy import SQLAlchemyDatabase, SQLAlchemyModel
+from tests.models import Person, SQLEvent, SQLPerson
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    """Make a Flask app whose databases keep their files in tmp_path."""
+    def make_app(**config):
+        app = Flask(__name__)
+        app.config.update(
+            API_ROOT='/api/', FLAT_DATABASE_FILE=str(tmp_path / 'db.json'),
+            SQLALCHEMY_DATABASE_URI='sqlite:///' + str(tmp_path / 'db.sqlite')
+        )
+        app.config.update(config)
+        return app
+    return make_app
+
+
+@pytest.fixture
+def make_flat(make_app):
+    """Make a FlatDatabase of Person, or of the given models."""
+    databases = []
+
+    def make_flat(*models, **config):
+        database = FlatDatabase(make_app(**config))
+        for model in models or (Person,):
+            database.add_model(model)
+        databases.append(database)
+        return database
+    yield make_flat
+    for database in databases:
+        database.close()
+
+
+@pytest.fixture
+def make_sql(make_app):
+    """Make a SQLAlchemyDatabase of SQLPerson and SQLEvent, with its tables created."""
+    databases = []
+
+    def make_sql(**config):
+        database = SQLAlchemyDatabase(make_app(**config))
+        database.add_model(SQLPerson)
+        database.add_model(SQLEvent)
+        SQLAlchemyModel.metadata.create_all(database.database)
+        databases.append(database)
+        return database
+    yield make_sql
+    for database in databases:
+        database.database.dispose()
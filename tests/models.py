@@ -0,0 +1,74 @@
+"""
+Models shared by the tests. SQLAlchemy models all live here, as they share SQLAlchemyModel's metadata.
+"""
+
+from sqlalchemy import Column, DateTime, Integer, String
+from flask_crudsdb import Model
+from flask_crudsdb.sqlalchemy import SQLAlchemyModel
+
+
+class Person(Model):
+    __required__ = ['name']
+    __indexed__ = ['name', 'bio']
+    name = None
+    bio = None
+
+    def __init__(self, pk, data, *args, **kwargs):
+        self.pk = pk
+        self.endpoint = '/api/person/%s' % pk
+        self.update(data)
+
+
+class SortedPerson(Person):
+    __sorted__ = ['name', 'bio']
+
+
+class SQLPerson(SQLAlchemyModel, Model):
+    __tablename__ = 'person'
+    __required__ = ['name']
+    __indexed__ = ['name', 'bio']
+    __fields__ = ['name', 'bio']
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
+    bio = Column(String)
+    endpoint = property(lambda self: '/api/person/%s' % self.id)
+
+    def __init__(self, data, *args, **kwargs):
+        self.update(data)
+
+
+class SQLEvent(SQLAlchemyModel, Model):
+    __tablename__ = 'event'
+    __fields__ = ['title', 'starts']
+    id = Column(Integer, primary_key=True)
+    title = Column(String)
+    starts = Column(DateTime)
+    endpoint = property(lambda self: '/api/event/%s' % self.id)
+
+    def __init__(self, data, *args, **kwargs):
+        self.update(data)
+
+
+class SQLTag(SQLAlchemyModel, Model):
+    """A model without __fields__, its fields are inferred from its columns."""
+    __tablename__ = 'tag'
+    id = Column(Integer, primary_key=True)
+    label = Column(String)
+    weight = Column(Integer, default=1)
+    endpoint = property(lambda self: '/api/tag/%s' % self.id)
+
+    def __init__(self, data, *args, **kwargs):
+        self.update(data)
+
+
+def person(name, bio=None):
+    """The Collection+JSON data array of a Person."""
+    data = [{'name': 'name', 'value': name}]
+    if bio is not None:
+        data.append({'name': 'bio', 'value': bio})
+    return data
+
+
+def names(collection):
+    """The names of the items of a collection, in order."""
+    return [item.data.find('name')[0].value for item in collection.items]
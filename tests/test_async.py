@@ -0,0 +1,127 @@
+import asyncio
+from sqlalchemy import event
+from flask_crudsdb.flatfile import AsyncFlatDatabase
+from flask_crudsdb.sqlalchemy import AsyncSQLAlchemyDatabase
+from tests.models import Person, SQLEvent, SQLPerson, names, person
+
+
+def make_async_flat(make_app, **config):
+    database = AsyncFlatDatabase(make_app(**config))
+    database.add_model(Person)
+    return database
+
+
+async def crud(database, model):
+    created = await database.create(model, person('ada'))
+    pk = int(created.items[0].href.rsplit('/', 1)[1])
+    await database.bulk_create(model, [person('bob'), person('cat', 'cats')])
+    await database.update(model, person('ada', 'maths'), pk=pk)
+    assert names(await database.read(model)) == ['ada', 'bob', 'cat']
+    assert (await database.read(model, pk=pk)).items[0].data.find('bio')[0].value == 'maths'
+    await database.delete(model, pk=pk)
+    page = await database.read(model, limit=1)
+    assert names(page) == ['bob']
+    assert [pair[1].name async for pair in database.iter_instances(model)] == ['bob', 'cat']
+    response = await database.bulk_update(model, {pk: person('x')})
+    assert response.error.message == 'item 0: not found'
+
+
+def test_async_flat_crud(make_app):
+    database = make_async_flat(make_app)
+    asyncio.run(crud(database, 'Person'))
+    database.close()
+
+
+def test_async_flat_search(make_app):
+    database = make_async_flat(make_app)
+
+    async def run():
+        await database.bulk_create('Person', [person('ada', 'likes cats'), person('bob', 'likes dogs')])
+        assert names(await database.search('Person', 'cats')) == ['ada']
+    asyncio.run(run())
+    database.close()
+
+
+def test_async_flat_reads_are_not_broken_by_concurrent_writes(make_app):
+    database = make_async_flat(make_app)
+
+    async def run():
+        await database.bulk_create('Person', [person('p%d' % index) for index in range(5000)])
+
+        async def write():
+            for index in range(20):
+                await database.create('Person', person('new'))
+
+        async def read():
+            for index in range(5):
+                response = await database.read('Person')
+                assert 5000 <= len(response.items) <= 5040
+        await asyncio.gather(write(), write(), read(), read())
+        assert len(database.list_instances('Person')) == 5040
+    asyncio.run(run())
+    database.close()
+
+
+def test_shared_async_flat_reads_do_not_hold_the_process_lock(make_app, make_flat):
+    database = make_async_flat(make_app, FLAT_DATABASE_SHARED=True)
+    other = make_flat(FLAT_DATABASE_SHARED=True)
+    other.create('Person', person('ada'))
+
+    async def run():
+        # another process writing holds the lock between catching up and appending to the journal
+        with other.process_lock:
+            assert names(await asyncio.wait_for(database.read('Person'), 5)) == ['ada']
+            assert names(await asyncio.wait_for(database.search('Person', {'name': 'ada'}), 5)) == ['ada']
+        other.create('Person', person('bob'))
+        assert names(await database.read('Person')) == ['ada', 'bob']
+    asyncio.run(run())
+    database.close()
+
+
+def test_async_sqlalchemy_crud(make_sql, make_app):
+    uri = make_sql().app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:', 'sqlite+aiosqlite:')
+    database = AsyncSQLAlchemyDatabase(make_app(SQLALCHEMY_DATABASE_URI=uri))
+    database.add_model(SQLPerson)
+    database.add_model(SQLEvent)
+
+    async def run():
+        await crud(database, 'SQLPerson')
+        await database.close()
+    asyncio.run(run())
+
+
+def test_async_sqlalchemy_reindexes_string_primary_keys(make_sql, make_app, tmp_path):
+    uri = make_sql().app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:', 'sqlite+aiosqlite:')
+    database = AsyncSQLAlchemyDatabase(make_app(SQLALCHEMY_DATABASE_URI=uri, WHOOSH_INDEX_DIR=str(tmp_path / 'index')))
+    database.add_model(SQLPerson)
+
+    async def run():
+        await database.bulk_create('SQLPerson', [person('ada', 'likes cats'), person('bob', 'likes cats')])
+        await database.update('SQLPerson', person('ada', 'likes owls'), pk='1')
+        await database.delete('SQLPerson', pk='2')
+        database.search_index.flush()
+        assert database.search_index.search(SQLPerson, 'owls') == ([1], 1)
+        assert database.search_index.search(SQLPerson, 'cats') == ([], 0)
+        await database.close()
+    asyncio.run(run())
+    database.search_index.close()
+
+
+def test_async_sqlalchemy_after_from_a_query_string(make_sql, make_app):
+    uri = make_sql().app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:', 'sqlite+aiosqlite:')
+    database = AsyncSQLAlchemyDatabase(make_app(SQLALCHEMY_DATABASE_URI=uri))
+    database.add_model(SQLPerson)
+    parameters = []
+    listener = lambda connection, cursor, statement, values, context, executemany: parameters.append(values)
+
+    async def run():
+        await database.bulk_create('SQLPerson', [person(name) for name in 'dbace'])
+        event.listen(database.database.sync_engine, 'before_cursor_execute', listener)
+        try:
+            assert names(await database.read('SQLPerson', limit=2, after='2')) == ['a', 'c']
+            assert names(await database.read('SQLPerson', limit=2, after='1', order_by='name')) == ['e']
+        finally:
+            event.remove(database.database.sync_engine, 'before_cursor_execute', listener)
+        await database.close()
+    asyncio.run(run())
+    assert '2' not in parameters[0] and 2 in parameters[0]
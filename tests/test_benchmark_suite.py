@@ -0,0 +1,39 @@
+import json
+import os
+import pytest
+from benchmarks import suite
+
+
+@pytest.fixture
+def results(tmp_path, monkeypatch):
+    # cases run as "python -m benchmarks.suite", from the repository root
+    monkeypatch.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    output = str(tmp_path / 'before.json')
+    suite.main(['run', '--rows', '30', '--widths', '2', '--count', '5', '--output', output])
+    return output
+
+
+def test_run_measures_every_backend_and_operation(results):
+    with open(results) as results_file:
+        cases = json.load(results_file)['cases']
+    assert [case['backend'] for case in cases] == list(suite.BACKENDS)
+    for case in cases:
+        assert (case['rows'], case['width'], case['count']) == (30, 2, 5)
+        assert sorted(case['operations']) == sorted(suite.OPERATIONS)
+        assert all(stats['ops_per_second'] > 0 for stats in case['operations'].values())
+
+
+def test_compare_exits_with_status_1_on_regressions(results, tmp_path, capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        suite.main(['compare', results, results])
+    assert exit_info.value.code == 0
+    with open(results) as results_file:
+        slower = json.load(results_file)
+    slower['cases'][0]['operations']['read']['ops_per_second'] /= 2
+    after = str(tmp_path / 'after.json')
+    with open(after, 'w') as after_file:
+        json.dump(slower, after_file)
+    with pytest.raises(SystemExit) as exit_info:
+        suite.main(['compare', results, after])
+    assert exit_info.value.code == 1
+    assert capsys.readouterr().out.count('REGRESSION') == 1
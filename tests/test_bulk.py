@@ -0,0 +1,75 @@
+import pytest
+from sqlalchemy import event
+from tests.models import names, person
+
+
+@pytest.fixture(params=['flat', 'sql'])
+def database(request, make_flat, make_sql):
+    if request.param == 'flat':
+        yield make_flat(), 'Person'
+    else:
+        database = make_sql()
+        with database.app.app_context():
+            yield database, 'SQLPerson'
+
+
+@pytest.fixture
+def statements(make_sql):
+    """A SQLAlchemyDatabase, and the list of statements it runs."""
+    database = make_sql()
+    executed = []
+    event.listen(
+        database.database, 'before_cursor_execute',
+        lambda conn, cursor, statement, parameters, context, executemany: executed.append(statement.split()[0])
+    )
+    with database.app.app_context():
+        yield database, executed
+
+
+def test_bulk_create_reports_failed_items(database):
+    database, model = database
+    response = database.bulk_create(model, [person('ada'), [{'name': 'bio', 'value': 'x'}], person('bob'), 'junk'])
+    assert names(response) == ['ada', 'bob']
+    assert response.error.title == '2 item(s) failed'
+    assert response.error.message.splitlines()[0].startswith('item 1: ')
+    assert response.error.message.splitlines()[1] == 'item 3: malformed data'
+    assert names(database.read(model)) == ['ada', 'bob']
+
+
+def test_bulk_update_and_delete_report_failed_items(database):
+    database, model = database
+    database.bulk_create(model, [person('ada'), person('bob'), person('cat')])
+    pks = [int(item.href.rsplit('/', 1)[1]) for item in database.read(model).items]
+    response = database.bulk_update(model, {pks[0]: person('ada', 'maths'), pks[1]: 'junk', 999: person('x')})
+    assert names(response) == ['ada']
+    assert response.error.message.splitlines() == ['item 1: malformed data', 'item 2: not found']
+    assert [item.data.find('bio')[0].value for item in database.read(model).items] == ['maths', None, None]
+    response = database.bulk_delete(model, [pks[1], 999])
+    assert response.error.message == 'item 1: not found'
+    assert names(database.read(model)) == ['ada', 'cat']
+
+
+def test_bulk_create_does_not_reload_what_it_created(statements):
+    database, executed = statements
+    response = database.bulk_create('SQLPerson', [person('p%d' % index, 'bio') for index in range(50)])
+    assert len(response.items) == 50 and response.items[49].href == '/api/person/50'
+    assert 'SELECT' not in executed
+
+
+def test_bulk_update_does_one_select_and_one_update(statements):
+    database, executed = statements
+    database.bulk_create('SQLPerson', [person('p%d' % index) for index in range(50)])
+    del executed[:]
+    response = database.bulk_update('SQLPerson', dict((pk, person('q%d' % pk, 'bio')) for pk in range(1, 51)))
+    assert names(response)[:2] == ['q1', 'q2']
+    assert executed.count('SELECT') == 1 and executed.count('UPDATE') == 1
+
+
+def test_bulk_instances_are_reloaded_after_the_batch(statements):
+    database, executed = statements
+    database.bulk_create('SQLPerson', [person('ada')])
+    instance = database.session.query(database.models['SQLPerson']).get(1)
+    database.bulk_update('SQLPerson', {1: person('bob')})
+    with database.database.begin() as connection:
+        connection.exec_driver_sql("UPDATE person SET name = 'eve'")
+    assert instance.name == 'eve'
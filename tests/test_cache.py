@@ -0,0 +1,115 @@
+import pytest
+import threading
+import time
+from flask_crudsdb.cache import CachedDatabase, MemoryCache, RedisCache
+from flask_crudsdb.testing import FakeRedis
+from tests.models import names, person
+
+
+class CachedCollection(object):
+    def __init__(self, href):
+        self.href = href
+
+    def to_dict(self):
+        return {'collection': {'version': '1.0', 'href': self.href}}
+
+
+def test_memory_cache_evicts_the_least_recently_used():
+    cache = MemoryCache(size=2)
+    for key in ('a', 'b'):
+        cache.set('Person', None, key, key.upper(), cache.get('Person', None, key)[2])
+    assert cache.get('Person', None, 'a')[:2] == (True, 'A')
+    cache.set('Person', None, 'c', 'C', cache.get('Person', None, 'c')[2])
+    assert not cache.get('Person', None, 'b')[0]
+    assert cache.get('Person', None, 'a')[0] and cache.get('Person', None, 'c')[0]
+    assert cache.stats() == {'size': 2, 'evictions': 1}
+
+
+def test_memory_cache_entries_expire():
+    cache = MemoryCache(ttl=0.05)
+    cache.set('Person', '1', 'a', 'A', cache.get('Person', '1', 'a')[2])
+    assert cache.get('Person', '1', 'a')[0]
+    time.sleep(0.1)
+    assert not cache.get('Person', '1', 'a')[0]
+    assert cache.stats()['size'] == 0
+
+
+def test_memory_cache_invalidates_listings_and_instances():
+    cache = MemoryCache()
+    for pk, key in ((None, 'list'), ('1', 'one'), ('2', 'two')):
+        cache.set('Person', pk, key, key, cache.get('Person', pk, key)[2])
+    cache.set('Other', None, 'other', 'other', 0)
+    cache.invalidate('Person', ['1'])
+    assert [cache.get('Person', pk, key)[0] for pk, key in ((None, 'list'), ('1', 'one'), ('2', 'two'))] == [
+        False, False, True
+    ]
+    assert cache.get('Other', None, 'other')[0]
+    cache.clear()
+    assert cache.stats()['size'] == 0
+
+
+def test_memory_cache_does_not_store_results_read_before_a_write():
+    cache = MemoryCache()
+    hit, value, token = cache.get('Person', None, 'list')
+    cache.invalidate('Person')
+    cache.set('Person', None, 'list', 'stale', token)
+    assert not cache.get('Person', None, 'list')[0]
+
+
+def test_redis_cache_generations():
+    client = FakeRedis()
+    cache = RedisCache(client, prefix='test:')
+    for pk, key in ((None, 'list'), ('1', 'one'), ('2', 'two')):
+        cache.set('Person', pk, key, CachedCollection(key), cache.get('Person', pk, key)[2])
+    assert cache.get('Person', '1', 'one')[1].href == 'one'
+    cache.invalidate('Person', ['1'])
+    assert [cache.get('Person', pk, key)[0] for pk, key in ((None, 'list'), ('1', 'one'), ('2', 'two'))] == [
+        False, False, True
+    ]
+    cache.clear()
+    assert not cache.get('Person', '2', 'two')[0]
+    assert all(key.startswith(b'test:' if isinstance(key, bytes) else 'test:') for key in client.data)
+
+
+def test_redis_cache_entries_expire():
+    cache = RedisCache(FakeRedis(), ttl=0.05)
+    cache.set('Person', None, 'list', CachedCollection('list'), cache.get('Person', None, 'list')[2])
+    assert cache.get('Person', None, 'list')[0]
+    time.sleep(0.1)
+    assert not cache.get('Person', None, 'list')[0]
+
+
+@pytest.mark.parametrize('backend', [MemoryCache, lambda: RedisCache(FakeRedis())])
+def test_cached_database_reads_through(make_flat, backend):
+    database = CachedDatabase(make_flat(), backend())
+    database.create('Person', person('ada'))
+    assert names(database.read('Person')) == ['ada']
+    assert names(database.read('Person')) == ['ada']
+    assert names(database.read('Person', pk=0)) == ['ada']
+    assert (database.cache_stats()['hits'], database.cache_stats()['misses']) == (1, 2)
+    database.update('Person', person('bob'), pk=0)
+    assert names(database.read('Person')) == ['bob'] and names(database.read('Person', pk=0)) == ['bob']
+    database.create('Person', person('cat'))
+    assert names(database.read('Person')) == ['bob', 'cat']
+    database.delete('Person', pk=0)
+    assert names(database.read('Person')) == ['cat']
+    database.bulk_update('Person', {1: person('dan')})
+    assert names(database.read('Person', pk=1)) == ['dan']
+    assert 'dan' in ''.join(database.read('Person', stream=True))
+    assert database.cache_stats()['misses'] == 7
+
+
+def test_cached_database_counts_every_read(make_flat):
+    database = CachedDatabase(make_flat())
+    database.create('Person', person('ada'))
+
+    def read():
+        for index in range(500):
+            database.read('Person')
+    threads = [threading.Thread(target=read) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = database.cache_stats()
+    assert stats['hits'] + stats['misses'] == 4000 and stats['misses'] >= 1
@@ -0,0 +1,114 @@
+from urllib.parse import parse_qs, urlsplit
+import pytest
+from werkzeug.exceptions import Conflict, NotFound
+from flask_crudsdb.couch_db import CouchDatabase
+from flask_crudsdb.testing import FakeCouchDB
+from tests.models import Person, names, person
+
+
+@pytest.fixture
+def couch():
+    with FakeCouchDB() as couch:
+        yield couch
+
+
+@pytest.fixture
+def database(couch, make_app):
+    database = CouchDatabase(make_app(COUCHDB_URL=couch.url, COUCHDB_BATCH_SIZE=2))
+    database.add_model(Person)
+    for name in 'edcba':
+        database.create('Person', person(name))
+    yield database
+    database.close()
+
+
+def get_pk(item):
+    return item.href.rsplit('/', 1)[1]
+
+
+def get_cursor(collection, rel):
+    for link in collection.links or ():
+        if link.rel == rel:
+            return parse_qs(urlsplit(link.href).query)['cursor'][0]
+
+
+def test_keys_are_allocated_in_order(database):
+    pks = [get_pk(item) for item in database.read('Person').items]
+    assert pks == sorted(pks) and len(set(pks)) == 5
+    assert names(database.read('Person')) == ['e', 'd', 'c', 'b', 'a']
+
+
+def test_requests_share_one_connection(couch, database):
+    assert couch.connections == 1
+
+
+def test_read_update_and_delete(database):
+    pk = get_pk(database.read('Person', limit=1).items[0])
+    assert names(database.update('Person', person('z'), pk=pk)) == ['z']
+    assert names(database.read('Person', pk=pk)) == ['z']
+    database.delete('Person', pk=pk)
+    with pytest.raises(NotFound):
+        database.read('Person', pk=pk)
+    with pytest.raises(NotFound):
+        database.delete('Person', pk=pk)
+    assert names(database.read('Person')) == ['d', 'c', 'b', 'a']
+
+
+def test_update_retries_conflicts(couch, database, monkeypatch):
+    pk = get_pk(database.read('Person', limit=1).items[0])
+    docs = couch.databases['crudsdb']['docs']
+    request = database.request
+    puts = []
+
+    def request_after_another_writer(method, path, **kwargs):
+        if method == 'PUT':
+            # another writer changes the document between our read and our write
+            puts.append(path)
+            docs['Person:' + pk] = dict(docs['Person:' + pk], _rev='%d-elsewhere' % (len(puts) + 10))
+        return request(method, path, **kwargs)
+    monkeypatch.setattr(database, 'request', request_after_another_writer)
+    with pytest.raises(Conflict):
+        database.update('Person', person('z'), pk=pk)
+    assert len(puts) == database.conflict_retries + 1
+    monkeypatch.setattr(database, 'request', request)
+    assert names(database.update('Person', person('z'), pk=pk)) == ['z']
+
+
+@pytest.mark.parametrize('order_by', [None, 'name'])
+def test_pages_seek_both_ways(database, order_by):
+    expected = ['a', 'b', 'c', 'd', 'e'] if order_by else ['e', 'd', 'c', 'b', 'a']
+    first = database.read('Person', limit=2, order_by=order_by)
+    second = database.read('Person', limit=2, order_by=order_by, cursor=get_cursor(first, 'next'))
+    third = database.read('Person', limit=2, order_by=order_by, cursor=get_cursor(second, 'next'))
+    assert names(first) + names(second) + names(third) == expected
+    assert get_cursor(third, 'next') is None
+    back = database.read('Person', limit=2, order_by=order_by, cursor=get_cursor(third, 'prev'))
+    assert names(back) == names(second)
+
+
+def test_unpaginated_listings_read_every_batch(database):
+    assert names(database.read('Person', order_by='name')) == ['a', 'b', 'c', 'd', 'e']
+    assert names(database.read('Person', filter_by={'name': 'c'})) == ['c']
+    assert ''.join(database.read('Person', stream=True)).count('"href": "/api/person/') == 5
+
+
+def test_bulk_operations_report_failed_items(database):
+    response = database.bulk_create('Person', [person('f'), 'junk'])
+    assert names(response) == ['f'] and response.error.message == 'item 1: malformed data'
+    pk = get_pk(response.items[0])
+    response = database.bulk_update('Person', {pk: person('g'), 'missing': person('x')})
+    assert names(response) == ['g'] and response.error.message == 'item 1: not found'
+    response = database.bulk_delete('Person', ['missing', pk])
+    assert response.error.message == 'item 0: not found'
+    assert names(database.read('Person')) == ['e', 'd', 'c', 'b', 'a']
+
+
+def test_search(couch, make_app, tmp_path):
+    database = CouchDatabase(make_app(COUCHDB_URL=couch.url, WHOOSH_INDEX_DIR=str(tmp_path / 'index')))
+    database.add_model(Person)
+    for name, bio in (('ada', 'likes cats'), ('bob', 'likes dogs')):
+        database.create('Person', person(name, bio))
+    database.search_index.flush()
+    assert names(database.search('Person', 'cats')) == ['ada']
+    database.search_index.close()
+    database.close()
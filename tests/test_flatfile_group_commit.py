@@ -0,0 +1,81 @@
+import errno
+import json
+import pytest
+from flask_crudsdb import DatabaseError
+from tests.models import names, person
+
+
+@pytest.mark.parametrize('journal', [False, True])
+def test_flush_persists_every_queued_mutation(make_flat, journal):
+    database = make_flat(
+        FLAT_DATABASE_JOURNAL=journal, FLAT_DATABASE_DURABILITY='group', FLAT_DATABASE_FLUSH_INTERVAL=60000,
+        FLAT_DATABASE_FLUSH_MUTATIONS=1000
+    )
+    for index in range(20):
+        database.create('Person', person('p%d' % index))
+    database.delete('Person', pk=3)
+    assert database.flush(timeout=10)
+    assert database.persistence_stats()['queue_depth'] == 0
+    reopened = make_flat(FLAT_DATABASE_JOURNAL=journal)
+    assert len(reopened.read('Person').items) == 19
+
+
+def test_mutations_are_coalesced_into_batches(make_flat):
+    database = make_flat(
+        FLAT_DATABASE_DURABILITY='group', FLAT_DATABASE_FLUSH_INTERVAL=60000, FLAT_DATABASE_FLUSH_MUTATIONS=10
+    )
+    for index in range(50):
+        database.create('Person', person('p%d' % index))
+    database.flush(timeout=10)
+    stats = database.persistence_stats()
+    assert 1 <= stats['flush_count'] <= 6
+    assert stats['average_flush_latency'] > 0
+    with open(database.app.config['FLAT_DATABASE_FILE']) as db_file:
+        assert len(json.load(db_file)['Person']) == 51
+
+
+def test_the_interval_flushes_without_being_asked(make_flat):
+    database = make_flat(FLAT_DATABASE_DURABILITY='group', FLAT_DATABASE_FLUSH_INTERVAL=10)
+    database.create('Person', person('ada'))
+    writer = database.writer
+    with writer.condition:
+        assert writer.condition.wait_for(lambda: writer.flushed >= writer.submitted, 10)
+    assert names(make_flat().read('Person')) == ['ada']
+
+
+def test_close_flushes_and_stops_the_writer(make_flat):
+    database = make_flat(FLAT_DATABASE_DURABILITY='group', FLAT_DATABASE_FLUSH_INTERVAL=60000)
+    database.create('Person', person('ada'))
+    database.close()
+    assert not database.writer.is_alive()
+    assert names(make_flat().read('Person')) == ['ada']
+
+
+def test_sync_durability_has_no_writer(make_flat):
+    database = make_flat()
+    assert database.persistence_stats() is None
+    assert database.flush()
+
+
+def test_failed_flushes_are_retried(make_flat):
+    database = make_flat(
+        FLAT_DATABASE_JOURNAL=True, FLAT_DATABASE_DURABILITY='group', FLAT_DATABASE_FLUSH_INTERVAL=60000
+    )
+    writer = database.writer
+    flush = writer.flush_callback
+    failures = []
+
+    def fail_once(batch):
+        if not failures:
+            failures.append(batch)
+            raise OSError(errno.ENOSPC, 'No space left on device')
+        flush(batch)
+    writer.flush_callback = fail_once
+    database.create('Person', person('a'))
+    database.create('Person', person('b'))
+    with pytest.raises(DatabaseError):
+        database.flush(timeout=10)
+    assert writer.flushed == 0 and writer.queue_depth == 2
+    database.create('Person', person('c'))
+    assert database.flush(timeout=10)
+    assert names(make_flat(FLAT_DATABASE_JOURNAL=True).read('Person')) == ['a', 'b', 'c']
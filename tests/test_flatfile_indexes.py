@@ -0,0 +1,109 @@
+import random
+import pytest
+from werkzeug.exceptions import NotImplemented
+from flask_crudsdb import Model
+from flask_crudsdb.flatfile import FlatDatabase
+from tests.models import Person, SortedPerson, names, person
+
+
+class Note(Model):
+    text = None
+
+    def __init__(self, pk, data, *args, **kwargs):
+        self.pk = pk
+        self.update(data)
+
+
+class Doc(object):
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+def test_inverted_index():
+    index = FlatDatabase.InvertedIndex(['name', 'bio'])
+    index.add(1, Doc(name='Ada', bio='likes cats and maths'))
+    index.add(2, Doc(name='Bob', bio='likes dogs'))
+    index.add(3, Doc(name='Cats', bio='likes cats'))
+    assert index.search('likes cats') == [3, 1]
+    assert index.search({'bio': 'likes'}) == [1, 2, 3]
+    assert index.search('nothing') == [] and index.search('') == []
+    index.add(1, Doc(name='Ada', bio='likes owls'))
+    index.remove(3)
+    assert index.search('cats') == []
+    assert index.postings[('bio', 'likes')] == {1, 2}
+    with pytest.raises(ValueError):
+        index.search({'age': '3'})
+
+
+def test_sorted_index():
+    index = FlatDatabase.SortedIndex('name')
+    index.extend([(3, Doc(name='b')), (1, Doc(name=None)), (2, Doc(name='a'))])
+    index.add(4, Doc(name='b'))
+    assert [pk for value, pk in index.entries] == [1, 2, 3, 4]
+    assert index.find('b') == {3, 4} and index.find(None) == {1}
+    index.add(1, Doc(name='c'))
+    index.remove(3)
+    assert [pk for value, pk in index.entries] == [2, 4, 1]
+    assert index.find('b') == {4}
+
+
+def test_sorted_index_orders_mixed_types(make_flat):
+    database = make_flat(SortedPerson)
+    for bio in ('b', 2, None, 1.5, ['x'], True, 'a'):
+        database.create('SortedPerson', person('p', bio))
+    database.update('SortedPerson', person('p', {'z': 1}), pk=0)
+    bios = [item.data.find('bio')[0].value for item in database.read('SortedPerson', order_by='bio').items]
+    assert bios == [None, True, 1.5, 2, 'a', {'z': 1}, ['x']]
+    assert names(database.read('SortedPerson', filter_by={'bio': 2})) == ['p']
+
+
+def test_search_answers_from_the_inverted_index(make_flat):
+    database = make_flat()
+    for name, bio in (('p0', 'likes cats'), ('p1', 'likes dogs'), ('p2', 'cats and dogs')):
+        database.create('Person', person(name, bio))
+    assert names(database.search('Person', 'cats dogs')) == ['p2']
+    database.update('Person', person('p1', 'likes cats'), pk=1)
+    database.delete('Person', pk=0)
+    assert names(database.search('Person', 'cats', pagelen=1)) == ['p1']
+    assert names(database.search('Person', 'cats', page=2, pagelen=1)) == ['p2']
+    assert names(database.search('Person', [{'name': 'bio', 'value': 'dogs'}])) == ['p2']
+
+
+def test_search_needs_indexed_fields(make_flat):
+    database = make_flat(Note)
+    database.create('Note', [{'name': 'text', 'value': 'hello'}])
+    with pytest.raises(NotImplemented):
+        database.search('Note', 'hello')
+
+
+def test_indexes_are_rebuilt_on_load(make_flat):
+    database = make_flat(SortedPerson, FLAT_DATABASE_JOURNAL=True)
+    for name in ('b', 'a', 'c'):
+        database.create('SortedPerson', person(name, 'bio of %s' % name))
+    reopened = make_flat(SortedPerson, FLAT_DATABASE_JOURNAL=True)
+    assert names(reopened.search('SortedPerson', 'bio')) == ['b', 'a', 'c']
+    assert [pk for value, pk in reopened.sorted_indexes['SortedPerson']['name'].entries] == [1, 0, 2]
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'order_by': 'name'}, {'order_by': 'bio'}, {'filter_by': {'name': 'n3'}}, {'filter_by': {'bio': None}},
+    {'filter_by': {'name': 'n1', 'bio': 'b2'}}, {'filter_by': {'name': 'n2'}, 'order_by': 'bio'}
+])
+def test_indexed_listings_match_a_scan(make_flat, kwargs):
+    database = make_flat(Person, SortedPerson)
+    rng = random.Random(1)
+    for index in range(120):
+        data = person('n%d' % rng.randrange(5), rng.choice(['b%d' % rng.randrange(4), None]))
+        database.create('Person', data)
+        database.create('SortedPerson', data)
+    for index in range(0, 120, 7):
+        database.delete('Person', pk=index)
+        database.delete('SortedPerson', pk=index)
+    for index in (index for index in range(1, 120, 11) if index % 7):
+        database.update('Person', person('n9', 'b9'), pk=index)
+        database.update('SortedPerson', person('n9', 'b9'), pk=index)
+    for limit in (None, 9):
+        scanned = database.read('Person', limit=limit, **kwargs).to_dict()['collection']['items']
+        indexed = database.read('SortedPerson', limit=limit, **kwargs).to_dict()['collection']['items']
+        assert scanned == indexed
+        assert scanned
@@ -0,0 +1,117 @@
+import json
+import os
+import threading
+import pytest
+from tests.models import names, person
+
+
+def journal_lines(database):
+    with open(database.journal_file) as journal:
+        return [json.loads(line) for line in journal]
+
+
+def test_writes_append_to_the_journal(make_flat):
+    database = make_flat(FLAT_DATABASE_JOURNAL=True)
+    with open(database.app.config['FLAT_DATABASE_FILE']) as db_file:
+        snapshot = db_file.read()
+    database.create('Person', person('ada'))
+    database.update('Person', person('ada', 'maths'), pk=0)
+    database.create('Person', person('bob'))
+    database.delete('Person', pk=1)
+    with open(database.app.config['FLAT_DATABASE_FILE']) as db_file:
+        assert db_file.read() == snapshot
+    assert [(record['op'], record['pk']) for record in journal_lines(database)] == \
+        [('set', 0), ('set', 0), ('set', 1), ('delete', 1)]
+
+
+def test_journal_is_replayed_on_load(make_flat):
+    database = make_flat(FLAT_DATABASE_JOURNAL=True)
+    for name in ('ada', 'bob', 'cy'):
+        database.create('Person', person(name))
+    database.update('Person', person('bob', 'builder'), pk=1)
+    database.delete('Person', pk=0)
+    reopened = make_flat(FLAT_DATABASE_JOURNAL=True)
+    assert names(reopened.read('Person')) == ['bob', 'cy']
+    assert reopened.database['Person'][1].bio == 'builder'
+    # keys keep counting from the replayed records
+    assert reopened.create('Person', person('dee')).items[0].href == '/api/person/3'
+
+
+def test_compaction_folds_the_journal_into_the_snapshot(make_flat):
+    database = make_flat(FLAT_DATABASE_JOURNAL=True, FLAT_DATABASE_JOURNAL_MAX_RECORDS=5)
+    for index in range(7):
+        database.create('Person', person('p%d' % index))
+    with open(database.app.config['FLAT_DATABASE_FILE']) as db_file:
+        snapshot = json.load(db_file)
+    assert sorted(key for key in snapshot['Person'] if key != 'next') == ['0', '1', '2', '3', '4']
+    lines = journal_lines(database)
+    assert lines[0] == {'generation': 1}
+    assert [record['pk'] for record in lines[1:]] == [5, 6]
+    assert len(make_flat(FLAT_DATABASE_JOURNAL=True).read('Person').items) == 7
+
+
+def test_explicit_compaction_empties_the_journal(make_flat):
+    database = make_flat(FLAT_DATABASE_JOURNAL=True)
+    database.create('Person', person('ada'))
+    database.compact()
+    assert journal_lines(database) == [{'generation': 1}]
+    assert names(make_flat(FLAT_DATABASE_JOURNAL=True).read('Person')) == ['ada']
+
+
+@pytest.mark.parametrize('durability', ['sync', 'group'])
+def test_compaction_does_not_deadlock_with_writes(make_flat, durability):
+    database = make_flat(FLAT_DATABASE_JOURNAL=True, FLAT_DATABASE_DURABILITY=durability)
+
+    def compact():
+        for index in range(50):
+            database.compact()
+
+    def create():
+        for index in range(200):
+            database.create('Person', person('p%d' % index))
+    threads = [threading.Thread(target=compact, daemon=True), threading.Thread(target=create, daemon=True)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+        assert not thread.is_alive()
+    database.flush()
+    assert len(make_flat(FLAT_DATABASE_JOURNAL=True).read('Person').items) == 200
+
+
+def test_a_torn_last_record_is_ignored(make_flat):
+    database = make_flat(FLAT_DATABASE_JOURNAL=True)
+    database.create('Person', person('ada'))
+    database.create('Person', person('bob'))
+    with open(database.journal_file, 'a') as journal:
+        journal.write('{"op": "set", "model": "Person", "pk": 2, "it')
+    reopened = make_flat(FLAT_DATABASE_JOURNAL=True)
+    assert names(reopened.read('Person')) == ['ada', 'bob']
+    # the torn record is ended before appending after it
+    reopened.create('Person', person('cy'))
+    assert names(make_flat(FLAT_DATABASE_JOURNAL=True).read('Person')) == ['ada', 'bob', 'cy']
+
+
+def test_replaying_records_already_in_the_snapshot_is_harmless(make_flat):
+    database = make_flat(FLAT_DATABASE_JOURNAL=True)
+    database.create('Person', person('ada'))
+    database.create('Person', person('bob'))
+    database.delete('Person', pk=0)
+    with open(database.journal_file) as journal:
+        records = journal.read()
+    database.compact()
+    # as if the process crashed after writing the snapshot, before replacing the journal
+    with open(database.journal_file, 'w') as journal:
+        journal.write(records)
+    reopened = make_flat(FLAT_DATABASE_JOURNAL=True)
+    assert names(reopened.read('Person')) == ['bob']
+    assert reopened.create('Person', person('cy')).items[0].href == '/api/person/2'
+
+
+def test_the_snapshot_is_replaced_atomically(make_flat):
+    database = make_flat()
+    database.create('Person', person('ada'))
+    path = database.app.config['FLAT_DATABASE_FILE']
+    assert not os.path.exists(path + '.tmp')
+    with open(path) as db_file:
+        assert json.load(db_file)['Person']['0']['data'][0] == {'name': 'name', 'value': 'ada'}
@@ -0,0 +1,67 @@
+import pytest
+from collection_json import Template
+from flask_crudsdb.flatfile import FlatDatabase
+from tests.models import Person, names, person
+
+
+def test_keys_are_not_reused_after_a_delete():
+    table = FlatDatabase.AutoKeyDict()
+    for index in range(3):
+        table['next'] = index
+    del table[2]
+    table['next'] = 'new'
+    assert sorted(table) == [0, 1, 3]
+    assert table.get_next() == 4
+    assert table.sorted_keys == [0, 1, 3]
+
+
+def test_explicit_keys_move_the_counter_past_them():
+    table = FlatDatabase.AutoKeyDict()
+    table['7'] = 'seven'
+    table[2] = 'two'
+    assert table.get_next() == 8
+    assert table.sorted_keys == [2, 7]
+    with pytest.raises(TypeError):
+        table['seven'] = 'seven'
+
+
+@pytest.mark.parametrize('store', ['dict', 'packed'])
+@pytest.mark.parametrize('journal', [False, True])
+def test_the_counter_is_persisted(make_flat, store, journal):
+    config = dict(FLAT_DATABASE_JOURNAL=journal, FLAT_DATABASE_RECORD_STORE=store)
+    database = make_flat(**config)
+    for name in ('ada', 'bob', 'cy'):
+        database.create('Person', person(name))
+    database.delete('Person', pk=2)
+    reopened = make_flat(**config)
+    assert reopened.create('Person', person('dee')).items[0].href == '/api/person/3'
+    assert names(reopened.read('Person')) == ['ada', 'bob', 'dee']
+
+
+def test_packed_store_keeps_values_not_instances(make_flat):
+    database = make_flat(FLAT_DATABASE_RECORD_STORE='packed')
+    database.create('Person', person('ada', 'maths'))
+    database.create('Person', person('bob'))
+    table = database.database['Person']
+    assert isinstance(table, FlatDatabase.PackedKeyDict)
+    assert table.data[0] == ('ada', 'maths')
+    assert table.data[1] == ('bob', None)
+    instance = table[0]
+    assert isinstance(instance, Person) and instance.bio == 'maths'
+    database.update('Person', person('ada', 'logic'), pk=0)
+    assert table.data[0] == ('ada', 'logic')
+    assert database.read('Person', 0).items[0].data.find('bio')[0].value == 'logic'
+
+
+def test_packed_records_are_stored_by_column():
+    table = FlatDatabase.PackedKeyDict(Person)
+    for key in ('next', 'next', 5, 3):
+        table[key] = Person(None, Template(person('p%s' % key, None if key == 3 else 'b')))
+    table[1] = Person(None, Template(person('p1', 'c')))
+    del table[0]
+    assert list(table.sorted_keys) == [1, 3, 5] and list(table) == [1, 3, 5] and len(table) == 3
+    assert table.data.columns == [['p1', 'p3', 'p5'], ['c', None, 'b']]
+    assert table.data[3] == ('p3', None) and 0 not in table and 'x' not in table
+    assert table.get_next() == 6
+    with pytest.raises(KeyError):
+        del table[0]
@@ -0,0 +1,93 @@
+import json
+import os
+import pytest
+from flask_crudsdb import DatabaseError
+from flask_crudsdb.flatfile import FlatDatabase, migrate
+from tests.models import Person, names, person
+
+SHARDED = dict(FLAT_DATABASE_LAYOUT='sharded')
+BINARY = dict(SHARDED, FLAT_DATABASE_ENCODING='binary')
+MAPPED = dict(BINARY, FLAT_DATABASE_RECORD_STORE='mapped')
+
+
+class Pet(Person):
+    pass
+
+
+def fill(database):
+    for name in ('ada', 'bob', 'cy'):
+        database.create('Person', person(name, 'x'))
+    database.create('Pet', person('rex'))
+    database.update('Person', person('bob', 1.5), pk=1)
+    database.delete('Person', pk=0)
+
+
+@pytest.mark.parametrize('config', [SHARDED, BINARY, MAPPED], ids=['json', 'binary', 'mapped'])
+def test_models_are_loaded_when_first_used(make_flat, config):
+    fill(make_flat(Person, Pet, **config))
+    database = make_flat(Person, Pet, **config)
+    assert list(dict.keys(database.database)) == []
+    assert names(database.read('Person')) == ['bob', 'cy']
+    assert [item.data.find('bio')[0].value for item in database.read('Person').items] == [1.5, 'x']
+    assert list(dict.keys(database.database)) == ['Person']
+    assert database.create('Person', person('dee')).items[0].href == '/api/person/3'
+    assert names(make_flat(Person, Pet, **config).read('Pet')) == ['rex']
+
+
+def test_one_segment_per_model(make_flat):
+    database = make_flat(Person, Pet, **BINARY)
+    fill(database)
+    path = database.app.config['FLAT_DATABASE_FILE']
+    with open(path) as manifest_file:
+        manifest = json.load(manifest_file)
+    assert manifest['models'] == {
+        'Person': {'segment': 'db.json.Person.seg', 'encoding': 'binary'},
+        'Pet': {'segment': 'db.json.Pet.seg', 'encoding': 'binary'}
+    }
+    assert sorted(os.listdir(os.path.dirname(path))) == ['db.json', 'db.json.Person.seg', 'db.json.Pet.seg']
+
+
+def test_only_changed_segments_are_written(make_flat, monkeypatch):
+    fill(make_flat(Person, Pet, **SHARDED))
+    database = make_flat(Person, Pet, **SHARDED)
+    written = []
+    write_segment = FlatDatabase.write_segment
+    monkeypatch.setattr(FlatDatabase, 'write_segment', classmethod(
+        lambda cls, path, *args: written.append(os.path.basename(path)) or write_segment(path, *args)
+    ))
+    database.create('Pet', person('fido'))
+    assert written == ['db.json.Pet.json']
+
+
+def test_journal_records_of_unloaded_models_are_folded_in(make_flat):
+    config = dict(SHARDED, FLAT_DATABASE_JOURNAL=True)
+    database = make_flat(Person, Pet, **config)
+    database.create('Pet', person('rex'))
+    database.create('Person', person('ada'))
+    database.close()
+    database = make_flat(Person, Pet, **config)
+    database.read('Person')
+    database.compact()
+    assert list(dict.keys(database.database)) == ['Person']
+    assert names(make_flat(Person, Pet, **SHARDED).read('Pet')) == ['rex']
+
+
+def test_mapped_record_store_needs_binary_segments(make_flat):
+    with pytest.raises(DatabaseError):
+        make_flat(FLAT_DATABASE_RECORD_STORE='mapped', **SHARDED)
+
+
+def test_migrate_between_layouts(make_flat, tmp_path):
+    database = make_flat(Person, Pet, FLAT_DATABASE_JOURNAL=True)
+    fill(database)
+    database.close()
+    source = database.app.config['FLAT_DATABASE_FILE']
+    os.makedirs(str(tmp_path / 'sharded'))
+    assert migrate(source, str(tmp_path / 'sharded' / 'db.json'), encoding='binary') == {'Person': 2, 'Pet': 1}
+    assert migrate(str(tmp_path / 'sharded' / 'db.json'), str(tmp_path / 'back.json'), layout='file') == \
+        {'Person': 2, 'Pet': 1}
+    database = make_flat(Person, Pet, FLAT_DATABASE_FILE=str(tmp_path / 'back.json'))
+    assert names(database.read('Person')) == ['bob', 'cy']
+    assert database.create('Person', person('dee')).items[0].href == '/api/person/3'
+    with pytest.raises(DatabaseError):
+        make_flat(FLAT_DATABASE_FILE=str(tmp_path / 'back.json'), **SHARDED)
@@ -0,0 +1,101 @@
+import multiprocessing
+import threading
+import pytest
+from flask import Flask
+from flask_crudsdb import DatabaseError
+from flask_crudsdb.flatfile import FlatDatabase
+from tests.models import Person, SortedPerson, names, person
+
+SHARED = dict(FLAT_DATABASE_SHARED=True)
+
+
+def test_writes_of_one_process_are_read_by_another(make_flat):
+    first, second = make_flat(**SHARED), make_flat(**SHARED)
+    first.create('Person', person('ada'))
+    assert second.create('Person', person('bob')).items[0].href == '/api/person/1'
+    assert names(first.read('Person')) == ['ada', 'bob']
+    second.update('Person', person('ada', 'maths'), pk=0)
+    first.delete('Person', pk=1)
+    assert names(second.read('Person')) == ['ada']
+    assert first.read('Person', pk=0).items[0].data.find('bio')[0].value == 'maths'
+
+
+def test_indexes_follow_other_processes(make_flat):
+    first, second = make_flat(SortedPerson, **SHARED), make_flat(SortedPerson, **SHARED)
+    for name in ('cy', 'ada', 'bob'):
+        first.create('SortedPerson', person(name, 'likes %s' % name))
+    second.read('SortedPerson')
+    first.delete('SortedPerson', pk=1)
+    assert names(second.read('SortedPerson', order_by='name')) == ['bob', 'cy']
+    assert names(second.read('SortedPerson', filter_by={'name': 'bob'})) == ['bob']
+
+
+def test_processes_follow_compactions(make_flat):
+    config = dict(SHARED, FLAT_DATABASE_JOURNAL_MAX_RECORDS=3)
+    first, second = make_flat(**config), make_flat(**config)
+    first.create('Person', person('p0'))
+    assert names(second.read('Person')) == ['p0']
+    for index in range(1, 10):
+        first.create('Person', person('p%d' % index))
+    assert first.generation == 3
+    assert len(second.read('Person').items) == 10
+    assert second.generation == 3
+
+
+def create_people(config, worker):
+    app = Flask(__name__)
+    app.config.update(config)
+    database = FlatDatabase(app)
+    database.add_model(Person)
+    for index in range(20):
+        database.create('Person', person('w%d-%d' % (worker, index)))
+    database.close()
+
+
+def test_no_writes_are_lost_between_processes(make_flat):
+    database = make_flat(FLAT_DATABASE_JOURNAL_MAX_RECORDS=25, **SHARED)
+    context = multiprocessing.get_context('fork')
+    workers = [
+        context.Process(target=create_people, args=(dict(database.app.config), worker)) for worker in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+    hrefs = [item.href for item in database.read('Person').items]
+    assert len(hrefs) == len(set(hrefs)) == 80
+
+
+def test_shared_mode_needs_sync_durability(make_flat):
+    with pytest.raises(DatabaseError):
+        make_flat(FLAT_DATABASE_DURABILITY='group', **SHARED)
+
+
+@pytest.mark.parametrize('config', [{}, SHARED], ids=['private', 'shared'])
+def test_reads_are_not_broken_by_writes_on_other_threads(make_flat, config):
+    database = make_flat(**config)
+    database.bulk_create('Person', [person('p%d' % index, 'likes cats') for index in range(3000)])
+    other = make_flat(**config) if config else database
+    errors = []
+
+    def write(writer):
+        for index in range(30):
+            writer.create('Person', person('new', 'likes cats'))
+
+    def read():
+        try:
+            for index in range(5):
+                assert 3000 <= len(database.read('Person').items) <= 3060
+                assert len(database.read('Person', filter_by={'bio': 'likes cats'}).items) >= 3000
+                assert len(list(database.iter_instances('Person'))) >= 3000
+        except Exception as error:
+            errors.append(error)
+    threads = [threading.Thread(target=write, args=(writer,)) for writer in (database, other)] + \
+        [threading.Thread(target=read) for index in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(database.read('Person').items) == 3060
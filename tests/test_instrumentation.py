@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import pytest
+from werkzeug.exceptions import NotFound
+from flask_crudsdb.flatfile import AsyncFlatDatabase
+from flask_crudsdb.instrumentation import (
+    NULL_INSTRUMENTATION, Histogram, Instrumentation, operation_finished, operation_started
+)
+from tests.models import Person, person
+
+
+def test_histogram():
+    histogram = Histogram((0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+    assert histogram.cumulative() == [(0.1, 2), (1.0, 3), (float('inf'), 4)]
+    assert (histogram.count, histogram.sum) == (4, 2.65)
+
+
+def test_databases_are_not_instrumented_by_default(make_flat):
+    database = make_flat()
+    assert database.instrumentation is NULL_INSTRUMENTATION
+    assert 'create' not in vars(database)
+
+
+def test_operations_and_phases_are_timed(make_flat):
+    database = make_flat()
+    instrumentation = Instrumentation()
+    database.instrument(instrumentation)
+    database.create('Person', person('ada'))
+    database.read('Person')
+    with pytest.raises(NotFound):
+        database.read('Person', pk=7)
+    assert instrumentation.operations[('read', 'Person')].count == 2
+    assert instrumentation.counters == {
+        ('create', 'Person', 'ok'): 1, ('read', 'Person', 'ok'): 1, ('read', 'Person', 'error'): 1
+    }
+    phases = set(phase for operation, model, phase in instrumentation.phases if operation == 'create')
+    assert {'model', 'persist'} <= phases
+    assert instrumentation.phases[('read', 'Person', 'serialize')].count == 1
+
+
+def test_slow_operations_are_logged(make_flat, caplog):
+    database = make_flat()
+    instrumentation = Instrumentation(slow_seconds=0, slow_log_size=2)
+    database.instrument(instrumentation)
+    with caplog.at_level(logging.WARNING, logger='flask_crudsdb.instrumentation'):
+        for name in ('ada', 'bob', 'cat'):
+            database.create('Person', person(name))
+    assert len(instrumentation.slow_operations) == 2
+    assert instrumentation.slow_operations[0]['operation'] == 'create'
+    assert instrumentation.slow_operations[0]['outcome'] == 'ok'
+    assert caplog.text.count('slow create of Person') == 3
+
+
+def test_signals(make_flat):
+    database = make_flat()
+    database.instrument(Instrumentation())
+    events = []
+
+    def started(sender, **kwargs):
+        events.append(('started', sender, kwargs))
+
+    def finished(sender, **kwargs):
+        events.append(('finished', sender, kwargs['operation'], kwargs['model'], kwargs['error']))
+    with operation_started.connected_to(started), operation_finished.connected_to(finished):
+        database.create('Person', person('ada'))
+    assert events == [
+        ('started', database, {'operation': 'create', 'model': 'Person'}),
+        ('finished', database, 'create', 'Person', None)
+    ]
+
+
+def test_prometheus_endpoint(make_flat):
+    database = make_flat(API_INSTRUMENTATION=True, API_METRICS_ENDPOINT='/metrics')
+    database.create('Person', person('a "quoted" name'))
+    database.read('Person')
+    response = database.app.test_client().get('/metrics')
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    assert '# TYPE crudsdb_operation_seconds histogram' in text
+    assert 'crudsdb_operation_seconds_bucket{operation="read",model="Person",le="+Inf"} 1' in text
+    assert 'crudsdb_operation_seconds_count{operation="create",model="Person"} 1' in text
+    assert 'crudsdb_operations_total{operation="create",model="Person",outcome="ok"} 1' in text
+    assert 'crudsdb_phase_seconds_count{operation="read",model="Person",phase="serialize"} 1' in text
+    assert text.endswith('crudsdb_slow_operations 0\n')
+    assert Instrumentation.get_labels(('model',), ('a "b"\n',)) == 'model="a \\"b\\"\\n"'
+
+
+def test_async_operations_are_timed(make_app):
+    database = AsyncFlatDatabase(make_app())
+    database.add_model(Person)
+    instrumentation = Instrumentation()
+    database.instrument(instrumentation)
+
+    async def run():
+        await database.create('Person', person('ada'))
+        await database.read('Person')
+    asyncio.run(run())
+    assert instrumentation.counters == {('create', 'Person', 'ok'): 1, ('read', 'Person', 'ok'): 1}
+    assert instrumentation.phases[('create', 'Person', 'model')].count == 1
+    database.close()
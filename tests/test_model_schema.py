@@ -0,0 +1,108 @@
+import logging
+import pytest
+from collection_json import Template
+from flask_crudsdb import Model, ModelError, TypeEnforcer
+from tests.models import Person, SQLPerson, SQLTag, names, person
+
+
+class Animal(Model):
+    name = None
+    legs = 4
+    owner = TypeEnforcer(str)
+
+    def speak(self):
+        pass
+
+    @property
+    def loud(self):
+        return False
+
+
+class Bird(Animal):
+    legs = 2
+    wings = 2
+    speak = None
+
+
+class Listed(Animal):
+    __fields__ = ['wings', 'name']
+    wings = 2
+
+
+def test_fields_are_collected_in_declaration_order():
+    assert Animal.__schema__.fields == ('name', 'legs', 'owner')
+    assert Animal.__schema__.defaults == {'name': None, 'legs': 4}
+    assert Bird.__schema__.fields == ('name', 'legs', 'owner', 'wings', 'speak')
+    assert Bird.__schema__.defaults['legs'] == 2
+    assert Listed.__schema__.fields == ('wings', 'name')
+    assert SQLPerson.__schema__.fields == ('name', 'bio')
+    assert Person.__schema__.required == ('name',) and Person.__schema__.indexed == ('name', 'bio')
+
+
+def test_update_validates_and_assigns_in_one_pass(caplog):
+    instance = Person(1, Template(person('ada', 'maths')))
+    assert (instance.name, instance.bio) == ('ada', 'maths')
+    with caplog.at_level(logging.WARNING, logger='flask_crudsdb'):
+        unknown = Person.__schema__.update(instance, Template(person('bob') + [{'name': 'age', 'value': 3}]))
+    assert unknown == ['age'] and 'age' in caplog.text
+    assert not hasattr(instance, 'age') and instance.name == 'bob'
+    with pytest.raises(ModelError):
+        Person(2, Template([{'name': 'bio', 'value': 'x'}]))
+
+
+def test_items_and_templates_follow_the_fields():
+    item = Person(1, Template(person('ada'))).get_collection_item()
+    assert item.href == '/api/person/1'
+    assert [(datum.name, datum.value) for datum in item.data] == [('name', 'ada'), ('bio', None)]
+    assert [datum.name for datum in Person.__schema__.get_template().data] == ['name', 'bio']
+
+
+def test_primary_keys_are_not_inferred_fields(make_sql):
+    assert SQLTag.__schema__.fields == ('label', 'weight')
+    assert SQLTag.__schema__.defaults == {}
+    database = make_sql()
+    database.add_model(SQLTag)
+    with database.app.app_context():
+        data = [{'name': 'id', 'value': 7}, {'name': 'label', 'value': 'red'}]
+        created = database.create('SQLTag', data)
+        assert created.items[0].href == '/api/tag/1'
+        assert [datum.name for datum in database.read('SQLTag').template.data] == ['label', 'weight']
+        database.update('SQLTag', data, pk=1)
+        assert database.read('SQLTag', pk=1).items[0].href == '/api/tag/1'
+
+
+class Note(Model):
+    __slots__ = ()
+    text = None
+    size = 0
+
+    def __init__(self, data, *args, **kwargs):
+        self.update(data)
+
+
+def test_slotted_class_stores_fields_in_slots():
+    Slotted = Person.__schema__.slotted_class('pk', 'endpoint')
+    assert Slotted.__name__ == 'Person' and issubclass(Slotted, Person)
+    assert Slotted.__slots__ == ('name', 'bio', 'pk', 'endpoint')
+    instance = Slotted(1, Template(person('ada')))
+    assert (instance.pk, instance.name, instance.bio) == (1, 'ada', None)
+    expected = Person(1, Template(person('ada'))).get_collection_item().to_dict()
+    assert instance.get_collection_item().to_dict() == expected
+    # Person does not declare __slots__, so its instances keep a __dict__
+    assert hasattr(instance, '__dict__')
+
+
+def test_slotted_class_has_no_instance_dict():
+    instance = Note.__schema__.slotted_class()(Template([{'name': 'text', 'value': 'hi'}]))
+    assert not hasattr(instance, '__dict__')
+    assert (instance.text, instance.size) == ('hi', 0)
+    with pytest.raises(AttributeError):
+        instance.other = 1
+
+
+def test_slotted_class_in_a_database(make_flat):
+    database = make_flat(Person.__schema__.slotted_class('pk', 'endpoint'))
+    database.create('Person', person('ada'))
+    database.update('Person', person('bob', 'birds'), pk=0)
+    assert names(database.read('Person')) == ['bob']
+    assert names(database.search('Person', 'birds')) == ['bob']
@@ -0,0 +1,159 @@
+import datetime
+import decimal
+import uuid
+from urllib.parse import parse_qs, urlsplit
+import pytest
+from sqlalchemy import event
+from werkzeug.exceptions import BadRequest
+from flask_crudsdb import Database
+from tests.models import names, person
+
+NAMES = ['d', 'b', 'a', 'c', 'e', 'b', 'f', 'g']
+
+
+@pytest.fixture(params=['flat', 'sql'])
+def database(request, make_flat, make_sql):
+    database = make_flat() if request.param == 'flat' else make_sql()
+    model = 'Person' if request.param == 'flat' else 'SQLPerson'
+    with database.app.app_context():
+        for name in NAMES:
+            database.create(model, person(name))
+        yield database, model
+
+
+def link_args(collection, rel):
+    links = [link.href for link in collection.links or [] if link.rel == rel]
+    if not links:
+        return None
+    return dict((key, values[0]) for key, values in parse_qs(urlsplit(links[0]).query).items())
+
+
+def walk(database, model, **kwargs):
+    """Page forward through a listing, then back from its last page, by following links."""
+    pages = [database.read(model, limit=3, **kwargs)]
+    while link_args(pages[-1], 'next') is not None:
+        pages.append(database.read(model, **dict(kwargs, **link_args(pages[-1], 'next'))))
+    backwards = [pages[-1]]
+    while link_args(backwards[-1], 'prev') is not None:
+        backwards.append(database.read(model, **dict(kwargs, **link_args(backwards[-1], 'prev'))))
+    return [names(page) for page in pages], [names(page) for page in reversed(backwards)]
+
+
+def test_pages_by_primary_key(database):
+    pages, backwards = walk(*database)
+    assert pages == [['d', 'b', 'a'], ['c', 'e', 'b'], ['f', 'g']]
+    assert backwards == pages
+
+
+def test_pages_by_order_by(database):
+    pages, backwards = walk(*database, order_by='name')
+    assert pages == [['a', 'b', 'b'], ['c', 'd', 'e'], ['f', 'g']]
+    assert backwards == pages
+
+
+def test_pages_filtered(database):
+    pages, backwards = walk(*database, filter_by={'name': 'b'})
+    assert pages == [['b', 'b']]
+
+
+def test_after(database):
+    database, model = database
+    first = 1 if model == 'SQLPerson' else 0
+    assert names(database.read(model, limit=2, after=first + 4)) == ['b', 'f']
+    assert names(database.read(model, limit=2, after=first, order_by='name')) == ['e', 'f']
+
+
+def test_deletes_between_pages_do_not_skip_items(database):
+    database, model = database
+    page = database.read(model, limit=3)
+    database.delete(model, pk=int(page.items[-1].href.rsplit('/', 1)[1]))
+    assert names(database.read(model, **link_args(page, 'next'))) == ['c', 'e', 'b']
+
+
+def test_limits(database):
+    database, model = database
+    database.app.config.update(API_PAGE_LIMIT=2, API_MAX_PAGE_LIMIT=4)
+    assert len(database.read(model).items) == 2
+    assert len(database.read(model, limit=100).items) == 4
+    for limit in (0, 'x'):
+        with pytest.raises(BadRequest):
+            database.read(model, limit=limit)
+    with pytest.raises(BadRequest):
+        database.read(model, limit=2, cursor='not a cursor')
+
+
+def test_links_without_api_root(database):
+    database, model = database
+    database.app.config.pop('API_ROOT')
+    page = database.read(model, limit=3)
+    assert link_args(page, 'next')['limit'] == '3'
+    assert [link.href for link in page.links][0].startswith('?')
+
+
+def test_links_in_a_request_reuse_its_url(database):
+    database, model = database
+    with database.app.test_request_context('/api/people?limit=3&after=1&x=y'):
+        href = [link.href for link in database.read(model, limit=3).links][0]
+    assert href.startswith('http://localhost/api/people?')
+    args = parse_qs(urlsplit(href).query)
+    assert 'after' not in args and args['x'] == ['y']
+
+
+@pytest.mark.parametrize('value', [
+    datetime.datetime(2024, 5, 1, 12, 30, 15, 250), datetime.date(2024, 5, 1), datetime.time(12, 30),
+    datetime.timedelta(hours=1, seconds=2), decimal.Decimal('1.10'), uuid.UUID(int=7), b'\x00\xff', 'text', 3,
+    2.5, None, True
+])
+def test_cursor_values_keep_their_type(value):
+    keys, direction = Database.decode_cursor(Database.encode_cursor([value, 1], 'prev'))
+    assert keys == [value, 1] and type(keys[0]) is type(value)
+    assert direction == 'prev'
+
+
+def test_malformed_typed_cursor_values():
+    for value in ({'$type': 'date', 'value': 'yesterday'}, {'$type': 'date', 'value': 3},
+                  {'$type': 'nope', 'value': 1}, {'$type': 'decimal', 'value': 'one'}):
+        cursor = Database.encode_cursor([value])
+        with pytest.raises(ValueError):
+            Database.decode_cursor(cursor)
+
+
+def test_pages_by_a_datetime_column(make_sql):
+    database = make_sql()
+    start = datetime.datetime(2024, 1, 1, 9, 0)
+    with database.app.app_context():
+        for index, hours in enumerate([5, 1, 3, 2, 4, 0, 6]):
+            database.create('SQLEvent', [
+                {'name': 'title', 'value': 'event %d' % index},
+                {'name': 'starts', 'value': start + datetime.timedelta(hours=hours, microseconds=index)}
+            ])
+        seen = []
+        page = database.read('SQLEvent', limit=2, order_by='starts')
+        while True:
+            seen.append([item.href for item in page.items])
+            args = link_args(page, 'next')
+            if args is None:
+                break
+            page = database.read('SQLEvent', **args)
+        assert seen == [
+            ['/api/event/6', '/api/event/2'], ['/api/event/4', '/api/event/3'], ['/api/event/5', '/api/event/1'],
+            ['/api/event/7']
+        ]
+        back = database.read('SQLEvent', **link_args(page, 'prev'))
+        assert [item.href for item in back.items] == ['/api/event/5', '/api/event/1']
+
+
+def test_after_from_a_query_string(make_sql):
+    database = make_sql()
+    parameters = []
+    with database.app.app_context():
+        for name in NAMES:
+            database.create('SQLPerson', person(name))
+        listener = lambda connection, cursor, statement, values, context, executemany: parameters.append(values)
+        event.listen(database.database, 'before_cursor_execute', listener)
+        try:
+            assert names(database.read('SQLPerson', limit=2, after='5')) == ['b', 'f']
+            assert names(database.read('SQLPerson', limit=2, after='1', order_by='name')) == ['e', 'f']
+        finally:
+            event.remove(database.database, 'before_cursor_execute', listener)
+    assert '5' not in parameters[0] and 5 in parameters[0]
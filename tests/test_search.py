@@ -0,0 +1,151 @@
+import threading
+import time
+import pytest
+from werkzeug.exceptions import NotImplemented
+from whoosh.index import LockError
+from flask_crudsdb.search import SearchIndex
+from tests.models import names, person
+
+BIOS = ['likes cats', 'likes dogs', 'hates cats', 'cats and dogs', 'fish']
+
+
+@pytest.fixture(params=['flat', 'sql'])
+def database(request, tmp_path, make_flat, make_sql):
+    config = dict(WHOOSH_INDEX_DIR=str(tmp_path / 'index'), WHOOSH_COMMIT_PERIOD=60)
+    database = make_flat(**config) if request.param == 'flat' else make_sql(**config)
+    model = 'Person' if request.param == 'flat' else 'SQLPerson'
+    with database.app.app_context():
+        for index, bio in enumerate(BIOS):
+            database.create(model, person('p%d' % index, bio))
+        yield database, model
+    database.search_index.close()
+
+
+def bios(collection):
+    return sorted(item.data.find('bio')[0].value for item in collection.items)
+
+
+def test_search_is_ranked_and_paged(database):
+    database, model = database
+    database.search_index.flush()
+    first = database.search(model, 'cats', pagelen=2)
+    second = database.search(model, 'cats', page=2, pagelen=2)
+    assert len(first.items) == 2 and len(second.items) == 1
+    assert sorted(bios(first) + bios(second)) == ['cats and dogs', 'hates cats', 'likes cats']
+    assert [link.rel for link in first.links] == ['next']
+    assert [link.rel for link in second.links] == ['prev']
+
+
+def test_search_by_field(database):
+    database, model = database
+    database.search_index.flush()
+    assert bios(database.search(model, [{'name': 'bio', 'value': 'dogs'}])) == ['cats and dogs', 'likes dogs']
+    assert names(database.search(model, {'name': 'p4'})) == ['p4']
+    with pytest.raises(Exception) as error:
+        database.search(model, {'nope': 'x'})
+    assert error.value.code == 400
+
+
+def test_changes_are_indexed_incrementally(database):
+    database, model = database
+    first = 1 if model == 'SQLPerson' else 0
+    database.search_index.flush()
+    database.update(model, person('p4', 'fish and cats'), pk=first + 4)
+    database.delete(model, pk=first + 2)
+    # queued, not committed yet
+    assert 'fish and cats' not in bios(database.search(model, 'cats'))
+    database.search_index.flush()
+    assert bios(database.search(model, 'cats')) == ['cats and dogs', 'fish and cats', 'likes cats']
+    assert len(database.search(model, 'hates').items) == 0
+
+
+def test_changes_through_string_primary_keys_replace_their_documents(make_sql, tmp_path):
+    database = make_sql(WHOOSH_INDEX_DIR=str(tmp_path / 'index'), WHOOSH_COMMIT_PERIOD=60)
+    model_class = database.models['SQLPerson']
+    with database.app.app_context():
+        for index, bio in enumerate(BIOS):
+            database.create('SQLPerson', person('p%d' % index, bio))
+        # primary keys arrive from urls and json object keys as strings
+        database.update('SQLPerson', person('p4', 'fish and cats'), pk='5')
+        database.bulk_update('SQLPerson', {'4': person('p3', 'cats only')})
+        database.delete('SQLPerson', pk='3')
+        database.bulk_delete('SQLPerson', ['1'])
+        database.search_index.flush()
+        assert bios(database.search('SQLPerson', 'cats')) == ['cats only', 'fish and cats']
+    assert database.search_index.search(model_class, 'fish') == ([5], 1)
+    assert database.search_index.search(model_class, 'hates') == ([], 0)
+    database.search_index.close()
+
+
+def test_writes_do_not_wait_for_commits(database):
+    database, model = database
+    index = database.search_index
+    # hold the commit lock, as a slow commit would
+    with index.commit_lock:
+        done = threading.Event()
+
+        def write():
+            with database.app.app_context():
+                database.create(model, person('p5', 'cats'))
+            done.set()
+        threading.Thread(target=write).start()
+        assert done.wait(5)
+    index.flush()
+    assert 'p5' in names(database.search(model, 'cats'))
+
+
+def test_changes_are_kept_while_another_writer_holds_the_index(database):
+    database, model = database
+    index = database.search_index
+    index.flush()
+    other = SearchIndex(database.app).get_index(database.models[model]).writer()
+    try:
+        database.create(model, person('p5', 'yak'))
+        created = database.create(model, person('p6', 'emu'))
+        with pytest.raises(LockError):
+            index.flush()
+        # newer than the change that failed to commit
+        database.update(model, person('p6', 'emu and owls'), pk=int(created.items[0].href.rsplit('/', 1)[1]))
+    finally:
+        other.cancel()
+    index.flush()
+    assert index.pending == {}
+    assert bios(database.search(model, 'yak')) == ['yak']
+    assert bios(database.search(model, 'emu')) == ['emu and owls']
+
+
+def test_the_committer_wakes_at_the_limit(database):
+    database, model = database
+    index = database.search_index
+    index.limit = 3
+    index.flush()
+    for number in range(5, 8):
+        database.create(model, person('p%d' % number, 'birds'))
+    deadline = time.time() + 10
+    while len(database.search(model, 'birds').items) < 3 and time.time() < deadline:
+        time.sleep(0.05)
+    assert len(database.search(model, 'birds').items) == 3
+    assert index.committer.is_alive()
+
+
+def test_reindex(database):
+    database, model = database
+    database.search_index.flush()
+    assert database.reindex(model) == 5
+    assert bios(database.search(model, 'dogs')) == ['cats and dogs', 'likes dogs']
+    result = database.app.test_cli_runner().invoke(args=['crudsdb-reindex', model])
+    assert result.output == '{model}: 5 instances indexed\n'.format(model=model)
+
+
+def test_close_commits_queued_changes(database):
+    database, model = database
+    database.create(model, person('p5', 'owls'))
+    database.search_index.close()
+    assert names(database.search(model, 'owls')) == ['p5']
+
+
+def test_search_needs_an_index(make_sql):
+    database = make_sql()
+    with database.app.app_context():
+        with pytest.raises(NotImplemented):
+            database.search('SQLPerson', 'cats')
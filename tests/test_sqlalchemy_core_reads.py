@@ -0,0 +1,67 @@
+import datetime
+from urllib.parse import parse_qs, urlsplit
+import pytest
+from sqlalchemy import event
+from flask_crudsdb import DatabaseError
+from tests.models import SQLPerson, person
+
+NAMES = ['d', 'b', 'a', 'c', 'e', 'b']
+
+
+@pytest.fixture
+def database(make_sql):
+    database = make_sql()
+    with database.app.app_context():
+        database.bulk_create('SQLPerson', [person(name, 'bio of %s' % name) for name in NAMES])
+        database.create('SQLEvent', [
+            {'name': 'title', 'value': 'launch'}, {'name': 'starts', 'value': datetime.datetime(2020, 1, 2, 3, 4)}
+        ])
+        database.session.expunge_all()
+        yield database
+
+
+def get_cursor(collection, rel):
+    for link in collection.links or ():
+        if link.rel == rel:
+            return parse_qs(urlsplit(link.href).query)['cursor'][0]
+
+
+@pytest.mark.parametrize('kwargs', [
+    {}, {'order_by': 'name'}, {'filter_by': {'name': 'b'}}, {'limit': 2}, {'limit': 2, 'order_by': 'name'},
+    {'after': 3}, {'after': 3, 'order_by': 'name'}
+])
+def test_core_listings_match_orm_listings(database, kwargs):
+    orm = database.read('SQLPerson', read_mode='orm', **kwargs)
+    core = database.read('SQLPerson', read_mode='core', **kwargs)
+    assert core.to_dict() == orm.to_dict()
+    cursor = get_cursor(core, 'next')
+    if cursor is not None:
+        kwargs = dict(kwargs, cursor=cursor)
+        assert database.read('SQLPerson', read_mode='core', **kwargs).to_dict() == \
+            database.read('SQLPerson', read_mode='orm', **kwargs).to_dict()
+
+
+def test_core_streams_match_orm_streams(database):
+    assert ''.join(database.read('SQLPerson', stream=True, read_mode='core', order_by='name')) == \
+        ''.join(database.read('SQLPerson', stream=True, read_mode='orm', order_by='name'))
+    assert database.read('SQLEvent', read_mode='core').to_dict() == database.read('SQLEvent').to_dict()
+
+
+def test_core_reads_do_not_load_instances(database):
+    loaded = []
+    listener = lambda instance, context: loaded.append(instance.id)
+    event.listen(SQLPerson, 'load', listener)
+    try:
+        database.read('SQLPerson', read_mode='core', limit=2)
+        database.read('SQLPerson', read_mode='core')
+        assert loaded == []
+        database.read('SQLPerson', read_mode='orm')
+        assert len(loaded) == len(NAMES)
+    finally:
+        event.remove(SQLPerson, 'load', listener)
+
+
+def test_read_mode_is_configurable(make_sql):
+    assert make_sql(SQLALCHEMY_READ_MODE='core').read_mode == 'core'
+    with pytest.raises(DatabaseError):
+        make_sql(SQLALCHEMY_READ_MODE='raw')
@@ -0,0 +1,98 @@
+import logging
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from flask_crudsdb import DatabaseError
+from flask_crudsdb.sqlalchemy import ReplicaPool, SQLAlchemyModel
+from tests.models import SQLPerson, names, person
+
+
+@pytest.fixture
+def replicated(make_sql, tmp_path):
+    """Make a SQLAlchemyDatabase with two replicas, each holding one person named after it."""
+    def replicated(**config):
+        uris = []
+        for name in ('one', 'two'):
+            uri = 'sqlite:///' + str(tmp_path / (name + '.sqlite'))
+            engine = create_engine(uri)
+            SQLAlchemyModel.metadata.create_all(engine)
+            with engine.begin() as connection:
+                connection.execute(SQLPerson.__table__.delete())
+                connection.execute(SQLPerson.__table__.insert().values(name=name))
+            engine.dispose()
+            uris.append(uri)
+        return make_sql(SQLALCHEMY_REPLICA_URIS=uris, **config)
+    return replicated
+
+
+def test_replicas_take_turns_by_app_context(replicated):
+    database = replicated()
+    served = []
+    for attempt in range(3):
+        with database.app.app_context():
+            served.append(names(database.read('SQLPerson')))
+            assert names(database.read('SQLPerson')) == served[-1]
+    assert served == [['one'], ['two'], ['one']]
+    assert [replica['active'] for replica in database.replicas.stats] == [0, 0]
+
+
+def test_writes_go_to_the_primary_and_are_read_back(replicated):
+    database = replicated()
+    with database.app.app_context():
+        assert names(database.read('SQLPerson')) == ['one']
+        database.create('SQLPerson', person('ada'))
+        assert names(database.read('SQLPerson')) == ['ada']
+    with database.app.app_context():
+        assert names(database.read('SQLPerson')) == ['two']
+
+
+def test_read_your_writes_can_be_disabled(replicated):
+    database = replicated(SQLALCHEMY_READ_YOUR_WRITES=False)
+    with database.app.app_context():
+        database.create('SQLPerson', person('ada'))
+        assert names(database.read('SQLPerson')) == ['one']
+
+
+def unreachable(database, index, tmp_path):
+    """Point a replica at a database file that cannot be opened."""
+    database.replicas.engines[index] = create_engine('sqlite:///' + str(tmp_path / 'missing' / 'replica.sqlite'))
+    database.replicas.session_factories[index] = sessionmaker(bind=database.replicas.engines[index])
+
+
+def test_unreachable_replicas_are_ejected(replicated, tmp_path, caplog):
+    database = replicated(SQLALCHEMY_REPLICA_EJECT_SECONDS=60)
+    unreachable(database, 0, tmp_path)
+    with caplog.at_level(logging.WARNING, logger='flask_crudsdb.sqlalchemy'):
+        for attempt in range(2):
+            with database.app.app_context():
+                assert names(database.read('SQLPerson')) == ['two']
+    assert 'Ejecting read replica' in caplog.text
+    assert [replica['ejected'] for replica in database.replicas.stats] == [True, False]
+    unreachable(database, 1, tmp_path)
+    with database.app.app_context():
+        database.create('SQLPerson', person('primary'))
+    with database.app.app_context():
+        assert names(database.read('SQLPerson')) == ['primary']
+
+
+def test_query_errors_do_not_eject_replicas(replicated):
+    database = replicated()
+    with database.replicas.engines[0].begin() as connection:
+        connection.exec_driver_sql('DROP TABLE person')
+    with database.app.app_context():
+        with pytest.raises(OperationalError):
+            database.read('SQLPerson')
+    assert [replica['ejected'] for replica in database.replicas.stats] == [False, False]
+    with database.app.app_context():
+        assert names(database.read('SQLPerson')) == ['two']
+
+
+def test_least_connections_balancing():
+    pool = ReplicaPool([create_engine('sqlite://'), create_engine('sqlite://')], balancing='least_connections')
+    first, second = pool.acquire(), pool.acquire()
+    assert (first, second) == (0, 1)
+    pool.release(first)
+    assert pool.acquire() == 0
+    with pytest.raises(DatabaseError):
+        ReplicaPool([], balancing='random')
@@ -0,0 +1,74 @@
+import pytest
+from collection_json import Template
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import QueuePool
+from flask_crudsdb.sqlalchemy import SQLAlchemyDatabase
+from tests.models import names, person
+
+
+def test_engine_options_come_from_the_config(make_app):
+    app = make_app(
+        SQLALCHEMY_POOL_SIZE=3, SQLALCHEMY_MAX_OVERFLOW=1, SQLALCHEMY_POOL_RECYCLE=60, SQLALCHEMY_POOL_PRE_PING=True,
+        SQLALCHEMY_ENGINE_OPTIONS={'poolclass': QueuePool, 'pool_size': 5}
+    )
+    assert SQLAlchemyDatabase.get_engine_options(app) == {
+        'poolclass': QueuePool, 'pool_size': 5, 'max_overflow': 1, 'pool_recycle': 60, 'pool_pre_ping': True
+    }
+    database = SQLAlchemyDatabase(app)
+    assert database.database.pool.size() == 5
+    assert database.database.pool._recycle == 60
+    database.database.dispose()
+
+
+def test_unset_pool_options_are_not_passed(make_app):
+    assert SQLAlchemyDatabase.get_engine_options(make_app()) == {}
+
+
+def test_one_session_per_app_context(make_sql):
+    database = make_sql()
+    with database.app.app_context():
+        session = database.session
+        database.create('SQLPerson', person('ada'))
+        database.update('SQLPerson', person('ada', 'maths'), pk=1)
+        assert names(database.read('SQLPerson')) == ['ada']
+        database.delete('SQLPerson', pk=1)
+        assert database.session is session
+    with database.app.app_context():
+        assert database.session is not session
+
+
+def test_the_session_is_closed_on_teardown(make_sql):
+    database = make_sql()
+    with database.app.app_context():
+        database.create('SQLPerson', person('ada'))
+        session = database.session
+        instance = session.query(database.models['SQLPerson']).get(1)
+        assert instance in session
+    assert instance not in session
+    assert not session.in_transaction()
+
+
+def test_uncommitted_changes_are_rolled_back_on_error(make_sql):
+    database = make_sql()
+    try:
+        with database.app.app_context():
+            database.session.add(database.models['SQLPerson'](Template(person('ghost'))))
+            database.session.flush()
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    with database.app.app_context():
+        assert len(database.read('SQLPerson').items) == 0
+
+
+def test_a_failed_commit_does_not_break_the_session(make_sql):
+    database = make_sql()
+    with database.app.app_context():
+        database.create('SQLPerson', person('ada'))
+        duplicate = database.models['SQLPerson'](Template(person('ghost')))
+        duplicate.id = 1
+        database.session.add(duplicate)
+        with pytest.raises(IntegrityError):
+            database.commit()
+        database.create('SQLPerson', person('bob'))
+        assert names(database.read('SQLPerson')) == ['ada', 'bob']
@@ -0,0 +1,67 @@
+import json
+import pytest
+from flask import Response
+from tests.models import person
+
+
+@pytest.fixture(params=['flat', 'sql'])
+def database(request, make_flat, make_sql):
+    config = dict(API_STREAM_CHUNK_SIZE=200, SQLALCHEMY_STREAM_BATCH=7)
+    database = make_flat(**config) if request.param == 'flat' else make_sql(**config)
+    model = 'Person' if request.param == 'flat' else 'SQLPerson'
+    with database.app.app_context():
+        for index in range(50):
+            database.create(model, person('p%02d' % index))
+        yield database, model
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'limit': 5, 'order_by': 'name'}, {'filter_by': {'name': 'p07'}}])
+def test_stream_matches_the_collection(database, kwargs):
+    database, model = database
+    chunks = list(database.read(model, stream=True, **kwargs))
+    assert all(isinstance(chunk, str) for chunk in chunks)
+    streamed = json.loads(''.join(chunks))
+    assert streamed == json.loads(json.dumps(database.read(model, **kwargs).to_dict()))
+
+
+def test_stream_is_written_in_chunks(database):
+    database, model = database
+    stream = database.read(model, stream=True)
+    first = next(stream)
+    assert first.startswith('{"collection": {"version": "1.0", "href": "/api/", "items": [')
+    assert 200 <= len(first) < 400
+    rest = list(stream)
+    assert len(rest) > 5
+    assert len(json.loads(first + ''.join(rest))['collection']['items']) == 50
+
+
+def test_stream_as_a_flask_response(database):
+    database, model = database
+
+    @database.app.route('/people')
+    def people():
+        return Response(database.read(model, stream=True), mimetype='application/vnd.collection+json')
+
+    response = database.app.test_client().get('/people')
+    assert response.is_streamed
+    assert len(json.loads(response.data)['collection']['items']) == 50
+
+
+def test_stream_errors_are_raised_by_read(database):
+    database, model = database
+    with pytest.raises(Exception) as error:
+        database.read(model, limit=0, stream=True)
+    assert getattr(error.value, 'code', None) == 400
+
+
+def test_flat_stream_follows_changes_made_while_streaming(make_flat):
+    database = make_flat(API_STREAM_CHUNK_SIZE=1)
+    for index in range(3):
+        database.create('Person', person('p%d' % index))
+    stream = database.read('Person', stream=True)
+    chunks = [next(stream)]
+    database.delete('Person', pk=2)
+    database.create('Person', person('p3'))
+    chunks.extend(stream)
+    items = json.loads(''.join(chunks))['collection']['items']
+    assert [item['data'][0]['value'] for item in items] == ['p0', 'p1', 'p3']
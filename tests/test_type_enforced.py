@@ -0,0 +1,98 @@
+import pytest
+from flask import Flask
+from flask_crudsdb import Database, DuckTypeEnforcer, Model, TypeEnforced, TypeEnforcer
+
+
+class Base(TypeEnforced):
+    name = TypeEnforcer(str)
+    items = DuckTypeEnforcer('__getitem__', '__len__')
+
+
+class Derived(Base):
+    name = TypeEnforcer(int)
+    items = None
+
+
+def test_enforcers_are_compiled_per_class():
+    assert Base.__enforcers__ == {'name': str, 'items': DuckTypeEnforcer('__getitem__', '__len__')}
+    assert Derived.__enforcers__ == {'name': int}
+
+
+def test_assignments_are_checked():
+    instance = Base()
+    instance.name = 'ada'
+    instance.items = [1]
+    instance.other = object()
+    with pytest.raises(TypeError, match='name must be of type str'):
+        instance.name = 1
+    with pytest.raises(TypeError, match='items must have attribute __getitem__'):
+        instance.items = iter([1])
+    derived = Derived()
+    derived.name = 1
+    derived.items = iter([1])
+    with pytest.raises(TypeError):
+        derived.name = 'ada'
+
+
+def test_compile_enforcers_picks_up_new_enforcers():
+    class Late(TypeEnforced):
+        pass
+    Late.size = TypeEnforcer(int)
+    Late().size = 'big'
+    Late.compile_enforcers()
+    with pytest.raises(TypeError):
+        Late().size = 'big'
+
+
+def test_enforcement_can_be_turned_off():
+    class Trusted(Base):
+        pass
+
+    class Checked(Trusted):
+        pass
+    Trusted.enforce_types(False)
+    Trusted().name = 1
+    Checked().name = 1
+    Base().name = 'ada'
+    with pytest.raises(TypeError):
+        Base().name = 1
+    Trusted.enforce_types()
+    with pytest.raises(TypeError):
+        Trusted().name = 1
+    with pytest.raises(TypeError):
+        Checked().name = 1
+
+
+def test_untrusting_an_app_only_affects_its_models():
+    class TrustedModel(Model):
+        name = TypeEnforcer(str)
+
+    class CheckedModel(Model):
+        name = TypeEnforcer(str)
+    app = Flask(__name__)
+    app.config['API_ENFORCE_TYPES'] = False
+    Database(app).add_model(TrustedModel)
+    Database(Flask(__name__)).add_model(CheckedModel)
+    try:
+        TrustedModel.__new__(TrustedModel).name = 1
+        with pytest.raises(TypeError):
+            CheckedModel.__new__(CheckedModel).name = 1
+        assert Model.__setattr__ is TypeEnforced.__setattr__
+    finally:
+        TrustedModel.enforce_types()
+
+
+def test_type_enforcer_is_immutable():
+    with pytest.raises(TypeError):
+        TypeEnforcer('str')
+    with pytest.raises(NotImplementedError):
+        TypeEnforcer(str).type = int
+
+
+def test_databases_enforce_their_attributes(make_flat):
+    database = make_flat()
+    with pytest.raises(TypeError):
+        database.app = object()
+    with pytest.raises(TypeError):
+        database.models = 1
+    database.app = Flask(__name__)